@@ -9,24 +9,79 @@ import os
 import sys
 import argparse
 import numpy as np
-import SimpleITK as sitk
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
 from modMisc.colours import Colours
-from modBiomech.calc_coord_systems import (
-    calculate_mc1_scs,
-    calculate_trp_scs,
-    transform_point,
-)
+from modMisc.cohort import read_cohort
+from modMisc.scan_layout import get_layout
+from modMisc.table_writer import TableWriter, table_formats
+from modBiomech.joint_motion import joint_motion_batch, transform_points_batch
+from modImgProc.transform_store import transform_store
 
 # Global variable for debugging
 debug = False
 
+# Raters whose points are processed for each scan
+rater_list = ["JJT", "TB", "MTK001", "MTK002", "MTK003"]
+header_arr = np.array(
+    [
+        [
+            "Frame",
+            "JJT_AbAd",
+            "JJT_FlexExt",
+            "JJT_Rot",
+            "JJT_X",
+            "JJT_Y",
+            "JJT_Z",
+            "TB_AbAd",
+            "TB_FlexExt",
+            "TB_Rot",
+            "TB_X",
+            "TB_Y",
+            "TB_Z",
+            "MTK_001_AbAd",
+            "MTK_001_FlexExt",
+            "MTK_001_Rot",
+            "MTK_001_X",
+            "MTK_001_Y",
+            "MTK_001_Z",
+            "MTK_002_AbAd",
+            "MTK_002_FlexExt",
+            "MTK_002_Rot",
+            "MTK_002_X",
+            "MTK_002_Y",
+            "MTK_002_Z",
+            "MTK_003_AbAd",
+            "MTK_003_FlexExt",
+            "MTK_003_Rot",
+            "MTK_003_X",
+            "MTK_003_Y",
+            "MTK_003_Z",
+        ]
+    ],
+    dtype=object,
+)
 
-def main(rater, next_scan):
+# Columns of the long-format table written by compute_cohort
+long_columns = [
+    "scan",
+    "series",
+    "rater",
+    "frame",
+    "ab_ad",
+    "flex_ext",
+    "ax_rot",
+    "t_x",
+    "t_y",
+    "t_z",
+]
+
+
+def main(rater, next_scan, series=None, parent_dir=None, layout_path=None):
     """
-    Main function to compute joint angles and translations. Directory structure is
-    assumed to follow a specific format to automate setup of files/folders used
-    in the computation of joint motion.
+    Main function to compute joint angles and translations. The points,
+    registration, and model directories of the scan are resolved from the scan
+    layout (see modMisc/scan_layout.yml).
 
     Parameters
     ----------
@@ -36,61 +91,56 @@ def main(rater, next_scan):
     next_scan : string
         String containing the next directory to process
 
+    series : string
+        DYNACT series (B, C, or D) used for the scan. If None, the series is
+        taken from the layout file or the registration directories of the scan.
+
+    parent_dir : string
+        Directory with the points, reg, and models directories. Defaults to the
+        parent of the scripts directory.
+
+    layout_path : string
+        Scan layout file. Uses the default layout if None.
+
     Returns
     -------
-    arr : list
-        A list containing the rotations and translations computed for the specified
-        rater and scan
+    arr : numpy.array
+        (F, 6) array (one row per DYNACT frame) containing the rotations and
+        translations computed for the specified rater and scan
     """
     # -------------------------------------------------------#
     #   Step 1: Setup inputs                                #
     # -------------------------------------------------------#
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    point_dir = os.path.join(parent_dir, "points")
-    point_dir = os.path.join(point_dir, "points_July2021")
-    reg_dir = os.path.join(parent_dir, "reg")
-    model_dir = os.path.join(parent_dir, "models")
+    if parent_dir is None:
+        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    layout = get_layout(parent_dir, layout_path)
 
-    # HR-pQCT directories:
-    xct_pnts_dir = os.path.join(point_dir, os.path.join(next_scan, "HR-pQCT"))
-    ct2xct_reg_dir = os.path.join(
-        reg_dir, os.path.join(next_scan, "staticCT_to_HR-pQCT")
-    )
-    xct_model_dir = os.path.join(model_dir, os.path.join(next_scan, "HR-pQCT"))
+    if series is None:
+        series = layout.series(next_scan)
 
-    # Static and Dynamic CT directories:
-    ct_pnts_dir = os.path.join(point_dir, os.path.join(next_scan, "staticCT"))
-    ct2dynact_reg_dir = os.path.join(
-        reg_dir, os.path.join(next_scan, "staticCT_to_dynamicCT/B")
-    )
+    scan_fields = {"scan": next_scan, "series": series}
 
-    dynact_pnts_dir = os.path.join(point_dir, os.path.join(next_scan, "dynamicCT"))
-    dynact_reg_dir = os.path.join(
-        reg_dir, os.path.join(next_scan, "dynamicCT_frames/B/FinalTFMs")
-    )
+    # HR-pQCT directories:
+    xct_pnts_dir = layout.path("xct_pnts_dir", **scan_fields)
+    ct2xct_reg_dir = layout.path("ct2xct_reg_dir", **scan_fields)
+    xct_model_dir = layout.path("xct_model_dir", **scan_fields)
 
-    if "3" in next_scan or "5" in next_scan or "7" in next_scan or "9" in next_scan:
-        ct2dynact_reg_dir = os.path.join(
-            reg_dir, os.path.join(next_scan, "staticCT_to_dynamicCT/C")
-        )
-        dynact_reg_dir = os.path.join(
-            reg_dir, os.path.join(next_scan, "dynamicCT_frames/C/FinalTFMs")
-        )
+    # Static and Dynamic CT directories:
+    ct_pnts_dir = layout.path("ct_pnts_dir", **scan_fields)
+    ct2dynact_reg_dir = layout.path("ct2dynact_reg_dir", **scan_fields)
+    ct_model_dir = layout.path("ct_model_dir", **scan_fields)
 
-    ct_model_dir = os.path.join(model_dir, os.path.join(next_scan, "staticCT"))
-    dynact_model_dir = os.path.join(model_dir, os.path.join(next_scan, "dynamicCT"))
+    dynact_pnts_dir = layout.path("dynact_pnts_dir", **scan_fields)
+    dynact_reg_dir = layout.path("dynact_reg_dir", **scan_fields)
+    dynact_model_dir = layout.path("dynact_model_dir", **scan_fields)
 
     # -------------------------------------------------------#
     #   Step 2: Read in the points from text file           #
     # -------------------------------------------------------#
     # There should be 3 points for the MC1 and 4 for the TRP
     # Points are picked in the XCT space
-    mc1_pnts_file = os.path.join(
-        point_dir, str(next_scan) + "e_MC1_SCS_" + str(rater) + ".txt"
-    )
-    trp_pnts_file = os.path.join(
-        point_dir, str(next_scan) + "e_TRP_SCS_" + str(rater) + ".txt"
-    )
+    mc1_pnts_file = layout.path("scs_points", bone="MC1", rater=rater, **scan_fields)
+    trp_pnts_file = layout.path("scs_points", bone="TRP", rater=rater, **scan_fields)
 
     mc1_pnts_list = [None] * 3
     trp_pnts_list = [None] * 4
@@ -106,7 +156,7 @@ def main(rater, next_scan):
             mc1_pnts_list = [line.rstrip("\n") for line in f]
     except FileNotFoundError:
         print(Colours.RED + "ERROR: File does not exist!" + Colours.WHITE)
-        sys.exit(1)
+        raise
 
     print(
         Colours.BLUE
@@ -119,9 +169,9 @@ def main(rater, next_scan):
             trp_pnts_list = [line.rstrip("\n") for line in f]
     except FileNotFoundError:
         print(Colours.RED + "ERROR: File does not exist!" + Colours.WHITE)
-        sys.exit(1)
+        raise
 
-    # Put the directories into lists to cleanly pass to the compute_angles function
+    # Put the directories into lists to cleanly pass to xct_to_dynact_transform
     xct_dir_list = [xct_pnts_dir, ct2xct_reg_dir, xct_model_dir]
     ct_dir_list = [ct_pnts_dir, ct2dynact_reg_dir, ct_model_dir]
     dynact_dir_list = [dynact_pnts_dir, dynact_reg_dir, dynact_model_dir]
@@ -136,90 +186,26 @@ def main(rater, next_scan):
     return arr
 
 
-def compute_angles(R_relative):
+def dynact_frame_transform(mc1_chain, trp_chain, mc1_pnts_xct, trp_pnts_xct):
     """
-    Function to compute joint rotations by decomposing the input rotation matrix.
-
-    alpha (a) = abduction-adduction angle (X_MC1)
-    beta  (b) = axial rotation (Floating axis)
-    gama  (g) = flexion-extension (Z_TRP)
-
-    Relative rotation matrix is assumed to have the following form:
-    Rxyz = Rz * Ry * Rx
-    Rxyz = [ cos(b)cos(g)   (sin(a)sin(b)cos(g) + cos(a)sin(g))   (-cos(a)sin(b)cos(g) + sin(a)sin(g)) ]
-        [ -cos(b)sin(g)  (-sin(a)sin(b)sin(g) + cos(a)cos(g))   (cos(a)sin(b)sin(g) + sin(a)cos(g)) ]
-        [ sin(b)                    -sin(a)cos(b)                         cos(a)cos(b)              ]
+    Transform MC1 and TRP points from XCT to every DYNACT frame using the
+    composed transform matrices. Joint angles and translations are then
+    computed for all frames at once.
 
     Parameters
     ----------
-    R_relative : list
+    mc1_chain : dict
+        MC1 transform chain from the transform store
 
-    Returns
-    -------
-    angles : list
-    """
-    beta = np.arcsin(R_relative[2, 0])
-    alpha = np.arcsin(-1 * R_relative[2, 1] / np.cos(beta))
-    gama = np.arcsin(-1 * R_relative[1, 0] / np.cos(beta))
+    trp_chain : dict
+        TRP transform chain from the transform store
 
-    angles = [alpha, beta, gama]
-    return angles
-
-
-def compute_translations(R_relative, curr_origin, prev_origin):
-    """
-    Computes joint translations at a specific DYNACT frame. Translations are
-    computed for the origin of the MC1 relative to the TRP.
-
-    Parameters
-    ----------
-    R_relative : list
-        Matrix to move from the MC1 coordinates to the TRP coordinates
-
-    curr_origin : list
-        MC1 origin at the current DYNACT frame
-
-    prev_origin : string
-        MC1 origin at the previous DYNACT frame
-
-    Returns
-    -------
-    translations : list
-        List of the X, Y, and Z translations of the MC1 relative to the TRP
-
-    transformed_origin : list
-        Origin for the next frame
-    """
-    transformed_origin = R_relative.dot(
-        np.array([float(curr_origin[0]), float(curr_origin[1]), float(curr_origin[2])])
-    )
-
-    t_x = str(float(transformed_origin[0]) - float(prev_origin[0]))
-    t_y = str(float(transformed_origin[1]) - float(prev_origin[1]))
-    t_z = str(float(transformed_origin[2]) - float(prev_origin[2]))
-
-    translations = [t_x, t_y, t_z]
-    return translations, transformed_origin
-
-
-def dynact_frame_transform(
-    dynact_reg_dir, mc1_pnts_dynact, trp_pnts_dynact, R_relative
-):
-    """
-    Transform MC1 and TRP points from XCT to CT, CT to DYNACT frame #1, and
-    between DYNACT frames. Joint angles and translations are then computed for
-    each DYNACT frame.
-
-    Parameters
-    ----------
-    dynact_reg_dir : list
-
-    mc1_pnts_dynact : list
-        Anatommical landmarks for the MC1.
+    mc1_pnts_xct : numpy.array
+        Anatommical landmarks for the MC1 in ITK world coordinates.
         Contains 3 points: 1) LDT, 2) MDT, 3) M1TJ (origin)
 
-    trp_pnts_dynact : list
-        Anatommical landmarks for the TRP.
+    trp_pnts_xct : numpy.array
+        Anatommical landmarks for the TRP in ITK world coordinates.
         Contains 4 points: 1) TM1J (origin), 2) TM2J, 3) TSTJ, 4) TDET
 
     Returns
@@ -230,166 +216,42 @@ def dynact_frame_transform(
     translations : list
         The X, Y, and Z translations of the MC1
     """
-    mc1_pnt1_dynact = mc1_pnts_dynact[0]
-    mc1_pnt2_dynact = mc1_pnts_dynact[1]
-    mc1_pnt3_dynact = mc1_pnts_dynact[2]
-    trp_pnt1_dynact = trp_pnts_dynact[0]
-    trp_pnt2_dynact = trp_pnts_dynact[1]
-    trp_pnt3_dynact = trp_pnts_dynact[2]
-    trp_pnt4_dynact = trp_pnts_dynact[3]
-
-    # Abduction, flexion, and internal rotation are positive
-    # Adduction, extension, and external rotation are negative
-    angle_list = compute_angles(R_relative)
-    ab_ad = np.rad2deg(angle_list[0])
-    ax_rot = np.rad2deg(angle_list[1])
-    flex_ext = np.rad2deg(angle_list[2])
-
-    ab_ad_arr = np.arange(59).astype(str)
-    flex_ext_arr = np.arange(59).astype(str)
-    ax_rot_arr = np.arange(59).astype(str)
-    o_x = np.arange(59).astype(str)
-    o_y = np.arange(59).astype(str)
-    o_z = np.arange(59).astype(str)
-    t_x = np.arange(59).astype(str)
-    t_y = np.arange(59).astype(str)
-    t_z = np.arange(59).astype(str)
-
-    ab_ad_arr.shape = (59, 1)
-    flex_ext_arr.shape = (59, 1)
-    ax_rot_arr.shape = (59, 1)
-    o_x.shape = (59, 1)
-    o_y.shape = (59, 1)
-    o_z.shape = (59, 1)
-    t_x.shape = (59, 1)
-    t_y.shape = (59, 1)
-    t_z.shape = (59, 1)
-
-    ab_ad_arr[0] = str(ab_ad)
-    flex_ext_arr[0] = str(flex_ext)
-    ax_rot_arr[0] = str(ax_rot)
-
-    transformed_origin = R_relative.dot(
-        np.array(
-            [
-                float(mc1_pnt3_dynact[0]),
-                float(mc1_pnt3_dynact[1]),
-                float(mc1_pnt3_dynact[2]),
-            ]
-        )
-    )
-    o_x[0] = str(transformed_origin[0])
-    o_y[0] = str(transformed_origin[1])
-    o_z[0] = str(transformed_origin[2])
+    # (F, 3, 3) and (F, 4, 3) landmark stacks for all DYNACT frames
+    mc1_pnts_frames = transform_points_batch(mc1_chain["composed"], mc1_pnts_xct)
+    trp_pnts_frames = transform_points_batch(trp_chain["composed"], trp_pnts_xct)
+
+    motion = joint_motion_batch(mc1_pnts_frames, trp_pnts_frames)
+    angles = motion["angles"]
+    trans = motion["translations"]
 
     if debug:
+        print(Colours.PURPLE + "\t DEBUG: XCT coordinate systems:" + Colours.WHITE)
+        print("\t M_scs_MC1: \n\t " + str(motion["mc1_scs"][0]).replace("\n", "\n \t"))
+        print("\t M_scs_TRP: \n\t " + str(motion["trp_scs"][0]).replace("\n", "\n \t"))
+        print(
+            Colours.PURPLE + "\t DEBUG: XCT relative rotation matrix:" + Colours.WHITE
+        )
+        print(
+            "\t R_relative: \n\t " + str(motion["r_relative"][0]).replace("\n", "\n \t")
+        )
+        print()
         print(Colours.BLUE + "\t Printing joint motion for frame #1:" + Colours.WHITE)
-        print("\t Abduction-Adduction: " + str(ab_ad))
-        print("\t Flexion-Extension: " + str(flex_ext))
-        print("\t Internal-External Rotation: " + str(ax_rot))
+        print("\t Abduction-Adduction: " + str(angles[0, 0]))
+        print("\t Flexion-Extension: " + str(angles[0, 1]))
+        print("\t Internal-External Rotation: " + str(angles[0, 2]))
         print()
-        print("\t Translation X: " + str(o_x[0]))
-        print("\t Translation Y: " + str(o_y[0]))
-        print("\t Translation Z: " + str(o_z[0]))
+        print("\t Translation X: " + str(motion["origins"][0, 0]))
+        print("\t Translation Y: " + str(motion["origins"][0, 1]))
+        print("\t Translation Z: " + str(motion["origins"][0, 2]))
         print()
 
-    # Transform between DYNACT frames
-    for i in range(2, 60):
-        # Transform to the next DYNACT frame
-        # MC1
-        dynact_reg_path_mc1 = os.path.join(
-            dynact_reg_dir, "VOLUME_REF_TO_" + str(i) + "_MC1_REG.tfm"
-        )
-        dynact_next_reg_mc1_tfm = sitk.ReadTransform(dynact_reg_path_mc1)
-
-        mc1_pnt1_dynact_frame = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt1_dynact
-        )
-        mc1_pnt2_dynact_frame = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt2_dynact
-        )
-        mc1_pnt3_dynact_frame = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt3_dynact
-        )
-
-        # TRP
-        dynact_reg_path_trp = os.path.join(
-            dynact_reg_dir, "VOLUME_REF_TO_" + str(i) + "_TRP_REG.tfm"
-        )
-        dynact_next_reg_trp_tfm = sitk.ReadTransform(dynact_reg_path_trp)
-
-        trp_pnt1_dynact_frame = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt1_dynact
-        )
-        trp_pnt2_dynact_frame = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt2_dynact
-        )
-        trp_pnt3_dynact_frame = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt3_dynact
-        )
-        trp_pnt4_dynact_frame = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt4_dynact
-        )
-
-        # Calculate joint angles for testing
-        # Matricies from these functions are returned in the following format:
-        # [Xx  Xy  Xz]
-        # [Yx  Yy  Yz]
-        # [Zx  Zy  Zz]
-        xct_mc1_scs = np.array(
-            calculate_mc1_scs(
-                [mc1_pnt1_dynact_frame, mc1_pnt2_dynact_frame, mc1_pnt3_dynact_frame]
-            )
-        )
-        xct_trp_scs = np.array(
-            calculate_trp_scs(
-                [
-                    trp_pnt1_dynact_frame,
-                    trp_pnt2_dynact_frame,
-                    trp_pnt3_dynact_frame,
-                    trp_pnt4_dynact_frame,
-                ]
-            )
-        )
-
-        M_scs_MC1 = np.array([xct_mc1_scs[0], xct_mc1_scs[1], xct_mc1_scs[2]])
-        M_scs_TRP = np.array([xct_trp_scs[0], xct_trp_scs[1], xct_trp_scs[2]])
-
-        # Calculate angle of MC1 relative to TRP
-        R_relative = np.linalg.inv(M_scs_TRP) * M_scs_MC1
-
-        # Abduction, flexion, and internal rotation are positive
-        # Adduction, extension, and external rotation are negative
-        angle_list = compute_angles(R_relative)
-        ab_ad = np.rad2deg(angle_list[0])
-        ax_rot = np.rad2deg(angle_list[1])
-        flex_ext = np.rad2deg(angle_list[2])
-
-        # translation
-        prev_origin = [o_x[i - 2], o_y[i - 2], o_z[i - 2]]
-        t, o = compute_translations(R_relative, mc1_pnt3_dynact_frame, prev_origin)
-        t_x[i - 1] = t[0]
-        t_y[i - 1] = t[1]
-        t_z[i - 1] = t[2]
-        o_x[i - 1] = o[0]
-        o_y[i - 1] = o[1]
-        o_z[i - 1] = o[2]
-
-        ab_ad_arr[i - 1] = str(ab_ad)
-        flex_ext_arr[i - 1] = str(flex_ext)
-        ax_rot_arr[i - 1] = str(ax_rot)
-
-        # Keep commented out to reduce the processing time
-        # if debug:
-        #     print(Colours.BLUE + '\t Printing joint motion for frame #' + str(i-1) + ':' + Colours.WHITE)
-        #     print('\t Abduction-Adduction: ' + str(ab_ad))
-        #     print('\t Flexion-Extension: ' + str(flex_ext))
-        #     print('\t Internal-External Rotation: ' + str(ax_rot))
-        #     print()
-        #     print('\t Translation X: ' + str(t_x[i-1]))
-        #     print('\t Translation Y: ' + str(t_y[i-1]))
-        #     print('\t Translation Z: ' + str(t_z[i-1]))
-        #     print()
+    # Columns of shape (F, 1) to stack into the output table
+    ab_ad_arr = angles[:, 0:1]
+    flex_ext_arr = angles[:, 1:2]
+    ax_rot_arr = angles[:, 2:3]
+    t_x = trans[:, 0:1]
+    t_y = trans[:, 1:2]
+    t_z = trans[:, 2:3]
 
     rotations = [ab_ad_arr, flex_ext_arr, ax_rot_arr]
     translations = [t_x, t_y, t_z]
@@ -416,7 +278,7 @@ def xct_to_dynact_transform(
 
     Returns
     -------
-    arr : list
+    arr : numpy.array
     """
     # ----------------------------------------------------------#
     #   Step 1: Setup directories, points, and XCT images      #
@@ -432,15 +294,13 @@ def xct_to_dynact_transform(
     dynact_reg_dir = dynact_dir_list[1]
     dynact_model_dir = dynact_dir_list[2]
 
-    # Strip the list to create a seperate list for each point
-    mc1_pnt1 = [float(s) for s in mc1_pnts_list[0].split(",")]
-    mc1_pnt2 = [float(s) for s in mc1_pnts_list[1].split(",")]
-    mc1_pnt3 = [float(s) for s in mc1_pnts_list[2].split(",")]
-
-    trp_pnt1 = [float(s) for s in trp_pnts_list[0].split(",")]
-    trp_pnt2 = [float(s) for s in trp_pnts_list[1].split(",")]
-    trp_pnt3 = [float(s) for s in trp_pnts_list[2].split(",")]
-    trp_pnt4 = [float(s) for s in trp_pnts_list[3].split(",")]
+    # Strip the list to create a seperate row for each point
+    mc1_pnts = np.array(
+        [[float(s) for s in line.split(",")] for line in mc1_pnts_list[:3]]
+    )
+    trp_pnts = np.array(
+        [[float(s) for s in line.split(",")] for line in trp_pnts_list[:4]]
+    )
 
     if debug:
         print(Colours.PURPLE + "\t DEBUG: Directories being used:" + Colours.WHITE)
@@ -456,146 +316,56 @@ def xct_to_dynact_transform(
         print()
         print(Colours.PURPLE + "\t DEBUG: Points read in:" + Colours.WHITE)
         print("\t MC1:")
-        print("\t (" + str(mc1_pnt1) + ")")
-        print("\t (" + str(mc1_pnt2) + ")")
-        print("\t (" + str(mc1_pnt3) + ")")
+        for pnt in mc1_pnts:
+            print("\t (" + str(pnt.tolist()) + ")")
         print("\t TRP:")
-        print("\t (" + str(trp_pnt1) + ")")
-        print("\t (" + str(trp_pnt2) + ")")
-        print("\t (" + str(trp_pnt3) + ")")
-        print("\t (" + str(trp_pnt4) + ")")
+        for pnt in trp_pnts:
+            print("\t (" + str(pnt.tolist()) + ")")
         print()
 
-    # ----------------------------------------------------------#
-    #   Step 2: Transform points from XCT to CT image space    #
-    # ----------------------------------------------------------#
-    # Read in the CT to XCT transform
     # Nifti to ITK World coordinates (Flip X and Y axes to go from VTK to ITK coordinates)
-    mc1_pnt1 = [-1 * mc1_pnt1[0], -1 * mc1_pnt1[1], mc1_pnt1[2]]
-    mc1_pnt2 = [-1 * mc1_pnt2[0], -1 * mc1_pnt2[1], mc1_pnt2[2]]
-    mc1_pnt3 = [-1 * mc1_pnt3[0], -1 * mc1_pnt3[1], mc1_pnt3[2]]
-
-    trp_pnt1 = [-1 * trp_pnt1[0], -1 * trp_pnt1[1], trp_pnt1[2]]
-    trp_pnt2 = [-1 * trp_pnt2[0], -1 * trp_pnt2[1], trp_pnt2[2]]
-    trp_pnt3 = [-1 * trp_pnt3[0], -1 * trp_pnt3[1], trp_pnt3[2]]
-    trp_pnt4 = [-1 * trp_pnt4[0], -1 * trp_pnt4[1], trp_pnt4[2]]
-
-    # MC1
-    ct2xct_path_mc1 = os.path.join(ct2xct_reg_dir, "CT2XCT_MC1_REG.tfm")
-    ct2xct_mc1_tfm = sitk.ReadTransform(ct2xct_path_mc1)
-    xct2ct_mc1_tfm = ct2xct_mc1_tfm.GetInverse()
-
-    mc1_pnt1_ct = transform_point(xct2ct_mc1_tfm, mc1_pnt1)
-    mc1_pnt2_ct = transform_point(xct2ct_mc1_tfm, mc1_pnt2)
-    mc1_pnt3_ct = transform_point(xct2ct_mc1_tfm, mc1_pnt3)
-
-    # TRP
-    ct2xct_path_trp = os.path.join(ct2xct_reg_dir, "CT2XCT_TRP_REG.tfm")
-    ct2xct_trp_tfm = sitk.ReadTransform(ct2xct_path_trp)
-    xct2ct_trp_tfm = ct2xct_trp_tfm.GetInverse()
-
-    trp_pnt1_ct = transform_point(xct2ct_trp_tfm, trp_pnt1)
-    trp_pnt2_ct = transform_point(xct2ct_trp_tfm, trp_pnt2)
-    trp_pnt3_ct = transform_point(xct2ct_trp_tfm, trp_pnt3)
-    trp_pnt4_ct = transform_point(xct2ct_trp_tfm, trp_pnt4)
-
-    if debug:
-        print(
-            Colours.PURPLE + "\t DEBUG: Points transformed to CT space:" + Colours.WHITE
-        )
-        print("\t MC1:")
-        print("\t mc1_pnt1_ct: " + str(mc1_pnt1_ct))
-        print("\t mc1_pnt2_ct: " + str(mc1_pnt2_ct))
-        print("\t mc1_pnt3_ct: " + str(mc1_pnt3_ct))
-        print("\t TRP:")
-        print("\t trp_pnt1_ct: " + str(trp_pnt1_ct))
-        print("\t trp_pnt2_ct: " + str(trp_pnt2_ct))
-        print("\t trp_pnt3_ct: " + str(trp_pnt3_ct))
-        print("\t trp_pnt4_ct: " + str(trp_pnt4_ct))
-        print()
+    mc1_pnts[:, :2] *= -1
+    trp_pnts[:, :2] *= -1
 
     # ----------------------------------------------------------#
-    #   Step 3: Transform points from CT to DYNACT image space #
+    #   Step 2: Read the XCT -> CT -> DYNACT transform chains  #
     # ----------------------------------------------------------#
-    # Read in the CT to DYNACT (first frame) transform
-    # MC1
-    ct2dynact_path_mc1 = os.path.join(ct2dynact_reg_dir, "CT2DYNACT_MC1_REG.tfm")
-    ct2dynact_mc1_tfm = sitk.ReadTransform(ct2dynact_path_mc1)
-
-    mc1_pnt1_dynact = transform_point(ct2dynact_mc1_tfm, mc1_pnt1_ct)
-    mc1_pnt2_dynact = transform_point(ct2dynact_mc1_tfm, mc1_pnt2_ct)
-    mc1_pnt3_dynact = transform_point(ct2dynact_mc1_tfm, mc1_pnt3_ct)
-
-    # TRP
-    ct2dynact_path_trp = os.path.join(ct2dynact_reg_dir, "CT2DYNACT_TRP_REG.tfm")
-    ct2dynact_trp_tfm = sitk.ReadTransform(ct2dynact_path_trp)
-
-    trp_pnt1_dynact = transform_point(ct2dynact_trp_tfm, trp_pnt1_ct)
-    trp_pnt2_dynact = transform_point(ct2dynact_trp_tfm, trp_pnt2_ct)
-    trp_pnt3_dynact = transform_point(ct2dynact_trp_tfm, trp_pnt3_ct)
-    trp_pnt4_dynact = transform_point(ct2dynact_trp_tfm, trp_pnt4_ct)
-
-    if debug:
-        print(
-            Colours.PURPLE
-            + "\t DEBUG: Points transformed to DYNACT space:"
-            + Colours.WHITE
-        )
-        print("\t MC1:")
-        print("\t mc1_pnt1_dynact: " + str(mc1_pnt1_dynact))
-        print("\t mc1_pnt2_dynact: " + str(mc1_pnt2_dynact))
-        print("\t mc1_pnt3_dynact: " + str(mc1_pnt3_dynact))
-        print("\t TRP:")
-        print("\t trp_pnt1_dynact: " + str(trp_pnt1_dynact))
-        print("\t trp_pnt2_dynact: " + str(trp_pnt2_dynact))
-        print("\t trp_pnt3_dynact: " + str(trp_pnt3_dynact))
-        print("\t trp_pnt4_dynact: " + str(trp_pnt4_dynact))
-        print()
-
-    # Calculate joint angles for testing
-    # Matricies from these functions are returned in the following format:
-    # [Xx  Xy  Xz]
-    # [Yx  Yy  Yz]
-    # [Zx  Zy  Zz]
-    xct_mc1_scs = np.array(
-        calculate_mc1_scs([mc1_pnt1_dynact, mc1_pnt2_dynact, mc1_pnt3_dynact])
+    # The chains are parsed once per scan and shared between raters
+    mc1_chain = transform_store.chain(
+        ct2xct_reg_dir, ct2dynact_reg_dir, dynact_reg_dir, "MC1"
     )
-    xct_trp_scs = np.array(
-        calculate_trp_scs(
-            [trp_pnt1_dynact, trp_pnt2_dynact, trp_pnt3_dynact, trp_pnt4_dynact]
-        )
+    trp_chain = transform_store.chain(
+        ct2xct_reg_dir, ct2dynact_reg_dir, dynact_reg_dir, "TRP"
     )
 
-    # Matricies for axes should be formatted as follows:
-    # Rxyz = [Rz  Ry  Rx]
-    # Rxyz = [Zx  Yx  Xx]
-    #        [Zy  Yy  Xy]
-    #        [Zz  Yz  Xz]
-    M_scs_MC1 = np.array([xct_mc1_scs[0], xct_mc1_scs[1], xct_mc1_scs[2]])
-    M_scs_TRP = np.array([xct_trp_scs[0], xct_trp_scs[1], xct_trp_scs[2]])
-
-    # Calculate angle of MC1 relative to TRP
-    R_relative = np.linalg.inv(M_scs_TRP) * M_scs_MC1
-
     if debug:
-        print(Colours.PURPLE + "\t DEBUG: XCT coordinate systems:" + Colours.WHITE)
-        print("\t M_scs_MC1: \n\t " + str(M_scs_MC1).replace("\n", "\n \t"))
-        print("\t M_scs_TRP: \n\t " + str(M_scs_TRP).replace("\n", "\n \t"))
-        print(
-            Colours.PURPLE + "\t DEBUG: XCT relative rotation matrix:" + Colours.WHITE
-        )
-        print("\t R_relative: \n\t " + str(R_relative).replace("\n", "\n \t"))
-        print()
+        ct2dynact_mc1 = mc1_chain["ct2dynact"].dot(mc1_chain["xct2ct"])
+        ct2dynact_trp = trp_chain["ct2dynact"].dot(trp_chain["xct2ct"])
+        stages = [
+            ("CT", mc1_chain["xct2ct"], trp_chain["xct2ct"]),
+            ("DYNACT", ct2dynact_mc1, ct2dynact_trp),
+        ]
+        for space, mc1_matrix, trp_matrix in stages:
+            print(
+                Colours.PURPLE
+                + "\t DEBUG: Points transformed to "
+                + space
+                + " space:"
+                + Colours.WHITE
+            )
+            print("\t MC1:")
+            for pnt in transform_points_batch([mc1_matrix], mc1_pnts)[0]:
+                print("\t " + str(pnt.tolist()))
+            print("\t TRP:")
+            for pnt in transform_points_batch([trp_matrix], trp_pnts)[0]:
+                print("\t " + str(pnt.tolist()))
+            print()
 
-    mc1_pnts_dynact = [mc1_pnt1_dynact, mc1_pnt2_dynact, mc1_pnt3_dynact]
-    trp_pnts_dynact = [
-        trp_pnt1_dynact,
-        trp_pnt2_dynact,
-        trp_pnt3_dynact,
-        trp_pnt4_dynact,
-    ]
+    # ----------------------------------------------------------#
+    #   Step 3: Compute joint motion for all DYNACT frames     #
+    # ----------------------------------------------------------#
     rotations, translations = dynact_frame_transform(
-        dynact_reg_dir, mc1_pnts_dynact, trp_pnts_dynact, R_relative
+        mc1_chain, trp_chain, mc1_pnts, trp_pnts
     )
 
     ab_ad_arr = rotations[0]
@@ -609,86 +379,318 @@ def xct_to_dynact_transform(
     return arr
 
 
+def write_scan_csv(output_csv, rater_arrs):
+    """
+    Writes the joint angles and translations of all raters for a scan to a
+    CSV file with one row per frame.
+
+    Parameters
+    ----------
+    output_csv : string
+
+    rater_arrs : list
+        (F, 6) array for each rater in rater_list
+    """
+    num_frames = rater_arrs[0].shape[0]
+    output_arr = np.hstack(
+        [np.arange(num_frames).reshape(num_frames, 1)] + list(rater_arrs)
+    )
+    np.savetxt(
+        output_csv,
+        output_arr,
+        delimiter=",",
+        header=",".join(header_arr[0]),
+        comments="",
+        fmt=["%d"] + ["%s"] * (output_arr.shape[1] - 1),
+    )
+
+
+def compute_scan(next_scan, series=None, parent_dir=None, layout_path=None):
+    """
+    Computes the joint angles and translations of all raters for a scan and
+    writes them to <scan>_angles.csv in the output directory.
+
+    Parameters
+    ----------
+    next_scan : string
+
+    series : string
+        DYNACT series (B, C, or D) used for the scan
+
+    parent_dir : string
+        Directory with the points, reg, models, and output directories
+
+    layout_path : string
+        Scan layout file. Uses the default layout if None.
+
+    Returns
+    -------
+    output_csv : string
+    """
+    if parent_dir is None:
+        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    output_dir = get_layout(parent_dir, layout_path).path("output_dir")
+
+    print(
+        Colours.BOLD + "Computing angles for " + str(next_scan) + "..." + Colours.WHITE
+    )
+
+    rater_arrs = [
+        main(rater, next_scan, series, parent_dir, layout_path) for rater in rater_list
+    ]
+
+    print(Colours.BOLD + "Writing out values to CSV..." + Colours.WHITE)
+    print()
+    output_csv = os.path.join(output_dir, str(next_scan) + "_angles.csv")
+    write_scan_csv(output_csv, rater_arrs)
+
+    return output_csv
+
+
+def compute_scan_raters(args):
+    """
+    Computes the joint angles and translations of every rater for one scan.
+    Runs in the worker processes of compute_cohort. The raters of a scan run in
+    the same process so the scan's transform chains are parsed and composed
+    once (see transform_store). A failed rater does not stop the others.
+
+    Parameters
+    ----------
+    args : list
+        Scan, DYNACT series, root directory, and layout file
+
+    Returns
+    -------
+    result_list : list
+        [rater, arr, error] for each rater. arr is the (F, 6) array of
+        rotations and translations, or None if the rater failed.
+    """
+    next_scan, series, parent_dir, layout_path = args
+
+    result_list = []
+    for rater in rater_list:
+        try:
+            arr, error = main(rater, next_scan, series, parent_dir, layout_path), None
+        except Exception as e:
+            # Errors are returned as strings so they can always be pickled
+            arr, error = None, "{}: {}".format(type(e).__name__, e)
+        result_list.append([rater, arr, error])
+
+    return result_list
+
+
+def compute_cohort(
+    scan_list,
+    parent_dir,
+    workers=1,
+    output_path=None,
+    table_format=None,
+    layout_path=None,
+):
+    """
+    Computes the joint angles and translations of every rater for every scan.
+    Each scan is a separate task (all of its raters share the scan's transform
+    chains), so the scans of the cohort run on all workers at once. Results are
+    streamed to a long-format table (one row per scan, rater, and frame) as
+    tasks finish, and <scan>_angles.csv is written once all raters of a scan
+    are done. A failed task is reported and does not stop the other scans.
+
+    Parameters
+    ----------
+    scan_list : list
+        [scan, series] for each scan to process
+
+    parent_dir : string
+        Directory with the points, reg, models, and output directories
+
+    workers : int
+        Number of processes. 1 runs all tasks in this process.
+
+    output_path : string
+        Long-format CSV file. Default = <parent_dir>/output/joint_motion.csv
+
+    table_format : string
+        Also write the long-format table as parquet or feather
+
+    layout_path : string
+        Scan layout file. Uses the default layout if None.
+
+    Returns
+    -------
+    failures : list
+        [scan, rater, error] for each failed task
+    """
+    layout = get_layout(parent_dir, layout_path)
+    output_dir = layout.path("output_dir")
+    if output_path is None:
+        output_path = os.path.join(output_dir, "joint_motion.csv")
+
+    table_path = None
+    if table_format is not None:
+        table_path = os.path.splitext(output_path)[0] + "." + table_format
+
+    failures = []
+    task_list = []
+    for next_scan, series in scan_list:
+        if series is None:
+            try:
+                series = layout.series(next_scan)
+            except ValueError as e:
+                print(Colours.RED + "ERROR: {}".format(e) + Colours.WHITE)
+                failures.append([next_scan, "all raters", str(e)])
+                continue
+        task_list.append([next_scan, series, parent_dir, layout_path])
+
+    print(
+        Colours.BOLD
+        + "Computing angles for {} scans and {} raters...".format(
+            len(task_list), len(rater_list)
+        )
+        + Colours.WHITE
+    )
+
+    # Results of scans that are still waiting for some of their raters
+    scan_results = {}
+
+    with TableWriter(output_path, long_columns, table_path, table_format) as writer:
+
+        def finish_rater(task, rater, arr, error):
+            next_scan, series = task[:2]
+            if error is None:
+                batch = {"scan": next_scan, "series": series, "rater": rater}
+                batch["frame"] = np.arange(arr.shape[0])
+                for i, name in enumerate(long_columns[4:]):
+                    batch[name] = arr[:, i]
+                writer.write(batch)
+            else:
+                print(
+                    Colours.RED
+                    + "ERROR: {} {}: {}".format(next_scan, rater, error)
+                    + Colours.WHITE
+                )
+                failures.append([next_scan, rater, str(error)])
+
+            results = scan_results.setdefault(next_scan, {})
+            results[rater] = arr
+            if len(results) < len(rater_list):
+                return
+
+            del scan_results[next_scan]
+            if any(results[r] is None for r in rater_list):
+                return
+            output_csv = os.path.join(output_dir, str(next_scan) + "_angles.csv")
+            print("Writing to {}".format(output_csv))
+            write_scan_csv(output_csv, [results[r] for r in rater_list])
+
+        def finish_task(task, result_list, error):
+            if error is not None:
+                # The whole task failed (e.g., a worker process died)
+                result_list = [[rater, None, error] for rater in rater_list]
+            for rater, arr, rater_error in result_list:
+                finish_rater(task, rater, arr, rater_error)
+
+        if workers == 1:
+            for task in task_list:
+                finish_task(task, compute_scan_raters(task), None)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                future_dict = {
+                    executor.submit(compute_scan_raters, task): task
+                    for task in task_list
+                }
+                for future in as_completed(future_dict):
+                    try:
+                        result_list, error = future.result(), None
+                    except Exception as e:
+                        result_list, error = None, e
+                    finish_task(future_dict[future], result_list, error)
+
+    print("Writing to {}".format(output_path))
+    if table_path is not None:
+        print("Writing to {}".format(table_path))
+
+    return failures
+
+
 if __name__ == "__main__":
     # Allow for extra output for debugging
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "scans",
+        type=str,
+        nargs="*",
+        help="Scans to process. Default = all scans in the cohort manifest, or all "
+        "directories in the models directory",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        default=None,
+        help="Cohort manifest (YAML) with the scans and DYNACT series to process",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of scans processed in parallel (all raters of a scan run in "
+        "the same process)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Long-format CSV with one row per scan, rater, and frame. "
+        "Default = output/joint_motion.csv",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default=None,
+        choices=table_formats,
+        help="Also write the long-format table as Parquet or Feather (requires "
+        "pyarrow)",
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        type=str,
+        default=None,
+        help="Scan layout file (YAML) with the paths of the points, reg, and models "
+        "directories. Default = modMisc/scan_layout.yml",
+    )
     parser.add_argument("-d", "--debug", nargs="?", type=bool, default=False)
     args = parser.parse_args()
     debug = args.debug
 
     parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    model_dir = os.path.join(parent_dir, "models")
-    output_dir = os.path.join(parent_dir, "output")
 
-    rater_list = ["JJT", "TB", "MTK001", "MTK002", "MTK003"]
-    header_arr = np.array(
-        [
-            [
-                "Frame",
-                "JJT_AbAd",
-                "JJT_FlexExt",
-                "JJT_Rot",
-                "JJT_X",
-                "JJT_Y",
-                "JJT_Z",
-                "TB_AbAd",
-                "TB_FlexExt",
-                "TB_Rot",
-                "TB_X",
-                "TB_Y",
-                "TB_Z",
-                "MTK_001_AbAd",
-                "MTK_001_FlexExt",
-                "MTK_001_Rot",
-                "MTK_001_X",
-                "MTK_001_Y",
-                "MTK_001_Z",
-                "MTK_002_AbAd",
-                "MTK_002_FlexExt",
-                "MTK_002_Rot",
-                "MTK_002_X",
-                "MTK_002_Y",
-                "MTK_002_Z",
-                "MTK_003_AbAd",
-                "MTK_003_FlexExt",
-                "MTK_003_Rot",
-                "MTK_003_X",
-                "MTK_003_Y",
-                "MTK_003_Z",
-            ]
-        ],
-        dtype=object,
-    )
-    frame_arr = np.arange(59).astype(str)
-    frame_arr.shape = (59, 1)
-
-    # Compute angles for each rater, for each scan
-    for sub_dir in next(os.walk(model_dir))[1]:
-        # Skip a few directories that aren't ready for processing
-        if "DYNACT1_011" in sub_dir or "DYNACT1_001" in sub_dir or "Marker" in sub_dir:
-            continue
-
-        print(
-            Colours.BOLD
-            + "Computing angles for "
-            + str(sub_dir)
-            + "..."
-            + Colours.WHITE
-        )
+    # Scans (and their DYNACT series) to process
+    if args.manifest is not None:
+        cohort = read_cohort(args.manifest)
+        parent_dir = cohort["root"]
+        scan_list = [[scan["scan"], scan["series"]] for scan in cohort["scans"]]
+    else:
+        layout = get_layout(parent_dir, args.layout)
+        scan_list = [[sub_dir, None] for sub_dir in layout.scans()]
 
-        output_arr = frame_arr
-        output_arr = np.hstack([output_arr, main(rater_list[0], sub_dir)])
-        output_arr = np.hstack([output_arr, main(rater_list[1], sub_dir)])
-        output_arr = np.hstack([output_arr, main(rater_list[2], sub_dir)])
-        output_arr = np.hstack([output_arr, main(rater_list[3], sub_dir)])
-        output_arr = np.hstack([output_arr, main(rater_list[4], sub_dir)])
-        output_arr = np.vstack([header_arr, output_arr])
-        output_arr = output_arr.astype(str)
+    if args.scans:
+        series_dict = dict(scan_list)
+        scan_list = [[sub_dir, series_dict.get(sub_dir)] for sub_dir in args.scans]
 
-        print(Colours.BOLD + "Writing out values to CSV..." + Colours.WHITE)
-        print()
-        output_csv = os.path.join(output_dir, str(sub_dir) + "_angles.csv")
-        np.savetxt(output_csv, output_arr, delimiter=",", fmt="%s")
+    # Compute angles for each rater, for each scan
+    failures = compute_cohort(
+        scan_list, parent_dir, args.workers, args.output, args.format, args.layout
+    )
 
     print()
+    if failures:
+        print(Colours.RED + "{} task(s) failed:".format(len(failures)) + Colours.WHITE)
+        for next_scan, rater, error in failures:
+            print("\t {} {}: {}".format(next_scan, rater, error))
+        sys.exit(1)
+
     print(Colours.BOLD + "Done!")
@@ -2,4 +2,14 @@
 # Biomechanics Module
 
 from .calc_coord_systems import transform_point, calculate_mc1_scs, calculate_trp_scs
-from .scs_diff import scs_diff, unit_vector
+from .scs_diff import scs_diff, scs_diff_pairwise, unit_vector
+from .joint_motion import (
+    transform_points_batch,
+    calculate_mc1_scs_batch,
+    calculate_trp_scs_batch,
+    relative_rotation_batch,
+    cardan_angles_batch,
+    translations_batch,
+    joint_motion_batch,
+)
+from .landmark_uncertainty import monte_carlo_motion, motion_names
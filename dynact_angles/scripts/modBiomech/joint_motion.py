@@ -0,0 +1,237 @@
+"""
+joint_motion.py
+
+Created on: Oct. 18, 2026
+
+Description: Batched versions of the SCS and joint motion calculations. Every
+function works on a stack of F frames at once, so a whole DYNACT scan is
+processed with a handful of NumPy operations instead of a loop over frames.
+"""
+
+import numpy as np
+
+
+def _normalise(vectors):
+    """
+    Normalises a stack of vectors along the last axis.
+
+    Parameters
+    ----------
+    vectors : numpy.array
+        (..., 3) array
+
+    Returns
+    -------
+    numpy.array
+    """
+    return vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)
+
+
+def transform_points_batch(matrices, points):
+    """
+    Applies a stack of 4x4 homogeneous matrices to a set of points.
+
+    Parameters
+    ----------
+    matrices : numpy.array
+        (F, 4, 4) array, one matrix per frame
+
+    points : numpy.array
+        (P, 3) array of points, or (F, P, 3) array with different points for
+        each frame
+
+    Returns
+    -------
+    numpy.array
+        (F, P, 3) array of the transformed points
+    """
+    matrices = np.asarray(matrices, dtype=float)
+    points = np.asarray(points, dtype=float)
+    if points.ndim == 2:
+        points = np.broadcast_to(points, (matrices.shape[0],) + points.shape)
+
+    return (
+        np.einsum("fij,fpj->fpi", matrices[:, :3, :3], points)
+        + matrices[:, np.newaxis, :3, 3]
+    )
+
+
+def calculate_mc1_scs_batch(points):
+    """
+    Batched version of calculate_mc1_scs.
+
+    Parameters
+    ----------
+    points : numpy.array
+        (F, 3, 3) array with the LDT, MDT, and CPB points for each frame
+
+    Returns
+    -------
+    numpy.array
+        (F, 3, 3) array with the X, Y, and Z axes as the rows of each frame
+    """
+    points = np.asarray(points, dtype=float)
+    ldt = points[:, 0]
+    mdt = points[:, 1]
+    cpb = points[:, 2]
+
+    mid_pnt = (ldt + mdt) / 2
+    v = ldt - mdt
+    y = cpb - mid_pnt
+    x = np.cross(y, v)
+    z = np.cross(x, y)
+
+    return np.stack([_normalise(x), _normalise(y), _normalise(z)], axis=1)
+
+
+def calculate_trp_scs_batch(points):
+    """
+    Batched version of calculate_trp_scs.
+
+    Parameters
+    ----------
+    points : numpy.array
+        (F, 4, 3) array with the TM1J, TM2J, TSTJ, and TDET points for each
+        frame
+
+    Returns
+    -------
+    numpy.array
+        (F, 3, 3) array with the X, Y, and Z axes as the rows of each frame
+    """
+    points = np.asarray(points, dtype=float)
+    tm1j = points[:, 0]
+    tm2j = points[:, 1]
+    tstj = points[:, 2]
+    tdet = points[:, 3]
+
+    z = tdet - tm2j
+    x = np.cross(tstj - tm1j, z)
+    y = np.cross(z, x)
+
+    return np.stack([_normalise(x), _normalise(y), _normalise(z)], axis=1)
+
+
+def relative_rotation_batch(mc1_scs, trp_scs):
+    """
+    Computes the matrix that moves from the MC1 coordinates to the TRP
+    coordinates for each frame. Uses the same element-wise product as
+    compute_motion so the angles match previous results.
+
+    Parameters
+    ----------
+    mc1_scs : numpy.array
+        (F, 3, 3) MC1 SCS stack
+
+    trp_scs : numpy.array
+        (F, 3, 3) TRP SCS stack
+
+    Returns
+    -------
+    numpy.array
+        (F, 3, 3) array of relative rotation matrices
+    """
+    return np.linalg.inv(trp_scs) * mc1_scs
+
+
+def cardan_angles_batch(r_relative):
+    """
+    Decomposes each relative rotation matrix into Cardan angles, assuming
+    Rxyz = Rz * Ry * Rx:
+
+    Rxyz = [ cos(b)cos(g)   (sin(a)sin(b)cos(g) + cos(a)sin(g))   (-cos(a)sin(b)cos(g) + sin(a)sin(g)) ]
+        [ -cos(b)sin(g)  (-sin(a)sin(b)sin(g) + cos(a)cos(g))   (cos(a)sin(b)sin(g) + sin(a)cos(g)) ]
+        [ sin(b)                    -sin(a)cos(b)                         cos(a)cos(b)              ]
+
+    Parameters
+    ----------
+    r_relative : numpy.array
+        (F, 3, 3) array of relative rotation matrices
+
+    Returns
+    -------
+    numpy.array
+        (F, 3) array with alpha (abduction-adduction), beta (axial rotation),
+        and gama (flexion-extension) in radians
+    """
+    beta = np.arcsin(r_relative[:, 2, 0])
+    alpha = np.arcsin(-1 * r_relative[:, 2, 1] / np.cos(beta))
+    gama = np.arcsin(-1 * r_relative[:, 1, 0] / np.cos(beta))
+
+    return np.stack([alpha, beta, gama], axis=1)
+
+
+def translations_batch(r_relative, origins):
+    """
+    Computes the joint translations of the MC1 relative to the TRP. The MC1
+    origin of each frame is moved by the relative rotation and the translation is the
+    change from the previous frame. The first frame has no translation.
+
+    Parameters
+    ----------
+    r_relative : numpy.array
+        (F, 3, 3) array of relative rotation matrices
+
+    origins : numpy.array
+        (F, 3) array with the MC1 origin at each frame
+
+    Returns
+    -------
+    translations : numpy.array
+        (F, 3) array of the X, Y, and Z translations
+
+    transformed_origins : numpy.array
+        (F, 3) array of the transformed origins
+    """
+    transformed_origins = np.einsum("fij,fj->fi", r_relative, origins)
+
+    translations = np.zeros_like(transformed_origins)
+    translations[1:] = transformed_origins[1:] - transformed_origins[:-1]
+
+    return translations, transformed_origins
+
+
+def joint_motion_batch(mc1_points, trp_points):
+    """
+    Computes the SCSs, relative rotations, joint angles, and translations for
+    a stack of frames.
+
+    Parameters
+    ----------
+    mc1_points : numpy.array
+        (F, 3, 3) array of MC1 landmarks: 1) LDT, 2) MDT, 3) M1TJ (origin)
+
+    trp_points : numpy.array
+        (F, 4, 3) array of TRP landmarks: 1) TM1J (origin), 2) TM2J, 3) TSTJ,
+        4) TDET
+
+    Returns
+    -------
+    motion : dict
+        mc1_scs, trp_scs, and r_relative are (F, 3, 3) arrays. angles is an
+        (F, 3) array of the abduction-adduction, flexion-extension, and axial
+        rotation in degrees. translations and origins are (F, 3) arrays.
+    """
+    mc1_points = np.asarray(mc1_points, dtype=float)
+    trp_points = np.asarray(trp_points, dtype=float)
+
+    mc1_scs = calculate_mc1_scs_batch(mc1_points)
+    trp_scs = calculate_trp_scs_batch(trp_points)
+    r_relative = relative_rotation_batch(mc1_scs, trp_scs)
+
+    # Abduction, flexion, and internal rotation are positive
+    # Adduction, extension, and external rotation are negative
+    alpha, beta, gama = np.rad2deg(cardan_angles_batch(r_relative)).T
+    angles = np.stack([alpha, gama, beta], axis=1)
+
+    translations, origins = translations_batch(r_relative, mc1_points[:, 2])
+
+    motion = {
+        "mc1_scs": mc1_scs,
+        "trp_scs": trp_scs,
+        "r_relative": r_relative,
+        "angles": angles,
+        "translations": translations,
+        "origins": origins,
+    }
+    return motion
@@ -0,0 +1,244 @@
+"""
+landmark_uncertainty.py
+
+Created on: Oct. 18, 2026
+
+Description: Monte Carlo estimate of the joint motion uncertainty caused by
+             landmark picking. The MC1 and TRP landmarks are perturbed with a
+             given fiducial localization error (FLE), every sample is moved
+             through the XCT -> DYNACT frame transforms, and per-frame
+             confidence intervals of the joint angles and translations are
+             computed from the samples. Samples are processed in chunks, which
+             can run in parallel processes.
+"""
+
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+
+from .joint_motion import (
+    joint_motion_batch,
+    transform_points_batch,
+)
+
+# Joint motion components, in the order of the last axis of the results
+motion_names = ["ab_ad", "flex_ext", "ax_rot", "t_x", "t_y", "t_z"]
+
+
+def perturb_landmarks(pnts, fle, num_samples, rng):
+    """
+    Adds random localization errors to a set of landmarks. The FLE is the RMS
+    3D distance between the picked and true landmark, so each coordinate gets
+    Gaussian noise with a standard deviation of FLE / sqrt(3).
+
+    Parameters
+    ----------
+    pnts : numpy.array
+        (P, 3) array of landmarks
+
+    fle : float or numpy.array
+        FLE in mm, either one value or one value per landmark
+
+    num_samples : int
+
+    rng : numpy.random.Generator
+
+    Returns
+    -------
+    numpy.array
+        (S, P, 3) array of perturbed landmarks
+    """
+    pnts = np.asarray(pnts, dtype=float)
+    sigma = np.reshape(np.asarray(fle, dtype=float) / np.sqrt(3), (-1, 1))
+    noise = rng.standard_normal((num_samples,) + pnts.shape)
+    return pnts + noise * sigma
+
+
+def motion_samples(mc1_samples, trp_samples, mc1_matrices, trp_matrices):
+    """
+    Computes the joint motion of every sample at every frame.
+
+    Parameters
+    ----------
+    mc1_samples : numpy.array
+        (S, 3, 3) array of MC1 landmarks in XCT space
+
+    trp_samples : numpy.array
+        (S, 4, 3) array of TRP landmarks in XCT space
+
+    mc1_matrices : numpy.array
+        (F, 4, 4) array of the MC1 XCT to DYNACT frame matrices
+
+    trp_matrices : numpy.array
+        (F, 4, 4) array of the TRP XCT to DYNACT frame matrices
+
+    Returns
+    -------
+    numpy.array
+        (S, F, 6) array of the abduction-adduction, flexion-extension, axial
+        rotation (degrees), and X, Y, Z translations
+    """
+    num_samples = mc1_samples.shape[0]
+    num_frames = mc1_matrices.shape[0]
+
+    # (S, P, 3) -> (S * P, 3) so all samples are moved with one product
+    mc1_frames = transform_points_batch(mc1_matrices, mc1_samples.reshape(-1, 3))
+    trp_frames = transform_points_batch(trp_matrices, trp_samples.reshape(-1, 3))
+
+    # (F, S * P, 3) -> (S, F, P, 3)
+    mc1_frames = mc1_frames.reshape(num_frames, num_samples, 3, 3).transpose(1, 0, 2, 3)
+    trp_frames = trp_frames.reshape(num_frames, num_samples, 4, 3).transpose(1, 0, 2, 3)
+
+    motion = np.zeros((num_samples, num_frames, 6))
+    for i in range(num_samples):
+        sample = joint_motion_batch(mc1_frames[i], trp_frames[i])
+        motion[i, :, :3] = sample["angles"]
+        motion[i, :, 3:] = sample["translations"]
+
+    return motion
+
+
+def sample_chunk(args):
+    """
+    Draws and evaluates one chunk of samples. Runs in the worker processes of
+    monte_carlo_motion.
+
+    Parameters
+    ----------
+    args : list
+        MC1 and TRP landmarks, MC1 and TRP matrices, MC1 and TRP FLE, number
+        of samples, and the numpy.random.SeedSequence of the chunk
+
+    Returns
+    -------
+    numpy.array
+        (S, F, 6) array of joint motion samples
+    """
+    mc1_pnts, trp_pnts, mc1_matrices, trp_matrices, mc1_fle, trp_fle, n, seed = args
+    rng = np.random.default_rng(seed)
+
+    mc1_samples = perturb_landmarks(mc1_pnts, mc1_fle, n, rng)
+    trp_samples = perturb_landmarks(trp_pnts, trp_fle, n, rng)
+
+    return motion_samples(mc1_samples, trp_samples, mc1_matrices, trp_matrices)
+
+
+def confidence_intervals(samples, confidence=0.95):
+    """
+    Summarizes joint motion samples.
+
+    Parameters
+    ----------
+    samples : numpy.array
+        (S, F, 6) array of joint motion samples
+
+    confidence : float
+        Coverage of the two-sided percentile interval
+
+    Returns
+    -------
+    summary : dict
+        mean, std, lower, and upper (F, 6) arrays
+    """
+    alpha = (1 - confidence) / 2
+    lower, upper = np.nanpercentile(samples, [100 * alpha, 100 * (1 - alpha)], axis=0)
+
+    summary = {
+        "mean": np.nanmean(samples, axis=0),
+        "std": np.nanstd(samples, axis=0),
+        "lower": lower,
+        "upper": upper,
+    }
+    return summary
+
+
+def monte_carlo_motion(
+    mc1_pnts,
+    trp_pnts,
+    mc1_matrices,
+    trp_matrices,
+    mc1_fle,
+    trp_fle=None,
+    num_samples=10000,
+    confidence=0.95,
+    chunk_size=1000,
+    workers=1,
+    seed=None,
+):
+    """
+    Estimates the per-frame joint motion uncertainty caused by landmark
+    localization errors. Results are reproducible for a given seed and do not
+    depend on the number of workers.
+
+    Parameters
+    ----------
+    mc1_pnts : numpy.array
+        (3, 3) array of MC1 landmarks in XCT (ITK world) coordinates
+
+    trp_pnts : numpy.array
+        (4, 3) array of TRP landmarks in XCT (ITK world) coordinates
+
+    mc1_matrices : numpy.array
+        (F, 4, 4) array of the MC1 XCT to DYNACT frame matrices (e.g., the
+        composed chain of the transform store)
+
+    trp_matrices : numpy.array
+        (F, 4, 4) array of the TRP XCT to DYNACT frame matrices
+
+    mc1_fle : float or numpy.array
+        MC1 FLE in mm (one value or one per landmark)
+
+    trp_fle : float or numpy.array
+        TRP FLE in mm. Uses the MC1 FLE if None.
+
+    num_samples : int
+
+    confidence : float
+
+    chunk_size : int
+        Number of samples evaluated at once
+
+    workers : int
+        Number of processes. 1 evaluates all chunks in this process.
+
+    seed : int
+
+    Returns
+    -------
+    result : dict
+        nominal (joint motion of the picked landmarks), mean, std, lower, and
+        upper (F, 6) arrays. The last axis follows motion_names.
+    """
+    if trp_fle is None:
+        trp_fle = mc1_fle
+
+    mc1_pnts = np.asarray(mc1_pnts, dtype=float)
+    trp_pnts = np.asarray(trp_pnts, dtype=float)
+    mc1_matrices = np.asarray(mc1_matrices, dtype=float)
+    trp_matrices = np.asarray(trp_matrices, dtype=float)
+
+    # One seed per chunk so the samples do not depend on the chunk scheduling
+    chunk_sizes = [chunk_size] * (num_samples // chunk_size)
+    if num_samples % chunk_size:
+        chunk_sizes.append(num_samples % chunk_size)
+    seeds = np.random.SeedSequence(seed).spawn(len(chunk_sizes))
+
+    args_list = [
+        [mc1_pnts, trp_pnts, mc1_matrices, trp_matrices, mc1_fle, trp_fle, n, s]
+        for n, s in zip(chunk_sizes, seeds)
+    ]
+    if workers == 1:
+        chunk_list = [sample_chunk(args) for args in args_list]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            chunk_list = list(executor.map(sample_chunk, args_list))
+
+    samples = np.concatenate(chunk_list)
+
+    nominal = joint_motion_batch(
+        transform_points_batch(mc1_matrices, mc1_pnts),
+        transform_points_batch(trp_matrices, trp_pnts),
+    )
+
+    result = confidence_intervals(samples, confidence)
+    result["nominal"] = np.hstack([nominal["angles"], nominal["translations"]])
+    return result
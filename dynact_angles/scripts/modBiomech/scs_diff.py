@@ -43,3 +43,29 @@ def scs_diff(input_arr1, input_arr2):
     v = np.rad2deg(v)
 
     return v
+
+
+def scs_diff_pairwise(scs_arr):
+    """
+    Finds the angle between each axis of the SCSs of every pair of raters for
+    every frame in one pass.
+
+    Parameters
+    ----------
+    scs_arr : numpy.array
+        (R, F, 3, 3) array with the X, Y, and Z axes (rows) of each rater's SCS
+        at each frame
+
+    Returns
+    -------
+    v : numpy.array
+        (R, R, F, 3) array of the X, Y, and Z axis differences (in degrees)
+        between rater i and rater j
+    """
+    unit_arr = scs_arr / np.linalg.norm(scs_arr, axis=-1, keepdims=True)
+    cos_arr = np.einsum("afij,bfij->abfi", unit_arr, unit_arr)
+
+    # Clip round-off so identical axes give 0 instead of NaN
+    v = np.rad2deg(np.arccos(np.clip(cos_arr, -1.0, 1.0)))
+
+    return v
@@ -5,3 +5,19 @@ from .resample import resample
 from .batch_resample import batch_resample
 from .sitk_data_types import data_type_dict, sitk_pixelID_enum
 from .sitk_interpolators import interp_dict, interp_dict_enum
+from .dynact_stack import DynactStack, find_dynact_frames
+from .roi import (
+    mask_bounding_box,
+    crop_to_bounding_box,
+    crop_to_mask,
+    component_bounding_boxes,
+    apply_in_bounding_boxes,
+)
+from .transform_matrix import transform_to_matrix, matrix_to_euler
+from .async_writer import AsyncWriter
+from .registration_profiles import load_profile, read_profiles, setup_registration
+from .reference_context import ReferenceContext, multi_resolution_registration
+from .transform_store import TransformStore, transform_store
+from .moments import image_moments, combine_moments, principal_axes
+from .stage_graph import Stage, StageGraph
+from .slab_filter import slab_ranges, filter_slabs
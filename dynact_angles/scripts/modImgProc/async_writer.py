@@ -0,0 +1,161 @@
+"""
+async_writer.py
+
+Created on: Oct. 18, 2026
+
+Description: Writes SimpleITK images and transforms on a background thread so
+             compression and disk I/O overlap with the next computation. Jobs
+             are run in the order they are submitted.
+"""
+
+import queue
+import threading
+import SimpleITK as sitk
+
+
+class AsyncWriter:
+    """
+    Background writer with a bounded queue. Submitting blocks when the queue is
+    full, so memory use is bounded by the queue size.
+
+    Parameters
+    ----------
+    max_queue : int
+        Maximum number of pending jobs. 0 writes synchronously on the calling
+        thread.
+    """
+
+    def __init__(self, max_queue=8):
+        self.max_queue = max_queue
+        self.error = None
+        self.queue = None
+        self.thread = None
+
+        if max_queue > 0:
+            self.queue = queue.Queue(maxsize=max_queue)
+            self.thread = threading.Thread(target=self.run, daemon=True)
+            self.thread.start()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        # Queued jobs are always finished, but a write error is only raised if
+        # the block succeeded, so it does not hide the original exception
+        self.close(check=exc_type is None)
+
+    def run(self):
+        """
+        Runs queued jobs until the stop signal (None) is received. After the first
+        failure, remaining jobs are skipped and the error is raised on the calling
+        thread.
+
+        Returns
+        -------
+
+        """
+        while True:
+            job = self.queue.get()
+            if job is None:
+                break
+
+            func, args = job
+            if self.error is None:
+                try:
+                    func(*args)
+                except Exception as e:
+                    self.error = e
+
+    def check(self):
+        """
+        Raises any error from the background thread.
+
+        Returns
+        -------
+
+        """
+        if self.error is not None:
+            raise RuntimeError("Background write failed") from self.error
+
+    def submit(self, func, *args):
+        """
+        Queues a job. Jobs run in submission order, so a job can depend on all
+        earlier writes being finished (e.g., recording a completed frame).
+
+        Parameters
+        ----------
+        func : function
+
+        args : list
+            Arguments passed to func
+
+        Returns
+        -------
+
+        """
+        self.check()
+
+        if self.queue is None:
+            func(*args)
+        else:
+            self.queue.put((func, args))
+
+    def write_image(self, img, file_path, compress=False):
+        """
+        Queues a SimpleITK image write.
+
+        Parameters
+        ----------
+        img : SimpleITK.Image
+
+        file_path : string
+
+        compress : bool
+
+        Returns
+        -------
+
+        """
+        print("Writing to {}".format(file_path))
+        self.submit(sitk.WriteImage, img, file_path, compress)
+
+    def write_transform(self, tfm, file_path):
+        """
+        Queues a SimpleITK transform write.
+
+        Parameters
+        ----------
+        tfm : SimpleITK.TFM
+
+        file_path : string
+
+        Returns
+        -------
+
+        """
+        print("Writing to {}".format(file_path))
+        self.submit(sitk.WriteTransform, tfm, file_path)
+
+    def close(self, check=True):
+        """
+        Waits for all queued jobs to finish.
+
+        Parameters
+        ----------
+        check : bool
+            Raise any error from the background thread. If False, the error is
+            only printed.
+
+        Returns
+        -------
+
+        """
+        if self.thread is not None:
+            self.queue.put(None)
+            self.thread.join()
+            self.thread = None
+
+        if check:
+            self.check()
+        elif self.error is not None:
+            print("Background write failed: {}".format(self.error))
@@ -10,8 +10,16 @@ Modified by:        Michael Kuczynski
 Modified on:        2020.26.08
 Modification notes: Updated to use SimpleITK and take more optional arguments.
 
+Modified on:        Oct. 18, 2026
+Modification notes: Resamples all Volume_* series in a process pool. Each series
+                    is written to <output_path>/<series>_Resampled.nii, progress
+                    is shown on a single line, and failed series are listed at
+                    the end instead of stopping the batch. Each worker runs
+                    SimpleITK with one thread, and the default number of
+                    workers is capped since each holds a full volume.
+
 Usage:
-  python resample.py Input_path Output_path SpacingX SpacingY SpacingZ
+  python batch_resample.py Input_path Output_path SpacingX SpacingY SpacingZ
 
 Optional arguments:
   -i interpolatorType       Accepted types: linear, spline, nearestneighbor, or gaussian
@@ -21,31 +29,129 @@ Optional arguments:
   -t output_data_type         Select a valid output data type:
                                 0=uint8, 1=int8, 2=uint16, 3=int16, 4=uint32, 5=int32
                                 6=uint64, 7=int64, 8=float32, 9=float64, -1=unknown
+  -w workers                Number of processes (default = number of CPUs, at most 4)
+  -p pattern                Series directories to resample (default = Volume_*)
 """
 
 import os
+import re
+import sys
+import time
+import fnmatch
 import argparse
+import SimpleITK as sitk
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+try:
+    from .resample import resample
+except ImportError:
+    # Running as a script
+    from resample import resample
+
+# Default maximum number of worker processes. Each worker holds a full series
+# and its resampled image in memory.
+max_default_workers = 4
+
+
+def find_series(input_path, pattern="Volume_*"):
+    """
+    Finds the series directories to resample, in natural order (Volume_2 before
+    Volume_10).
+
+    Parameters
+    ----------
+    input_path : string
+
+    pattern : string
+        Shell-style pattern of the series directory names
+
+    Returns
+    -------
+    series_list : list
+    """
+    series_list = []
+    with os.scandir(input_path) as it:
+        for entry in it:
+            if entry.is_dir() and fnmatch.fnmatch(entry.name, pattern):
+                series_list.append(entry.name)
+
+    def natural_key(name):
+        return [int(s) if s.isdigit() else s for s in re.split(r"(\d+)", name)]
+
+    return sorted(series_list, key=natural_key)
+
+
+def init_worker():
+    """
+    Runs SimpleITK with one thread in each worker, since the series are already
+    resampled in parallel.
+    """
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(1)
+
+
+def resample_series(task):
+    """
+    Resamples one series quietly. Runs in a worker process.
+
+    Parameters
+    ----------
+    task : list
+        [series_dir, output_file, resample arguments...]
+
+    Returns
+    -------
+    seconds : float
+    """
+    start = time.time()
+    resample(*task, verbose=False)
+
+    return time.time() - start
+
 
-from resample import Resample
+def print_status(done, total, num_failed):
+    """
+    Prints the batch progress on one line.
+
+    Parameters
+    ----------
+    done : int
+
+    total : int
+
+    num_failed : int
+    """
+    sys.stdout.write(
+        "\rResampled {}/{} series ({} failed)".format(done, total, num_failed)
+    )
+    if done == total:
+        sys.stdout.write("\n")
+    sys.stdout.flush()
 
 
 def batch_resample(
     input_path,
     output_path,
     new_spacing,
-    new_origin,
-    new_size,
-    new_direction,
-    interpolator,
-    output_data_type,
+    new_origin=None,
+    new_size=None,
+    new_direction=None,
+    interpolator=None,
+    output_data_type=None,
+    workers=None,
+    pattern="Volume_*",
 ):
     """
+    Resamples every series directory in input_path. Series are independent, so
+    they are resampled in parallel. A failed series is reported and does not
+    stop the others.
 
     Parameters
     ----------
     input_path : string
+        Directory containing the series directories
 
     output_path : string
+        Output directory. Each series is written to <series>_Resampled.nii.
 
     new_spacing : list
 
@@ -59,38 +165,106 @@ def batch_resample(
 
     output_data_type : int
 
+    workers : int
+        Number of processes. 1 runs all series in this process. Default = number
+        of CPUs, at most max_default_workers.
+
+    pattern : string
+        Shell-style pattern of the series directory names
+
     Returns
     -------
-
+    failures : list
+        [series, error] for each failed series
     """
-    try:
-        os.makedirs(os.path.join(input_path[0:-10], "RESAMPLED"))
-    except FileExistsError:
-        pass
-
-    for next_dir in os.listdir(input_path):
-        output_path = os.path.join(
-            os.path.join(input_path[0:-10], "RESAMPLED"), next_dir + "_Resampled.nii"
+    if not os.path.isdir(output_path):
+        os.makedirs(output_path)
+
+    task_dict = {}
+    for series in find_series(input_path, pattern):
+        task_dict[series] = [
+            os.path.join(input_path, series),
+            os.path.join(output_path, series + "_Resampled.nii"),
+            new_spacing,
+            new_origin,
+            new_size,
+            new_direction,
+            interpolator,
+            output_data_type,
+        ]
+
+    print(
+        "Resampling {} series from {} to {}".format(
+            len(task_dict), input_path, output_path
         )
-        next_dir = os.path.join(input_path, next_dir)
+    )
+    if not task_dict:
+        return []
+
+    if workers is None:
+        workers = min(os.cpu_count() or 1, max_default_workers)
+
+    failures = []
+    done = 0
+    print_status(done, len(task_dict), len(failures))
+
+    if workers == 1:
+        for series, task in task_dict.items():
+            try:
+                resample_series(task)
+            except Exception as e:
+                failures.append([series, str(e)])
+            done += 1
+            print_status(done, len(task_dict), len(failures))
+    else:
+        with ProcessPoolExecutor(
+            max_workers=workers, initializer=init_worker
+        ) as executor:
+            future_dict = {
+                executor.submit(resample_series, task): series
+                for series, task in task_dict.items()
+            }
+            for future in as_completed(future_dict):
+                try:
+                    future.result()
+                except Exception as e:
+                    failures.append([future_dict[future], str(e)])
+                done += 1
+                print_status(done, len(task_dict), len(failures))
 
-        if os.path.isdir(next_dir):
-            Resample(
-                next_dir,
-                output_path,
-                new_spacing,
-                new_origin,
-                new_size,
-                new_direction,
-                interpolator,
-                output_data_type,
-            )
+    # Report failures in series order, not the order they finished
+    series_list = list(task_dict)
+    return sorted(failures, key=lambda f: series_list.index(f[0]))
+
+
+def print_failures(failures):
+    """
+    Prints a table of the failed series.
+
+    Parameters
+    ----------
+    failures : list
+        [series, error] for each failed series
+    """
+    if not failures:
+        return
+
+    width = max(len("Series"), max(len(series) for series, _ in failures))
+    print("{} series failed:".format(len(failures)))
+    print("{}  {}".format("Series".ljust(width), "Error"))
+    print("{}  {}".format("-" * width, "-" * 5))
+    for series, error in failures:
+        # SimpleITK errors start with the source location; the reason is last
+        lines = error.strip().splitlines() or [""]
+        print("{}  {}".format(series.ljust(width), lines[-1]))
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Resample an image using SimpleITK")
-    parser.add_argument("input_path", help="The input image file path")
-    parser.add_argument("output_path", help="The output image file path")
+    parser.add_argument(
+        "input_path", help="Directory containing the DICOM series directories"
+    )
+    parser.add_argument("output_path", help="Output directory for the resampled images")
     parser.add_argument(
         "new_spacing", nargs=3, type=float, help="The new voxel spacing"
     )
@@ -128,6 +302,22 @@ if __name__ == "__main__":
         type=int,
         help="The resampled image data type",
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of processes. Default = number of CPUs, at most {}".format(
+            max_default_workers
+        ),
+    )
+    parser.add_argument(
+        "-p",
+        "--pattern",
+        type=str,
+        default="Volume_*",
+        help="Series directories to resample. Default = Volume_*",
+    )
     args = parser.parse_args()
 
     # Parse arguments
@@ -140,7 +330,7 @@ if __name__ == "__main__":
     interpolator = args.interpolator
     output_data_type = args.output_data_type
 
-    batch_resample(
+    failures = batch_resample(
         input_path,
         output_path,
         new_spacing,
@@ -149,4 +339,10 @@ if __name__ == "__main__":
         new_direction,
         interpolator,
         output_data_type,
+        args.workers,
+        args.pattern,
     )
+
+    if failures:
+        print_failures(failures)
+        sys.exit(1)
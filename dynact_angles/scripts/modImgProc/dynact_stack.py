@@ -0,0 +1,237 @@
+"""
+dynact_stack.py
+
+Created on: Oct. 18, 2026
+
+Description: Loads all resampled DYNACT frames (Volume_<n>_Resampled.nii) into a
+             single contiguous 4D float32 array (frame, z, y, x). The array is
+             cached as a memory-mapped .npy file beside the input directory so
+             later runs skip NIfTI decoding and only page in the frames they use.
+"""
+
+import os
+import re
+import json
+import numpy as np
+import SimpleITK as sitk
+
+# Matches resampled DYNACT frames and captures the volume number
+frame_pattern = re.compile(r"^Volume_(\d+)_Resampled\.nii(\.gz)?$")
+
+
+def find_dynact_frames(dynact_dir):
+    """
+    Finds all resampled DYNACT frames in a directory.
+
+    Parameters
+    ----------
+    dynact_dir : string
+
+    Returns
+    -------
+    frame_dict : dict
+        Maps each volume number (1...N) to the frame file path
+    """
+    frame_dict = {}
+    with os.scandir(dynact_dir) as it:
+        for entry in it:
+            match = frame_pattern.match(entry.name)
+            if match and entry.is_file():
+                frame_dict[int(match.group(1))] = entry.path
+
+    return frame_dict
+
+
+class DynactStack:
+    """
+    All frames of a DYNACT scan stored in one 4D float32 array.
+
+    The stack is backed by <dynact_dir>_STACK.npy and <dynact_dir>_STACK.json
+    (array + image geometry and source file information). The cache is rebuilt
+    whenever the frames in the input directory change.
+
+    Parameters
+    ----------
+    dynact_dir : string
+        Directory containing the Volume_<n>_Resampled.nii frames
+
+    cache_path : string
+        Optional path for the .npy cache file
+    """
+
+    def __init__(self, dynact_dir, cache_path=None):
+        self.dynact_dir = os.path.abspath(dynact_dir)
+
+        if cache_path is None:
+            cache_path = self.dynact_dir.rstrip(os.sep) + "_STACK.npy"
+        self.cache_path = cache_path
+        self.meta_path = os.path.splitext(cache_path)[0] + ".json"
+
+        self.frame_dict = find_dynact_frames(self.dynact_dir)
+        self.frame_nums = sorted(self.frame_dict)
+
+        self.array = None
+        self.origin = None
+        self.spacing = None
+        self.direction = None
+
+    def __len__(self):
+        return len(self.frame_nums)
+
+    def source_info(self):
+        """
+        Collects the size and modification time of every frame file. Used to
+        check if the cache is still valid.
+
+        Returns
+        -------
+        info : dict
+        """
+        info = {}
+        for num in self.frame_nums:
+            stat = os.stat(self.frame_dict[num])
+            info[str(num)] = [stat.st_size, stat.st_mtime]
+
+        return info
+
+    def cache_is_valid(self):
+        """
+        Checks if the cache exists and matches the frames on disk.
+
+        Returns
+        -------
+        bool
+        """
+        if not (os.path.isfile(self.cache_path) and os.path.isfile(self.meta_path)):
+            return False
+
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+
+        return (
+            meta.get("frame_nums") == self.frame_nums
+            and meta.get("sources") == self.source_info()
+        )
+
+    def load(self):
+        """
+        Memory-maps the cached stack, building the cache first if needed.
+
+        Returns
+        -------
+        self : DynactStack
+        """
+        if not self.frame_nums:
+            raise FileNotFoundError(
+                "No Volume_<n>_Resampled.nii frames found in " + self.dynact_dir
+            )
+
+        if not self.cache_is_valid():
+            self.build_cache()
+
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+
+        self.origin = tuple(meta["origin"])
+        self.spacing = tuple(meta["spacing"])
+        self.direction = tuple(meta["direction"])
+        self.array = np.load(self.cache_path, mmap_mode="r")
+
+        return self
+
+    def build_cache(self):
+        """
+        Reads every frame once and writes the 4D stack to the .npy cache. The
+        cache is written to a temporary file first so an interrupted build never
+        leaves a partial cache behind.
+
+        Returns
+        -------
+
+        """
+        print("Building DYNACT stack cache: {}".format(self.cache_path))
+
+        first_frame = sitk.ReadImage(
+            self.frame_dict[self.frame_nums[0]], sitk.sitkFloat32
+        )
+        frame_shape = sitk.GetArrayViewFromImage(first_frame).shape
+
+        tmp_path = self.cache_path + ".tmp"
+        stack = np.lib.format.open_memmap(
+            tmp_path,
+            mode="w+",
+            dtype=np.float32,
+            shape=(len(self.frame_nums),) + frame_shape,
+        )
+
+        for k, num in enumerate(self.frame_nums):
+            print("Reading: {}".format(self.frame_dict[num]))
+            if k == 0:
+                frame = first_frame
+            else:
+                frame = sitk.ReadImage(self.frame_dict[num], sitk.sitkFloat32)
+
+            frame_arr = sitk.GetArrayViewFromImage(frame)
+            if frame_arr.shape != frame_shape:
+                del stack
+                os.remove(tmp_path)
+                raise ValueError(
+                    "Frame {} has shape {}, expected {}".format(
+                        num, frame_arr.shape, frame_shape
+                    )
+                )
+            stack[k] = frame_arr
+
+        stack.flush()
+        del stack
+        os.replace(tmp_path, self.cache_path)
+
+        meta = {
+            "frame_nums": self.frame_nums,
+            "sources": self.source_info(),
+            "origin": list(first_frame.GetOrigin()),
+            "spacing": list(first_frame.GetSpacing()),
+            "direction": list(first_frame.GetDirection()),
+        }
+        with open(self.meta_path, "w") as f:
+            json.dump(meta, f, indent=2)
+
+    def frame_array(self, volume_num):
+        """
+        Returns a zero-copy (memory-mapped) view of a single frame.
+
+        Parameters
+        ----------
+        volume_num : int
+            Volume number of the frame (1...N)
+
+        Returns
+        -------
+        numpy.array
+            Frame voxels in (z, y, x) order
+        """
+        if self.array is None:
+            self.load()
+
+        return self.array[self.frame_nums.index(volume_num)]
+
+    def get_frame(self, volume_num):
+        """
+        Returns a single frame as a SimpleITK image. Only the requested frame is
+        paged in and copied out of the cache.
+
+        Parameters
+        ----------
+        volume_num : int
+            Volume number of the frame (1...N)
+
+        Returns
+        -------
+        frame : SimpleITK.Image
+        """
+        frame = sitk.GetImageFromArray(self.frame_array(volume_num))
+        frame.SetOrigin(self.origin)
+        frame.SetSpacing(self.spacing)
+        frame.SetDirection(self.direction)
+
+        return frame
@@ -0,0 +1,179 @@
+"""
+moments.py
+
+Created on: Oct. 18, 2026
+
+Description: Computes the image moments (total mass, centroid, central second
+             moments, principal moments, and principal axes) of a SimpleITK
+             image in physical coordinates. Only the foreground (non-zero)
+             voxels are used, read through a zero-copy array view, so no ITK
+             image has to be created. The results follow the conventions of
+             itk.ImageMomentsCalculator (voxel values as mass, principal axes
+             in the rows in ascending order of the principal moments, and a
+             right-handed set of axes).
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+
+def foreground_points(img):
+    """
+    Finds the physical coordinates and values of the non-zero voxels of an
+    image.
+
+    Parameters
+    ----------
+    img : SimpleITK.Image
+
+    Returns
+    -------
+    points : numpy.array
+        (K, D) array of physical points
+
+    weights : numpy.array
+        (K,) array of voxel values
+    """
+    if img.GetNumberOfComponentsPerPixel() > 1:
+        raise ValueError("Image moments need a scalar image")
+
+    # FORMAT: (z, y, x) view of the image buffer
+    arr = sitk.GetArrayViewFromImage(img)
+    nonzero = np.nonzero(arr)
+    weights = arr[nonzero].astype(np.float64)
+
+    # Reverse to (x, y, z) indices, then index -> physical space
+    dim = img.GetDimension()
+    index = np.stack(nonzero[::-1], axis=1).astype(np.float64)
+    origin = np.array(img.GetOrigin())
+    spacing = np.array(img.GetSpacing())
+    direction = np.reshape(img.GetDirection(), (dim, dim))
+    points = origin + (index * spacing).dot(direction.T)
+
+    return points, weights
+
+
+def image_moments(img):
+    """
+    Computes the moments of an image in physical coordinates.
+
+    Parameters
+    ----------
+    img : SimpleITK.Image
+
+    Returns
+    -------
+    moments : dict
+        mass : float
+            Sum of the voxel values
+
+        centroid : numpy.array
+            (D,) centre of gravity
+
+        second_moments : numpy.array
+            (D, D) central second moments (inertia tensor)
+
+        principal_moments : numpy.array
+            (D,) eigenvalues of the second moments, in ascending order
+
+        principal_axes : numpy.array
+            (D, D) unit eigenvectors of the second moments, in the rows. The
+            sign of each axis is arbitrary, but the last axis is flipped if
+            needed so the axes form a proper rotation.
+    """
+    points, weights = foreground_points(img)
+
+    mass = weights.sum()
+    if mass == 0:
+        raise ValueError("Total mass of the image is zero")
+
+    centroid = weights.dot(points) / mass
+    centred = points - centroid
+    second_moments = (centred * weights[:, np.newaxis]).T.dot(centred) / mass
+
+    return _principal_moments(mass, centroid, second_moments)
+
+
+def combine_moments(moments_list):
+    """
+    Computes the moments of the sum of several images from the moments of each
+    image (e.g., the combined image of all fiducials from the moments of each
+    fiducial image), without reading the images again.
+
+    Parameters
+    ----------
+    moments_list : list
+        Output of image_moments for each image. Only mass, centroid, and
+        second_moments are used.
+
+    Returns
+    -------
+    moments : dict
+        Same keys as image_moments
+    """
+    mass_arr = np.array([m["mass"] for m in moments_list], dtype=float)
+    centroid_arr = np.array([m["centroid"] for m in moments_list], dtype=float)
+    second_arr = np.array([m["second_moments"] for m in moments_list], dtype=float)
+
+    mass = mass_arr.sum()
+    if mass == 0:
+        raise ValueError("Total mass of the images is zero")
+
+    # Parallel axis theorem: shift each image's second moments to the combined
+    # centroid before averaging
+    centroid = mass_arr.dot(centroid_arr) / mass
+    offset = centroid_arr - centroid
+    second_moments = (
+        np.einsum("n,nij->ij", mass_arr, second_arr)
+        + np.einsum("n,ni,nj->ij", mass_arr, offset, offset)
+    ) / mass
+
+    return _principal_moments(mass, centroid, second_moments)
+
+
+def principal_axes(img):
+    """
+    Computes the principal axes of an image in physical coordinates.
+
+    Parameters
+    ----------
+    img : SimpleITK.Image
+
+    Returns
+    -------
+    numpy.array
+        (D, D) array with one principal axis in each row
+    """
+    return image_moments(img)["principal_axes"]
+
+
+def _principal_moments(mass, centroid, second_moments):
+    """
+    Adds the principal moments and axes to the mass, centroid, and second
+    moments of an image.
+
+    Parameters
+    ----------
+    mass : float
+
+    centroid : numpy.array
+
+    second_moments : numpy.array
+
+    Returns
+    -------
+    moments : dict
+        See image_moments
+    """
+    principal_moments, eigenvectors = np.linalg.eigh(second_moments)
+    principal_axes = eigenvectors.T
+    principal_axes[-1] *= np.sign(np.linalg.det(principal_axes))
+
+    moments = {
+        "mass": mass,
+        "centroid": centroid,
+        "second_moments": second_moments,
+        "principal_moments": principal_moments,
+        "principal_axes": principal_axes,
+    }
+    return moments
@@ -0,0 +1,151 @@
+"""
+reference_context.py
+
+Created on: Oct. 18, 2026
+
+Description: Reference (moving) image data that is shared by many registrations.
+             SimpleITK rebuilds the smoothing pyramid of the moving image on every
+             ImageRegistrationMethod.Execute. When the same reference image is
+             registered to many fixed images (e.g., every DYNACT frame), the
+             smoothed levels are computed once here and each level is registered
+             separately, passing the transform on to the next level.
+"""
+
+import SimpleITK as sitk
+
+
+def smooth_image(img, sigma):
+    """
+    Smooths an image for one pyramid level, like the SimpleITK multi-resolution
+    framework (discrete Gaussian, sigma in physical units).
+
+    Parameters
+    ----------
+    img : SimpleITK.Image
+
+    sigma : float
+        Smoothing sigma (mm). No smoothing if sigma is 0.
+
+    Returns
+    -------
+    smoothed_img : SimpleITK.Image
+    """
+    if sigma <= 0:
+        return img
+
+    return sitk.DiscreteGaussian(
+        img, variance=float(sigma) ** 2, maximumError=0.01, useImageSpacing=True
+    )
+
+
+class ReferenceContext:
+    """
+    Smoothed pyramid levels and masks of a reference image, computed once.
+
+    Parameters
+    ----------
+    image : SimpleITK.Image
+        Reference (moving) image
+
+    shrink_factors : list
+        Shrink factor per pyramid level (coarse to fine)
+
+    smoothing_sigmas : list
+        Smoothing sigma per pyramid level (mm)
+
+    mask : SimpleITK.Image
+        Reference bone mask (optional)
+
+    dilated_mask : SimpleITK.Image
+        Dilated reference bone mask (optional)
+    """
+
+    def __init__(
+        self, image, shrink_factors, smoothing_sigmas, mask=None, dilated_mask=None
+    ):
+        if len(shrink_factors) != len(smoothing_sigmas):
+            raise ValueError("Need one smoothing sigma per shrink factor")
+
+        self.image = image
+        self.mask = mask
+        self.dilated_mask = dilated_mask
+        self.shrink_factors = list(shrink_factors)
+        self.smoothing_sigmas = list(smoothing_sigmas)
+
+        # Levels with the same sigma share one smoothed image
+        smoothed_dict = {}
+        for sigma in self.smoothing_sigmas:
+            if sigma not in smoothed_dict:
+                smoothed_dict[sigma] = smooth_image(image, sigma)
+        self.levels = [smoothed_dict[sigma] for sigma in self.smoothing_sigmas]
+
+        # Geometric centre of the reference image
+        self.center = image.TransformContinuousIndexToPhysicalPoint(
+            [(sz - 1) / 2.0 for sz in image.GetSize()]
+        )
+
+    def __len__(self):
+        return len(self.levels)
+
+
+def multi_resolution_registration(reg_factory, init_tfm, fixed, context):
+    """
+    Registers a fixed image to a reference context one pyramid level at a time.
+    Only the fixed image is smoothed here, the reference levels are reused.
+
+    Each level's registration method is created by reg_factory(level) and should
+    have its metric, interpolator, sampling, and optimizer set. The pyramid is set
+    here: the image grid is shrunk by the level's shrink factor, and the images are
+    already smoothed. Image gradients are computed at the sample points only
+    instead of over the whole images, which is much cheaper with sparse sampling.
+
+    Parameters
+    ----------
+    reg_factory : function
+        Returns a SimpleITK.ImageRegistrationMethod for a pyramid level
+
+    init_tfm : SimpleITK.TFM
+
+    fixed : SimpleITK.Image
+
+    context : ReferenceContext
+
+    Returns
+    -------
+    final_tfm : SimpleITK.TFM
+
+    level_iterations : list
+        Optimizer iterations used at each pyramid level
+    """
+    tfm = init_tfm
+    final_tfm = init_tfm
+    level_iterations = []
+
+    for level in range(len(context)):
+        reg = reg_factory(level)
+
+        reg.SetShrinkFactorsPerLevel(shrinkFactors=[context.shrink_factors[level]])
+        reg.SetSmoothingSigmasPerLevel(smoothingSigmas=[0])
+        reg.SetMetricUseFixedImageGradientFilter(False)
+        reg.SetMetricUseMovingImageGradientFilter(False)
+
+        # Don't optimize in-place, the initial transform may be reused
+        reg.SetInitialTransform(tfm, inPlace=False)
+
+        fixed_level = smooth_image(fixed, context.smoothing_sigmas[level])
+        final_tfm = reg.Execute(fixed_level, context.levels[level])
+
+        # Execute wraps the optimized transform in a composite transform. Only pass
+        # the optimized transform on to the next level.
+        tfm = sitk.CompositeTransform(final_tfm).GetNthTransform(0)
+
+        level_iterations.append(reg.GetOptimizerIteration())
+        print(
+            "Level {}: metric value {}, {}".format(
+                level,
+                reg.GetMetricValue(),
+                reg.GetOptimizerStopConditionDescription(),
+            )
+        )
+
+    return final_tfm, level_iterations
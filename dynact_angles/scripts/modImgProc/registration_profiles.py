@@ -0,0 +1,162 @@
+"""
+registration_profiles.py
+
+Created on: Oct. 18, 2026
+
+Description: Named registration presets (pyramid, metric sampling, optimizer, and
+             convergence settings) read from a YAML config file. The default
+             config is registration_profiles.yml beside this module.
+"""
+
+import os
+import yaml
+import SimpleITK as sitk
+
+default_config_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "registration_profiles.yml"
+)
+
+# Supported optimizers and metric sampling strategies
+optimizer_list = ["Powell", "RegularStepGradientDescent", "LBFGSB"]
+sampling_dict = {
+    "RANDOM": sitk.ImageRegistrationMethod.RANDOM,
+    "REGULAR": sitk.ImageRegistrationMethod.REGULAR,
+    "NONE": sitk.ImageRegistrationMethod.NONE,
+}
+
+
+def read_profiles(config_path=None):
+    """
+    Reads all registration profiles from a config file.
+
+    Parameters
+    ----------
+    config_path : string
+        Path to the YAML config. Uses the default config if None.
+
+    Returns
+    -------
+    profile_dict : dict
+        Maps each profile name to its settings
+    """
+    if config_path is None:
+        config_path = default_config_path
+
+    with open(config_path, "r") as f:
+        profile_dict = yaml.safe_load(f)
+
+    return profile_dict
+
+
+def load_profile(name, config_path=None):
+    """
+    Loads and checks a registration profile.
+
+    Parameters
+    ----------
+    name : string
+
+    config_path : string
+        Path to the YAML config. Uses the default config if None.
+
+    Returns
+    -------
+    profile : dict
+    """
+    profile_dict = read_profiles(config_path)
+
+    if name not in profile_dict:
+        raise ValueError(
+            "Unknown registration profile {}. Choose from {}".format(
+                name, ", ".join(profile_dict)
+            )
+        )
+
+    profile = dict(profile_dict[name])
+    profile["name"] = name
+
+    num_levels = len(profile["shrink_factors"])
+    if len(profile["smoothing_sigmas"]) != num_levels:
+        raise ValueError(
+            "Profile {}: smoothing_sigmas must have one value per level".format(name)
+        )
+
+    # A single sampling percentage is used for every level
+    if not isinstance(profile["sampling_percentage"], list):
+        profile["sampling_percentage"] = [profile["sampling_percentage"]] * num_levels
+    if len(profile["sampling_percentage"]) != num_levels:
+        raise ValueError(
+            "Profile {}: sampling_percentage must have one value per level".format(name)
+        )
+
+    if profile["sampling_strategy"] not in sampling_dict:
+        raise ValueError(
+            "Profile {}: unknown sampling strategy {}".format(
+                name, profile["sampling_strategy"]
+            )
+        )
+    if profile["optimizer"] not in optimizer_list:
+        raise ValueError(
+            "Profile {}: unknown optimizer {}".format(name, profile["optimizer"])
+        )
+
+    profile.setdefault("seed", None)
+    profile.setdefault("optimizer_settings", {})
+
+    return profile
+
+
+def setup_registration(reg, profile, sampling_scale=1.0, level=None):
+    """
+    Sets the metric sampling, optimizer, and multi-resolution settings of a
+    registration method from a profile. The metric and interpolator are left to
+    the caller.
+
+    If a pyramid level is given, only that level's sampling is set and the
+    multi-resolution settings are left to the caller (see
+    reference_context.multi_resolution_registration).
+
+    Parameters
+    ----------
+    reg : SimpleITK.ImageRegistrationMethod
+
+    profile : dict
+
+    sampling_scale : float
+        Factor applied to the sampling percentages (e.g., for cropped images)
+
+    level : int
+        Pyramid level to set up. None sets up all levels.
+
+    Returns
+    -------
+    reg : SimpleITK.ImageRegistrationMethod
+    """
+    # Metric sampling
+    reg.SetMetricSamplingStrategy(sampling_dict[profile["sampling_strategy"]])
+
+    percentages = [
+        min(1.0, percentage * sampling_scale)
+        for percentage in profile["sampling_percentage"]
+    ]
+    if level is not None:
+        percentages = [percentages[level]]
+    if profile["seed"] is None:
+        reg.SetMetricSamplingPercentagePerLevel(percentages)
+    else:
+        reg.SetMetricSamplingPercentagePerLevel(percentages, int(profile["seed"]))
+
+    # Optimizer and convergence settings
+    set_optimizer = getattr(reg, "SetOptimizerAs" + profile["optimizer"])
+    set_optimizer(**profile["optimizer_settings"])
+    reg.SetOptimizerScalesFromPhysicalShift()
+
+    if level is not None:
+        return reg
+
+    # Multi-resolution framework
+    reg.SetShrinkFactorsPerLevel(shrinkFactors=profile["shrink_factors"])
+    reg.SetSmoothingSigmasPerLevel(smoothingSigmas=profile["smoothing_sigmas"])
+    reg.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
+
+    return reg
@@ -28,8 +28,13 @@ import sys
 import argparse
 import SimpleITK as sitk
 
-from sitk_interpolators import interp_dict, interp_dict_enum
-from sitk_data_types import data_type_dict, sitk_pixelID_enum
+try:
+    from .sitk_interpolators import interp_dict, interp_dict_enum
+    from .sitk_data_types import data_type_dict, sitk_pixelID_enum
+except ImportError:
+    # Running as a script
+    from sitk_interpolators import interp_dict, interp_dict_enum
+    from sitk_data_types import data_type_dict, sitk_pixelID_enum
 
 
 def resample(
@@ -41,17 +46,43 @@ def resample(
     new_direction,
     interpolator,
     output_data_type,
+    verbose=True,
 ):
     """
     Resamples an image using specified parameters.
 
     Parameters
     ----------
+    input_path : string
+        DICOM series directory
+
+    output_path : string
+
+    new_spacing : list
+
+    new_origin : list
+
+    new_size : list
+
+    new_direction : list
+
+    interpolator : string
+
+    output_data_type : int
+
+    verbose : bool
+        Print the image information and resampling progress
 
     Returns
     -------
+    resampled_path : string
     """
-    print(input_path)
+
+    def log(*args, **kwargs):
+        if verbose:
+            print(*args, **kwargs)
+
+    log(input_path)
     reader = sitk.ImageSeriesReader()
     dicom_names = reader.GetGDCMSeriesFileNames(input_path)
     reader.SetFileNames(dicom_names)
@@ -70,16 +101,16 @@ def resample(
 
     # Check optional arguements
     if interpolator is None or interpolator.lower() not in interp_dict:
-        print("** Invalid or no interpolator provided. Using: linear interpolator")
+        log("** Invalid or no interpolator provided. Using: linear interpolator")
         sitk_interp = sitk.sitkLinear
     else:
         sitk_interp = interp_dict.get(interpolator.lower())
-        print(
+        log(
             "** Using: provided interpolator: " + str(interp_dict_enum.get(sitk_interp))
         )
 
     if new_origin is None:
-        print(
+        log(
             "** Invalid or no image origin provided. Using: "
             + str(image_origin)
             + " as the resampled origin"
@@ -87,14 +118,14 @@ def resample(
         resampled_origin = image_origin
     else:
         resampled_origin = new_origin
-        print(
+        log(
             "** Using provided origin: "
             + str(resampled_origin)
             + " as the resampled origin"
         )
 
     if new_direction is None:
-        print(
+        log(
             "** Invalid or no image direction provided. Using: "
             + str(image_direction)
             + " as the resampled direction"
@@ -102,16 +133,14 @@ def resample(
         resampled_direction = image_direction
     else:
         resampled_direction = new_direction
-        print(
+        log(
             "** Using provided direction: "
             + str(resampled_direction)
             + " as the resampled direction"
         )
 
     if new_size is None:
-        print(
-            "** Invalid or no image dimensions provided. Calculating new image size..."
-        )
+        log("** Invalid or no image dimensions provided. Calculating new image size...")
 
         # Formula to calculate new image dimensions:
         # newDim = oldDim * oldSpacing / new_spacing
@@ -127,46 +156,46 @@ def resample(
         ]
         resampled_size = temp
 
-        print("   Using new image dimensions of: " + str(resampled_size))
+        log("   Using new image dimensions of: " + str(resampled_size))
     else:
         resampled_size = new_size
-        print("   Using provided image dimensions of: " + str(resampled_size))
+        log("   Using provided image dimensions of: " + str(resampled_size))
 
     if output_data_type is None or output_data_type not in sitk_pixelID_enum:
-        print(
+        log(
             "** Invalid or no output data type provided. Using: "
             + str(image.GetPixelIDTypeAsString())
         )
         resampled_data_type = image_data_type
     else:
         resampled_data_type = output_data_type
-        print(
+        log(
             "** Using provided data type: "
             + str(sitk_pixelID_enum.get(resampled_data_type))
         )
 
     # Print some information about the image
-    print()
-    print("*******************************************************")
-    print("Input Image Information:")
-    print("Dimensions:  " + str(image_size))
-    print("Spacing:     " + str(image_spacing))
-    print("Origin:      " + str(image_origin))
-    print("Direction:   " + str(image_direction))
-    print("Data Type:   " + image.GetPixelIDTypeAsString())
-    print("*******************************************************")
-    print("Resampled Image Information:")
-    print("Dimensions:   " + str(resampled_size))
-    print("Spacing:      " + str(resampled_spacing))
-    print("Origin:       " + str(resampled_origin))
-    print("Direction:    " + str(resampled_direction))
-    print("Data Type:    " + str(sitk_pixelID_enum.get(resampled_data_type)))
-    print("Interpolator: " + str(interp_dict_enum.get(sitk_interp)))
-    print("*******************************************************")
-    print()
+    log()
+    log("*******************************************************")
+    log("Input Image Information:")
+    log("Dimensions:  " + str(image_size))
+    log("Spacing:     " + str(image_spacing))
+    log("Origin:      " + str(image_origin))
+    log("Direction:   " + str(image_direction))
+    log("Data Type:   " + image.GetPixelIDTypeAsString())
+    log("*******************************************************")
+    log("Resampled Image Information:")
+    log("Dimensions:   " + str(resampled_size))
+    log("Spacing:      " + str(resampled_spacing))
+    log("Origin:       " + str(resampled_origin))
+    log("Direction:    " + str(resampled_direction))
+    log("Data Type:    " + str(sitk_pixelID_enum.get(resampled_data_type)))
+    log("Interpolator: " + str(interp_dict_enum.get(sitk_interp)))
+    log("*******************************************************")
+    log()
 
     # Resample the image
-    print("** Resampling...")
+    log("** Resampling...")
     resample_filter = sitk.ResampleImageFilter()
     resample_filter.SetSize(resampled_size)
     resample_filter.SetOutputOrigin(resampled_origin)
@@ -176,30 +205,31 @@ def resample(
     resample_filter.SetOutputPixelType(resampled_data_type)
 
     # Print resampling progress
-    resample_filter.AddCommand(
-        sitk.sitkProgressEvent,
-        lambda: print(
-            "\rProgress: {0:03.1f}%...".format(100 * resample_filter.GetProgress()),
-            end="",
-        ),
-    )
-    resample_filter.AddCommand(sitk.sitkProgressEvent, lambda: sys.stdout.flush())
+    if verbose:
+        resample_filter.AddCommand(
+            sitk.sitkProgressEvent,
+            lambda: print(
+                "\rProgress: {0:03.1f}%...".format(100 * resample_filter.GetProgress()),
+                end="",
+            ),
+        )
+        resample_filter.AddCommand(sitk.sitkProgressEvent, lambda: sys.stdout.flush())
 
     resampled_image = resample_filter.Execute(image)
 
-    print("Done!")
+    log("Done!")
 
-    print("*******************************************************")
-    print("Resample Information:")
-    print(resample_filter)
-    print("*******************************************************")
-    print()
+    log("*******************************************************")
+    log("Resample Information:")
+    log(resample_filter)
+    log("*******************************************************")
+    log()
 
     # Write out the resampled image
-    print("Writing resampled image to: " + str(resampled_path))
+    log("Writing resampled image to: " + str(resampled_path))
     sitk.WriteImage(resampled_image, resampled_path)
 
-    return
+    return resampled_path
 
 
 if __name__ == "__main__":
@@ -0,0 +1,274 @@
+"""
+roi.py
+
+Created on: Oct. 18, 2026
+
+Description: Functions to crop images to the bounding box of a binary mask.
+             Cropping with SimpleITK keeps the physical coordinates (origin,
+             spacing, direction) of each voxel, so transforms computed on
+             cropped images are valid for the full images.
+"""
+
+import SimpleITK as sitk
+
+
+def pad_bounding_box(index, size, img_size, margin):
+    """
+    Pads a bounding box by a margin and clips it to the image extent.
+
+    Parameters
+    ----------
+    index : list
+        Start index of the bounding box
+
+    size : list
+        Size of the bounding box
+
+    img_size : list
+        Size of the image the bounding box belongs to
+
+    margin : list
+        Number of voxels to pad in each direction
+
+    Returns
+    -------
+    index : list
+
+    size : list
+    """
+    start = [max(0, int(index[i]) - int(margin[i])) for i in range(len(index))]
+    end = [
+        min(int(img_size[i]), int(index[i]) + int(size[i]) + int(margin[i]))
+        for i in range(len(index))
+    ]
+    size = [end[i] - start[i] for i in range(len(index))]
+
+    return start, size
+
+
+def mask_bounding_box(mask, margin=[0, 0, 0], label=None):
+    """
+    Finds the bounding box of the foreground of a mask, padded by a margin.
+
+    Parameters
+    ----------
+    mask : SimpleITK.Image
+        Binary or label image
+
+    margin : list
+        Number of voxels to pad in each direction
+
+    label : int
+        Label to use. If None, all non-zero voxels are used.
+
+    Returns
+    -------
+    index : list
+        Start index of the bounding box (None if the mask is empty)
+
+    size : list
+        Size of the bounding box (None if the mask is empty)
+    """
+    if label is None:
+        mask = sitk.Cast(mask != 0, sitk.sitkUInt8)
+        label = 1
+
+    stats = sitk.LabelShapeStatisticsImageFilter()
+    stats.Execute(mask)
+
+    if not stats.HasLabel(label):
+        return None, None
+
+    # FORMAT: [xStart, yStart, zStart, xSize, ySize, zSize]
+    bbox = stats.GetBoundingBox(label)
+    dim = mask.GetDimension()
+
+    return pad_bounding_box(bbox[:dim], bbox[dim:], mask.GetSize(), margin)
+
+
+def crop_to_bounding_box(img, index, size):
+    """
+    Crops an image to a bounding box. The cropped image keeps its physical
+    position (the origin is moved to the first voxel of the bounding box).
+
+    Parameters
+    ----------
+    img : SimpleITK.Image
+
+    index : list
+
+    size : list
+
+    Returns
+    -------
+    cropped_img : SimpleITK.Image
+    """
+    cropped_img = sitk.RegionOfInterest(img, size, index)
+
+    return cropped_img
+
+
+def crop_to_mask(img, mask, margin=[0, 0, 0]):
+    """
+    Crops an image to the bounding box of a mask (on the same grid), padded by a
+    margin. Returns the input image if the mask is empty.
+
+    Parameters
+    ----------
+    img : SimpleITK.Image
+
+    mask : SimpleITK.Image
+
+    margin : list
+
+    Returns
+    -------
+    cropped_img : SimpleITK.Image
+    """
+    index, size = mask_bounding_box(mask, margin)
+    if index is None:
+        return img
+
+    return crop_to_bounding_box(img, index, size)
+
+
+def component_bounding_boxes(mask, margin=[0, 0, 0]):
+    """
+    Finds the bounding box of each connected component of the foreground of a
+    mask, padded by a margin. Padded boxes that overlap are merged, so the
+    returned boxes are disjoint.
+
+    Parameters
+    ----------
+    mask : SimpleITK.Image
+        Binary image
+
+    margin : list
+        Number of voxels to pad in each direction
+
+    Returns
+    -------
+    box_list : list
+        [index, size] of each box. Empty if the mask is empty.
+    """
+    stats = sitk.LabelShapeStatisticsImageFilter()
+    stats.Execute(sitk.ConnectedComponent(sitk.Cast(mask != 0, sitk.sitkUInt8)))
+
+    dim = mask.GetDimension()
+    box_list = []
+    for label in stats.GetLabels():
+        bbox = stats.GetBoundingBox(label)
+        box_list.append(
+            pad_bounding_box(bbox[:dim], bbox[dim:], mask.GetSize(), margin)
+        )
+
+    # Merge overlapping boxes until none overlap. Each pass compares every box
+    # with the merged boxes only, so many small components stay fast.
+    while True:
+        merged_list = []
+        for box in box_list:
+            for k, merged_box in enumerate(merged_list):
+                if _boxes_overlap(merged_box, box):
+                    merged_list[k] = _merge_boxes(merged_box, box)
+                    break
+            else:
+                merged_list.append(box)
+
+        if len(merged_list) == len(box_list):
+            break
+        box_list = merged_list
+
+    return box_list
+
+
+def apply_in_bounding_boxes(func, img, margin=[0, 0, 0], per_component=False):
+    """
+    Runs a filter only inside the padded bounding box of the foreground of a
+    binary image (or of each connected component) and pastes the results into
+    a full-size output. The rest of the output is background. For filters
+    whose output stays within the margin of the foreground (e.g., morphology
+    with a radius smaller than the margin), the result is the same as running
+    the filter on the whole image.
+
+    Parameters
+    ----------
+    func : function
+        Takes and returns a SimpleITK.Image
+
+    img : SimpleITK.Image
+        Binary image
+
+    margin : list
+        Number of voxels to pad in each direction
+
+    per_component : bool
+        Use one box per connected component instead of one box around all of
+        the foreground
+
+    Returns
+    -------
+    output_img : SimpleITK.Image
+    """
+    if per_component:
+        box_list = component_bounding_boxes(img, margin)
+    else:
+        index, size = mask_bounding_box(img, margin)
+        box_list = [] if index is None else [[index, size]]
+
+    # Nothing to restrict to
+    if not box_list:
+        return func(img)
+
+    output_img = None
+    for index, size in box_list:
+        sub_img = func(crop_to_bounding_box(img, index, size))
+        if output_img is None:
+            output_img = sitk.Image(img.GetSize(), sub_img.GetPixelID())
+            output_img.CopyInformation(img)
+        output_img = sitk.Paste(
+            output_img, sub_img, sub_img.GetSize(), [0] * img.GetDimension(), index
+        )
+
+    return output_img
+
+
+def _boxes_overlap(box1, box2):
+    """
+    Checks if two boxes ([index, size]) overlap.
+
+    Parameters
+    ----------
+    box1 : list
+
+    box2 : list
+
+    Returns
+    -------
+    bool
+    """
+    return all(
+        box1[0][i] < box2[0][i] + box2[1][i] and box2[0][i] < box1[0][i] + box1[1][i]
+        for i in range(len(box1[0]))
+    )
+
+
+def _merge_boxes(box1, box2):
+    """
+    Finds the smallest box ([index, size]) that contains two boxes.
+
+    Parameters
+    ----------
+    box1 : list
+
+    box2 : list
+
+    Returns
+    -------
+    list
+    """
+    start = [min(box1[0][i], box2[0][i]) for i in range(len(box1[0]))]
+    end = [
+        max(box1[0][i] + box1[1][i], box2[0][i] + box2[1][i])
+        for i in range(len(box1[0]))
+    ]
+    return [start, [end[i] - start[i] for i in range(len(start))]]
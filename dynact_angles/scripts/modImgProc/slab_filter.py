@@ -0,0 +1,227 @@
+"""
+slab_filter.py
+
+Created on: Oct. 18, 2026
+
+Description: Runs a filter over an image file in slabs along the z-axis so the
+             whole image never has to be in memory. Each slab is read with
+             sitk.ImageFileReader's extract region support, padded by a halo of
+             neighbouring slices so filters with a z-radius see the same
+             neighbourhood as on the whole image, and the filtered slices are
+             written into a memory-mapped raw file. A MetaImage header pointing
+             at the raw file is written last, so the output can be read with
+             sitk.ReadImage and an interrupted run leaves no valid image.
+             Reading is only streamed for formats that support it
+             (uncompressed MetaImage or NIfTI). Other formats (e.g., .nii.gz)
+             are filtered in a single pass over the whole image, with a
+             warning, since reading them once per slab would read the whole
+             image for every slab.
+"""
+
+import os
+import numpy as np
+import SimpleITK as sitk
+
+# Numpy data types -> MetaImage element types
+meta_type_dict = {
+    "uint8": "MET_UCHAR",
+    "int8": "MET_CHAR",
+    "uint16": "MET_USHORT",
+    "int16": "MET_SHORT",
+    "uint32": "MET_UINT",
+    "int32": "MET_INT",
+    "uint64": "MET_ULONG_LONG",
+    "int64": "MET_LONG_LONG",
+    "float32": "MET_FLOAT",
+    "float64": "MET_DOUBLE",
+}
+
+
+def can_stream(file_path):
+    """
+    Checks if slabs of an image file can be read without reading the whole
+    file. Only uncompressed NIfTI and MetaImage files can be streamed.
+
+    Parameters
+    ----------
+    file_path : string
+
+    Returns
+    -------
+    bool
+    """
+    name = file_path.lower()
+    if name.endswith(".nii"):
+        return True
+    if not name.endswith((".mha", ".mhd")):
+        return False
+
+    # The MetaImage header is text and ends at ElementDataFile
+    with open(file_path, "rb") as f:
+        for line in f:
+            key, _, value = line.decode("latin-1").partition("=")
+            key = key.strip()
+            if key == "CompressedData" and value.strip().lower() == "true":
+                return False
+            if key == "ElementDataFile":
+                break
+
+    return True
+
+
+def slab_ranges(num_slices, slab_size, halo=0):
+    """
+    Splits the slices of an image into slabs.
+
+    Parameters
+    ----------
+    num_slices : int
+
+    slab_size : int
+        Number of output slices in each slab
+
+    halo : int
+        Number of extra slices read on each side of a slab
+
+    Returns
+    -------
+    ranges : list
+        [start, stop, read_start, read_stop] of each slab. Slices start to stop
+        are written; read_start to read_stop (clipped to the image) are read.
+    """
+    if slab_size < 1:
+        raise ValueError("Slab size must be at least one slice")
+
+    ranges = []
+    for start in range(0, num_slices, slab_size):
+        stop = min(start + slab_size, num_slices)
+        read_start = max(start - halo, 0)
+        read_stop = min(stop + halo, num_slices)
+        ranges.append([start, stop, read_start, read_stop])
+
+    return ranges
+
+
+def write_meta_header(header_path, data_file, img_info, dtype):
+    """
+    Writes a MetaImage header for a raw data file.
+
+    Parameters
+    ----------
+    header_path : string
+
+    data_file : string
+        Name of the raw file, relative to the header
+
+    img_info : sitk.ImageFileReader
+        Reader of the input image (size, spacing, origin, direction)
+
+    dtype : numpy.dtype
+        Data type of the raw file
+    """
+    dtype = np.dtype(dtype)
+    if dtype.name not in meta_type_dict:
+        raise ValueError("Unsupported data type for MetaImage: {}".format(dtype))
+
+    def join(values):
+        return " ".join(str(v) for v in values)
+
+    lines = [
+        "ObjectType = Image",
+        "NDims = {}".format(img_info.GetDimension()),
+        "BinaryData = True",
+        "BinaryDataByteOrderMSB = {}".format(dtype.byteorder == ">"),
+        "CompressedData = False",
+        "TransformMatrix = {}".format(join(img_info.GetDirection())),
+        "Offset = {}".format(join(img_info.GetOrigin())),
+        "ElementSpacing = {}".format(join(img_info.GetSpacing())),
+        "DimSize = {}".format(join(img_info.GetSize())),
+        "ElementType = {}".format(meta_type_dict[dtype.name]),
+        "ElementDataFile = {}".format(data_file),
+    ]
+
+    # Write to a temporary file first so a partial header is never read
+    tmp_path = header_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, header_path)
+
+
+def filter_slabs(input_path, output_path, function, slab_size=64, halo=0):
+    """
+    Runs a filter over a 3D image file slab by slab. Peak memory is bounded by
+    the size of a slab (plus its halo), not the size of the image. Files that
+    cannot be streamed (see can_stream) are filtered in one slab.
+
+    Parameters
+    ----------
+    input_path : string
+
+    output_path : string
+        MetaImage header (.mha or .mhd). The data is written to a .raw file
+        with the same name.
+
+    function : function
+        Called with each slab (SimpleITK.Image). Must return an image of the
+        same size.
+
+    slab_size : int
+        Number of slices filtered at once
+
+    halo : int
+        Number of neighbouring slices read on each side of a slab (e.g., the
+        z-radius of the filter kernel)
+
+    Returns
+    -------
+    output_path : string
+    """
+    reader = sitk.ImageFileReader()
+    reader.SetFileName(input_path)
+    reader.ReadImageInformation()
+
+    if reader.GetDimension() != 3:
+        raise ValueError("Slab filtering needs a 3D image: {}".format(input_path))
+
+    size = list(reader.GetSize())
+    if not can_stream(input_path):
+        print(
+            "WARNING: {} cannot be read in slabs (compressed or unsupported "
+            "format). Filtering the whole image at once.".format(input_path)
+        )
+        slab_size = size[2]
+    ranges = slab_ranges(size[2], slab_size, halo)
+
+    raw_path = os.path.splitext(output_path)[0] + ".raw"
+    if os.path.isfile(output_path):
+        os.remove(output_path)
+
+    out_arr = None
+    for i, (start, stop, read_start, read_stop) in enumerate(ranges):
+        print(
+            "Filtering slices {}-{} ({}/{})...".format(
+                start, stop - 1, i + 1, len(ranges)
+            )
+        )
+        reader.SetExtractIndex([0, 0, read_start])
+        reader.SetExtractSize([size[0], size[1], read_stop - read_start])
+        slab_img = function(reader.Execute())
+
+        # FORMAT: (z, y, x)
+        slab_arr = sitk.GetArrayViewFromImage(slab_img)
+        if out_arr is None:
+            # Data type of the filter output is only known after the first slab
+            out_arr = np.memmap(
+                raw_path, dtype=slab_arr.dtype, mode="w+", shape=tuple(size[::-1])
+            )
+        out_arr[start:stop] = slab_arr[start - read_start : stop - read_start]
+        del slab_arr, slab_img
+
+    out_arr.flush()
+    dtype = out_arr.dtype
+    del out_arr
+
+    print("Writing to {}".format(output_path))
+    write_meta_header(output_path, os.path.basename(raw_path), reader, dtype)
+
+    return output_path
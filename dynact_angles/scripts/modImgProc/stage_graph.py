@@ -0,0 +1,374 @@
+"""
+stage_graph.py
+
+Created on: Oct. 18, 2026
+
+Description: Runs an image processing pipeline as a graph of stages. Each stage
+             is a function of the images of earlier stages and a set of
+             parameters. The output of each stage is cached on disk under a key
+             built from the hash of the input file, the function, and the
+             parameters of the stage and all stages before it. Re-running the
+             pipeline loads the cached outputs instead of recomputing them, so
+             an interrupted run resumes at the first missing stage and changing
+             a parameter only recomputes the stages that depend on it. Stages
+             can be skipped, in which case their input is passed through.
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import SimpleITK as sitk
+
+
+class Stage:
+    """
+    A node of a stage graph.
+
+    Parameters
+    ----------
+    name : string
+
+    function : function
+        Called with the input images (in order) and the parameters as keyword
+        arguments. Must return a SimpleITK.Image.
+
+    inputs : list
+        Names of the input stages
+
+    params : dict
+        Keyword arguments of the function. Must be JSON serializable.
+
+    skip : bool
+        Pass the first input through instead of running the function
+    """
+
+    def __init__(self, name, function, inputs, params=None, skip=False):
+        self.name = name
+        self.function = function
+        self.inputs = list(inputs)
+        self.params = dict(params or {})
+        self.skip = skip
+
+
+class StageGraph:
+    """
+    Graph of image processing stages with an on-disk cache of the stage
+    outputs.
+
+    Parameters
+    ----------
+    cache_dir : string
+        Directory for the cached stage outputs. Nothing is cached if None.
+
+    compress : bool
+        Compress the cached images
+    """
+
+    def __init__(self, cache_dir=None, compress=True):
+        self.cache_dir = cache_dir
+        self.compress = compress
+        self.sources = {}
+        self.stages = {}
+        self.images = {}
+        self.keys = {}
+
+        # Status (source, cached, computed, or skipped) and run time of each
+        # stage, in the order they are run
+        self.records = []
+
+        if cache_dir is not None and not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+
+    def add_source(self, name, file_path, img=None):
+        """
+        Adds an input image file. The image is only read if a stage that uses
+        it has to be computed.
+
+        Parameters
+        ----------
+        name : string
+
+        file_path : string
+
+        img : SimpleITK.Image
+            Image already read from file_path
+        """
+        self.sources[name] = file_path
+        if img is not None:
+            self.images[name] = img
+
+    def add_stage(self, name, function, inputs, params=None, skip=False):
+        """
+        Adds a stage to the graph.
+
+        Parameters
+        ----------
+        name : string
+
+        function : function
+
+        inputs : list
+
+        params : dict
+
+        skip : bool
+
+        Returns
+        -------
+        stage : Stage
+        """
+        for input_name in inputs:
+            if input_name not in self.sources and input_name not in self.stages:
+                raise ValueError(
+                    "Stage {} uses unknown input {}".format(name, input_name)
+                )
+
+        stage = Stage(name, function, inputs, params, skip)
+        self.stages[name] = stage
+        return stage
+
+    def key(self, name):
+        """
+        Computes the cache key of a source or stage. Skipped stages have the
+        key of their input, and stages that compute the same function of the
+        same inputs share a key (and a cached output). Functions are keyed by
+        name only, so editing a function does not invalidate its cached
+        outputs.
+
+        Parameters
+        ----------
+        name : string
+
+        Returns
+        -------
+        string
+        """
+        if name in self.keys:
+            return self.keys[name]
+
+        if name in self.sources:
+            sha1 = hashlib.sha1()
+            with open(self.sources[name], "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha1.update(chunk)
+            key = sha1.hexdigest()
+        else:
+            stage = self.stages[name]
+            input_keys = [self.key(input_name) for input_name in stage.inputs]
+            if stage.skip:
+                key = input_keys[0]
+            else:
+                description = {
+                    # Name only, so the key does not change when the module
+                    # is run as a script instead of imported
+                    "function": stage.function.__name__,
+                    "params": stage.params,
+                    "inputs": input_keys,
+                }
+                key = hashlib.sha1(
+                    json.dumps(description, sort_keys=True).encode()
+                ).hexdigest()
+
+        self.keys[name] = key
+        return key
+
+    def cache_path(self, name):
+        """
+        Returns the cache file of a stage.
+
+        Parameters
+        ----------
+        name : string
+
+        Returns
+        -------
+        string
+            None if there is no cache directory
+        """
+        if self.cache_dir is None:
+            return None
+
+        return os.path.join(self.cache_dir, self.key(name) + ".mha")
+
+    def is_cached(self, name):
+        """
+        Checks if the output of a stage is in memory or on disk.
+
+        Parameters
+        ----------
+        name : string
+
+        Returns
+        -------
+        bool
+        """
+        if name in self.images:
+            return True
+        if name in self.sources:
+            return False
+
+        cache_path = self.cache_path(name)
+        return cache_path is not None and os.path.isfile(cache_path)
+
+    def plan(self, targets):
+        """
+        Finds the stages that have to be loaded or run to get the targets, in
+        the order they are run. The inputs of stages that are already cached
+        are not needed.
+
+        Parameters
+        ----------
+        targets : list
+
+        Returns
+        -------
+        order : list
+        """
+        order = []
+        visited = set()
+
+        def visit(name):
+            if name in visited:
+                return
+            visited.add(name)
+
+            if name in self.stages and not self.is_cached(name):
+                for input_name in self.stages[name].inputs:
+                    visit(input_name)
+            order.append(name)
+
+        for name in targets:
+            visit(name)
+
+        return order
+
+    def run(self, targets):
+        """
+        Loads or computes the outputs of the target stages. Intermediate
+        images loaded by this run are released from memory once all stages
+        that use them are done. Runs on separate threads can share the graph
+        if the images they have in common are already in memory and the keys
+        have been computed.
+
+        Parameters
+        ----------
+        targets : list
+            Names of the stages to return
+
+        Returns
+        -------
+        images : dict
+            Output image of each target stage
+        """
+        order = self.plan(targets)
+
+        # Images that were already in memory (e.g., shared by several runs) are
+        # kept
+        loaded = [name for name in order if name not in self.images]
+
+        # Stages that use their inputs, and the number of them that use each image
+        uses_inputs = [
+            name for name in order if name in self.stages and not self.is_cached(name)
+        ]
+        consumers = {name: 0 for name in order}
+        for name in uses_inputs:
+            for input_name in self.stages[name].inputs:
+                consumers[input_name] += 1
+
+        for name in order:
+            if name not in self.images:
+                self.images[name] = self.compute(name)
+
+            if name not in uses_inputs:
+                continue
+            for input_name in self.stages[name].inputs:
+                consumers[input_name] -= 1
+                if (
+                    consumers[input_name] == 0
+                    and input_name not in targets
+                    and input_name in loaded
+                ):
+                    self.release(input_name)
+
+        return {name: self.images[name] for name in targets}
+
+    def result(self, name):
+        """
+        Loads or computes the output of one stage.
+
+        Parameters
+        ----------
+        name : string
+
+        Returns
+        -------
+        SimpleITK.Image
+        """
+        return self.run([name])[name]
+
+    def compute(self, name):
+        """
+        Reads a source, loads a cached stage output, or runs a stage. The inputs
+        of the stage must already be in memory.
+
+        Parameters
+        ----------
+        name : string
+
+        Returns
+        -------
+        img : SimpleITK.Image
+        """
+        start = time.time()
+
+        if name in self.sources:
+            print("Reading {}".format(self.sources[name]))
+            img = sitk.ReadImage(self.sources[name])
+            status = "source"
+        else:
+            stage = self.stages[name]
+            cache_path = self.cache_path(name)
+            if stage.skip and stage.inputs[0] in self.images:
+                print("Skipping {}...".format(name))
+                img = self.images[stage.inputs[0]]
+                status = "skipped"
+            elif cache_path is not None and os.path.isfile(cache_path):
+                print("Loading cached {} ({})".format(name, cache_path))
+                img = sitk.ReadImage(cache_path)
+                status = "cached"
+            else:
+                input_imgs = [self.images[input_name] for input_name in stage.inputs]
+                img = stage.function(*input_imgs, **stage.params)
+                status = "computed"
+                if cache_path is not None:
+                    # Write to a temporary file first so an interrupted write is
+                    # never mistaken for a finished stage. Threads running
+                    # stages with the same key each write their own file.
+                    tmp_path = "{}.{}.{}.tmp.mha".format(
+                        cache_path[: -len(".mha")], os.getpid(), threading.get_ident()
+                    )
+                    sitk.WriteImage(img, tmp_path, self.compress)
+                    os.replace(tmp_path, cache_path)
+
+        self.records.append(
+            {
+                "stage": name,
+                "key": self.key(name),
+                "status": status,
+                "seconds": round(time.time() - start, 3),
+            }
+        )
+        return img
+
+    def release(self, name):
+        """
+        Removes an image from memory. It is loaded from the cache (or
+        recomputed) if it is needed again.
+
+        Parameters
+        ----------
+        name : string
+        """
+        self.images.pop(name, None)
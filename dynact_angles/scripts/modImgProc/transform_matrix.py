@@ -0,0 +1,71 @@
+"""
+transform_matrix.py
+
+Created on: Oct. 18, 2026
+
+Description: Converts between SimpleITK transforms and 4x4 homogeneous matrices.
+"""
+
+import numpy as np
+import SimpleITK as sitk
+
+
+def transform_to_matrix(tfm):
+    """
+    Converts a (composite) linear SimpleITK transform to a 4x4 homogeneous
+    matrix by transforming the origin and the unit vectors. Works for any
+    transform that is affine (e.g., Euler3D, VersorRigid3D, Similarity3D, or a
+    composite of these).
+
+    Parameters
+    ----------
+    tfm : SimpleITK.TFM
+
+    Returns
+    -------
+    matrix : numpy.array
+        4x4 matrix that maps [x, y, z, 1] the same way as tfm.TransformPoint
+    """
+    offset = np.array(tfm.TransformPoint((0.0, 0.0, 0.0)))
+
+    matrix = np.eye(4)
+    matrix[:3, 3] = offset
+    for i in range(3):
+        unit = [0.0, 0.0, 0.0]
+        unit[i] = 1.0
+        matrix[:3, i] = np.array(tfm.TransformPoint(unit)) - offset
+
+    return matrix
+
+
+def matrix_to_euler(matrix, center=(0.0, 0.0, 0.0)):
+    """
+    Converts a 4x4 rigid matrix to a SimpleITK Euler3DTransform with the given
+    centre of rotation. The rotation is projected onto the closest orthonormal
+    matrix to remove round-off from composing matrices.
+
+    Parameters
+    ----------
+    matrix : numpy.array
+        4x4 homogeneous matrix
+
+    center : list
+        Centre of rotation of the output transform
+
+    Returns
+    -------
+    tfm : SimpleITK.Euler3DTransform
+    """
+    u, _, vt = np.linalg.svd(matrix[:3, :3])
+    rotation = u.dot(vt)
+
+    # x' = R(x - c) + c + t  =>  t = offset - c + Rc
+    center = np.array(center, dtype=float)
+    translation = matrix[:3, 3] - center + rotation.dot(center)
+
+    tfm = sitk.Euler3DTransform()
+    tfm.SetCenter(center.tolist())
+    tfm.SetMatrix(rotation.flatten().tolist())
+    tfm.SetTranslation(translation.tolist())
+
+    return tfm
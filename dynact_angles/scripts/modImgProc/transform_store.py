@@ -0,0 +1,177 @@
+"""
+transform_store.py
+
+Created on: Oct. 18, 2026
+
+Description: In-memory store of the registration transforms of a scan. Each
+             .tfm file is parsed once into a 4x4 homogeneous matrix and reused
+             until its modification time changes. The store also composes the
+             full XCT -> CT -> DYNACT frame #1 -> DYNACT frame #n chain of a
+             bone into one (F, 4, 4) array so landmarks of any number of raters
+             can be moved to every frame with a single matrix product.
+"""
+
+import os
+import re
+import numpy as np
+import SimpleITK as sitk
+
+from .transform_matrix import transform_to_matrix
+
+
+class TransformStore:
+    """
+    Cache of transform matrices keyed on the file path and its mtime.
+    """
+
+    def __init__(self):
+        self.matrices = {}
+        self.chains = {}
+
+    def matrix(self, tfm_path):
+        """
+        Returns the 4x4 matrix of a .tfm file, reading the file only if it is
+        not cached or has changed since it was read.
+
+        Parameters
+        ----------
+        tfm_path : string
+
+        Returns
+        -------
+        numpy.array
+        """
+        mtime = os.stat(tfm_path).st_mtime_ns
+        cached = self.matrices.get(tfm_path)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        matrix = transform_to_matrix(sitk.ReadTransform(tfm_path))
+        self.matrices[tfm_path] = (mtime, matrix)
+        return matrix
+
+    def chain(
+        self, ct2xct_reg_dir, ct2dynact_reg_dir, dynact_reg_dir, bone, num_frames=None
+    ):
+        """
+        Reads the transform chain of one bone and composes the XCT to DYNACT
+        frame matrices. Frame #1 is the DYNACT reference frame, so its frame
+        transform is the identity.
+
+        Parameters
+        ----------
+        ct2xct_reg_dir : string
+            Directory with CT2XCT_<bone>_REG.tfm
+
+        ct2dynact_reg_dir : string
+            Directory with CT2DYNACT_<bone>_REG.tfm
+
+        dynact_reg_dir : string
+            Directory with VOLUME_REF_TO_<n>_<bone>_REG.tfm for n = 2...num_frames
+
+        bone : string
+            MC1 or TRP
+
+        num_frames : int
+            Number of DYNACT frames. If None, it is found from the frame
+            transforms in dynact_reg_dir.
+
+        Returns
+        -------
+        chain : dict
+            xct2ct and ct2dynact are 4x4 matrices. frames is an (F, 4, 4) array
+            of the DYNACT frame #1 to frame #n matrices and composed is the
+            (F, 4, 4) array of XCT to DYNACT frame #n matrices.
+        """
+        if num_frames is None:
+            num_frames = self.num_frames(dynact_reg_dir, bone)
+
+        ct2xct_path = os.path.join(ct2xct_reg_dir, "CT2XCT_" + bone + "_REG.tfm")
+        ct2dynact_path = os.path.join(
+            ct2dynact_reg_dir, "CT2DYNACT_" + bone + "_REG.tfm"
+        )
+        frame_paths = [
+            os.path.join(
+                dynact_reg_dir, "VOLUME_REF_TO_" + str(i) + "_" + bone + "_REG.tfm"
+            )
+            for i in range(2, num_frames + 1)
+        ]
+        paths = [ct2xct_path, ct2dynact_path] + frame_paths
+
+        # Reuse the composed chain if none of the files changed
+        key = tuple(paths)
+        mtimes = [os.stat(path).st_mtime_ns for path in paths]
+        cached = self.chains.get(key)
+        if cached is not None and cached[0] == mtimes:
+            return cached[1]
+
+        # The points are moved from XCT to CT, so invert the CT to XCT transform
+        xct2ct = np.linalg.inv(self.matrix(ct2xct_path))
+        ct2dynact = self.matrix(ct2dynact_path)
+
+        frames = np.empty((num_frames, 4, 4))
+        frames[0] = np.eye(4)
+        for i, path in enumerate(frame_paths):
+            frames[i + 1] = self.matrix(path)
+
+        composed = np.matmul(frames, ct2dynact.dot(xct2ct))
+
+        chain = {
+            "xct2ct": xct2ct,
+            "ct2dynact": ct2dynact,
+            "frames": frames,
+            "composed": composed,
+        }
+        self.chains[key] = (mtimes, chain)
+        return chain
+
+    def num_frames(self, dynact_reg_dir, bone):
+        """
+        Counts the DYNACT frames of a bone from its frame transforms
+        (VOLUME_REF_TO_<n>_<bone>_REG.tfm, n = 2...N).
+
+        Parameters
+        ----------
+        dynact_reg_dir : string
+
+        bone : string
+
+        Returns
+        -------
+        num_frames : int
+            N, the number of frames including the reference frame
+        """
+        pattern = re.compile(r"^VOLUME_REF_TO_(\d+)_" + re.escape(bone) + r"_REG\.tfm$")
+        frame_nums = set()
+        with os.scandir(dynact_reg_dir) as it:
+            for entry in it:
+                match = pattern.match(entry.name)
+                if match and entry.is_file():
+                    frame_nums.add(int(match.group(1)))
+
+        if not frame_nums:
+            raise ValueError(
+                "No {} frame transforms found in {}".format(bone, dynact_reg_dir)
+            )
+
+        num_frames = max(frame_nums)
+        missing = sorted(set(range(2, num_frames + 1)) - frame_nums)
+        if missing:
+            raise ValueError(
+                "Missing {} frame transforms in {}: volume(s) {}".format(
+                    bone, dynact_reg_dir, ", ".join(str(n) for n in missing)
+                )
+            )
+
+        return num_frames
+
+    def clear(self):
+        """
+        Removes all cached matrices.
+        """
+        self.matrices.clear()
+        self.chains.clear()
+
+
+# Shared store so every rater of a scan reuses the same parsed transforms
+transform_store = TransformStore()
@@ -3,5 +3,12 @@
 
 from .colours import Colours
 from .dynact_volume_sort import sort_dynact_volumes
-from .sitk_itk import sitk2itk, itk2sitk
 from .img_to_dicom import img_to_dicom
+from .cohort import read_cohort
+from .table_writer import TableWriter
+from .scan_layout import ScanLayout, get_layout
+from .results_store import ResultsStore, file_hash
+from .dicom_index import DicomIndex, read_header
+
+# sitk_itk is not imported here since it needs itk. Import sitk2itk and itk2sitk
+# from modMisc.sitk_itk instead.
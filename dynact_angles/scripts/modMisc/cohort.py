@@ -0,0 +1,82 @@
+"""
+cohort.py
+
+Created on: Oct. 18, 2026
+
+Description: Reads a cohort manifest (YAML) listing the scans to process, the
+             DYNACT series used for each scan, and the pipeline settings. Scans
+             that are not ready for processing are marked with skip: true instead
+             of being hard-coded in the scripts.
+
+Example manifest:
+  root: /path/to/dynact_angles        # Directory with models/, reg/, points/
+  settings:
+    profile: default
+  scans:
+    - scan: DYNACT1_002
+      series: B
+    - scan: DYNACT1_011
+      series: B
+      skip: true
+"""
+
+import os
+import yaml
+
+
+def read_cohort(manifest_path, include_skipped=False):
+    """
+    Reads a cohort manifest.
+
+    Parameters
+    ----------
+    manifest_path : string
+
+    include_skipped : bool
+        Also return scans marked with skip: true
+
+    Returns
+    -------
+    cohort : dict
+        Dictionary with the root directory ("root"), pipeline settings
+        ("settings"), and list of scans ("scans"). Each scan is a dictionary with
+        the scan name ("scan") and DYNACT series ("series"). The series is None
+        if it is not in the manifest, so it is found from the scan layout (see
+        modMisc/scan_layout.py).
+    """
+    with open(manifest_path, "r") as f:
+        manifest = yaml.safe_load(f) or {}
+
+    # Relative roots are relative to the manifest. The default root is the parent
+    # of the scripts directory.
+    root = manifest.get("root")
+    if root is None:
+        root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        root = os.path.dirname(root)
+    elif not os.path.isabs(root):
+        root = os.path.join(os.path.dirname(os.path.abspath(manifest_path)), root)
+
+    scans = []
+    for entry in manifest.get("scans", []):
+        if isinstance(entry, str):
+            entry = {"scan": entry}
+
+        if "scan" not in entry:
+            raise ValueError("Scan entry without a scan name: {}".format(entry))
+        if entry.get("skip", False) and not include_skipped:
+            continue
+
+        scan = dict(entry)
+        if scan.get("series") is not None:
+            scan["series"] = str(scan["series"]).upper()
+        else:
+            scan["series"] = None
+        scans.append(scan)
+
+    cohort = {
+        "root": os.path.abspath(root),
+        "settings": manifest.get("settings") or {},
+        "scans": scans,
+    }
+
+    return cohort
@@ -0,0 +1,219 @@
+"""
+dicom_index.py
+
+Created on: Oct. 18, 2026
+
+Description: Builds an index of the DICOM headers in a directory in one pass.
+             Each file is read once with stop_before_pixels=True, so no pixel
+             data is loaded, and the files can be read on a thread pool. The
+             index is an in-memory table (one row per file) with the file path,
+             series UID and description, instance number, acquisition time,
+             transfer syntax, and the collimation width and slice thickness used
+             to split DYNACT scans into volumes. It can be saved to and loaded
+             from a CSV file, and drives the volume and series sorting.
+"""
+
+import os
+import csv
+import pydicom
+from concurrent.futures import ThreadPoolExecutor
+
+from pydicom.errors import InvalidDicomError
+
+# Columns of the index and the type of each column
+index_columns = [
+    "path",
+    "series_uid",
+    "series_description",
+    "instance_number",
+    "acquisition_time",
+    "transfer_syntax",
+    "collimation_width",
+    "slice_thickness",
+]
+column_types = {
+    "instance_number": int,
+    "collimation_width": float,
+    "slice_thickness": float,
+}
+
+# Uncompressed Implicit VR Little-endian = 1.2.840.10008.1.2
+# Uncompressed Explicit VR Little-endian = 1.2.840.10008.1.2.1
+# Uncompressed Explicit VR Big-endian = 1.2.840.10008.1.2.2
+uncompressed_syntaxes = [
+    "1.2.840.10008.1.2",
+    "1.2.840.10008.1.2.1",
+    "1.2.840.10008.1.2.2",
+]
+
+
+def read_header(file_path):
+    """
+    Reads the header of a DICOM file without the pixel data.
+
+    Parameters
+    ----------
+    file_path : string
+
+    Returns
+    -------
+    row : dict
+        Value of each index column. None if the file is not a DICOM file.
+    """
+    try:
+        ds = pydicom.dcmread(file_path, stop_before_pixels=True)
+    except InvalidDicomError:
+        return None
+
+    def get(keyword, value_type=str):
+        value = ds.get(keyword)
+        if value is None or value == "":
+            return None
+        return value_type(value)
+
+    file_meta = getattr(ds, "file_meta", None)
+    transfer_syntax = None
+    if file_meta is not None and "TransferSyntaxUID" in file_meta:
+        transfer_syntax = str(file_meta.TransferSyntaxUID)
+
+    row = {
+        "path": file_path,
+        "series_uid": get("SeriesInstanceUID"),
+        "series_description": get("SeriesDescription"),
+        "instance_number": get("InstanceNumber", int),
+        "acquisition_time": get("AcquisitionTime"),
+        "transfer_syntax": transfer_syntax,
+        "collimation_width": get("TotalCollimationWidth", float),
+        "slice_thickness": get("SliceThickness", float),
+    }
+    return row
+
+
+class DicomIndex:
+    """
+    Table of DICOM headers, one row per file, sorted by series and instance
+    number.
+
+    Parameters
+    ----------
+    rows : list
+        dict of the index columns for each file
+    """
+
+    def __init__(self, rows):
+        self.rows = sorted(
+            rows,
+            key=lambda row: (
+                row["series_uid"] or "",
+                row["instance_number"] is None,
+                row["instance_number"] or 0,
+                row["path"],
+            ),
+        )
+
+    @classmethod
+    def build(cls, input_dir, extension=None, workers=1):
+        """
+        Reads the headers of all DICOM files in a directory (not recursive).
+        Files that are not DICOM are left out.
+
+        Parameters
+        ----------
+        input_dir : string
+
+        extension : string
+            Only read files with this extension (e.g., .dcm). Reads all files
+            if None.
+
+        workers : int
+            Number of threads reading headers
+
+        Returns
+        -------
+        DicomIndex
+        """
+        file_list = []
+        with os.scandir(input_dir) as it:
+            for entry in it:
+                if not entry.is_file():
+                    continue
+                if extension is not None and not entry.name.endswith(extension):
+                    continue
+                file_list.append(entry.path)
+
+        if workers == 1:
+            row_list = [read_header(file_path) for file_path in file_list]
+        else:
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                row_list = list(executor.map(read_header, file_list))
+
+        return cls([row for row in row_list if row is not None])
+
+    @classmethod
+    def load(cls, index_path):
+        """
+        Reads an index saved with save.
+
+        Parameters
+        ----------
+        index_path : string
+
+        Returns
+        -------
+        DicomIndex
+        """
+        rows = []
+        with open(index_path, "r", newline="") as f:
+            for record in csv.DictReader(f):
+                row = {}
+                for name in index_columns:
+                    value = record.get(name, "")
+                    if value == "":
+                        row[name] = None
+                    else:
+                        row[name] = column_types.get(name, str)(value)
+                rows.append(row)
+
+        return cls(rows)
+
+    def save(self, index_path):
+        """
+        Writes the index to a CSV file.
+
+        Parameters
+        ----------
+        index_path : string
+        """
+        print("Writing to {}".format(index_path))
+        with open(index_path, "w", newline="") as f:
+            writer = csv.DictWriter(f, fieldnames=index_columns)
+            writer.writeheader()
+            for row in self.rows:
+                writer.writerow(
+                    {name: "" if row[name] is None else row[name] for name in row}
+                )
+
+    def group_by(self, column):
+        """
+        Groups the rows by the value of a column.
+
+        Parameters
+        ----------
+        column : string
+
+        Returns
+        -------
+        group_dict : dict
+            Maps each value to its rows (in index order)
+        """
+        group_dict = {}
+        for row in self.rows:
+            group_dict.setdefault(row[column], []).append(row)
+
+        return group_dict
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __iter__(self):
+        return iter(self.rows)
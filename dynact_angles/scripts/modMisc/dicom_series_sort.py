@@ -4,17 +4,28 @@ dicom_series_sort.py
 Created by: Michael Kuczynski
 Created on: Aug. 09, 2019
 
-Description: Sorts all DICOMs in the provided directory into subdirectories 
+Description: Sorts all DICOMs in the provided directory into subdirectories
                 based on the series description tag.
+
+Modified on:        Oct. 18, 2026
+Modification notes: Decompresses the images in a process pool. Outputs are
+                    written to a temporary file and renamed, so an interrupted
+                    sort never leaves a partial image. Files without a series
+                    description or instance number (e.g., a DICOMDIR) are
+                    skipped, since they have no output path.
 """
 
 import os
 import sys
-import errno
 import pydicom
 import argparse
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-from pydicom.errors import InvalidDicomError
+try:
+    from .dicom_index import DicomIndex, uncompressed_syntaxes
+except ImportError:
+    # Running as a script
+    from dicom_index import DicomIndex, uncompressed_syntaxes
 
 
 def print_progress(iteration, total, prefix="", suffix="", decimals=1, bar_length=100):
@@ -57,12 +68,183 @@ def print_progress(iteration, total, prefix="", suffix="", decimals=1, bar_lengt
     sys.stdout.flush()
 
 
+def output_file_path(input_path, row):
+    """
+    Finds the output path of a DICOM in the sorted directory.
+
+    Parameters
+    ----------
+    input_path : string
+
+    row : dict
+        Row of the DICOM index
+
+    Returns
+    -------
+    string
+    """
+    # Series description is located at [0x0008, 0x103e]
+    # Use the instance number located at [0x0020, 0x0013] to rename the images
+    series_description = str(row["series_description"]).upper()
+
+    # Make the instance number have the same number of digits for all images
+    instance_number_str = str(row["instance_number"]).rjust(4, "0")
+
+    series_file_path = os.path.join(input_path, series_description)
+    new_file_name = "IM_" + instance_number_str + ".dcm"
+
+    return os.path.join(series_file_path, new_file_name)
+
+
+def decompress_dicom(task):
+    """
+    Decompresses one DICOM and saves it. Runs in a worker process.
+
+    Parameters
+    ----------
+    task : list
+        [input file, output file, transfer syntax UID]
+
+    Returns
+    -------
+    output_path : string
+    """
+    input_file, output_path, transfer_syntax = task
+
+    # The pixel data is only read here, where it is needed
+    dicom = pydicom.dcmread(input_file)
+
+    # Check transfer syntax tag in DICOM header to see if file is compressed or not
+    # If the file is already decompressed, skip it
+    if transfer_syntax not in uncompressed_syntaxes:
+        dicom.decompress()
+
+    # Save the decompressed file to a temporary file in the same directory and
+    # rename it, so a partially written image is never left behind
+    tmp_path = "{}.{}.tmp".format(output_path, os.getpid())
+    try:
+        dicom.save_as(tmp_path)
+        os.replace(tmp_path, output_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+    return output_path
+
+
+def sort_dicom_series(input_path, index=None, workers=1):
+    """
+    Decompresses and copies all DICOMs in a directory into subdirectories named
+    after the series description. Images are renamed IM_<instance number>.dcm.
+    Decompression is CPU-bound, so images are decompressed in parallel. A
+    failed image is reported and does not stop the others. Files without a
+    series description or instance number (e.g., a DICOMDIR) are skipped and
+    listed.
+
+    Parameters
+    ----------
+    input_path : string
+
+    index : DicomIndex
+        Headers of the DICOMs in input_path. Built if None.
+
+    workers : int
+        Number of threads reading headers and processes decompressing images.
+        1 runs everything in this process.
+
+    Returns
+    -------
+    index : DicomIndex
+        Index of the input files
+
+    failures : list
+        [file, error] for each failed image
+    """
+    # Read the header of every file once to find the DICOMs and their series
+    if index is None:
+        index = DicomIndex.build(input_path, workers=workers)
+
+    # Files without a series description or instance number would all be
+    # written to NONE/IM_None.dcm and overwrite each other
+    row_list = []
+    for row in index:
+        if row["series_description"] is None or row["instance_number"] is None:
+            print(
+                "Skipping {} (no series description or instance number)".format(
+                    row["path"]
+                )
+            )
+            continue
+        row_list.append(row)
+
+    # Create the series description directories once, before any image is saved
+    for series_description in set(row["series_description"] for row in row_list):
+        series_file_path = os.path.join(input_path, str(series_description).upper())
+        if not os.path.exists(series_file_path):
+            os.makedirs(series_file_path)
+
+    task_list = [
+        [row["path"], output_file_path(input_path, row), row["transfer_syntax"]]
+        for row in row_list
+    ]
+
+    # Number of files for the progress bar and the number done so far
+    l = len(task_list)
+    i = 0
+    failures = []
+
+    def finish_task(task, error):
+        nonlocal i
+        if error is not None:
+            failures.append([task[0], str(error)])
+        i = i + 1
+        print_progress(i, l, prefix="Progress:", suffix="Complete", bar_length=50)
+
+    if workers == 1:
+        for task in task_list:
+            try:
+                decompress_dicom(task)
+                error = None
+            except Exception as e:
+                error = e
+            finish_task(task, error)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            future_dict = {
+                executor.submit(decompress_dicom, task): task for task in task_list
+            }
+            for future in as_completed(future_dict):
+                try:
+                    future.result()
+                    error = None
+                except Exception as e:
+                    error = e
+                finish_task(future_dict[future], error)
+
+    return index, failures
+
+
 if __name__ == "__main__":
     # Parse input arguements
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "input_path", type=str, help="The input DICOM directory (compressed files)"
     )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of threads reading headers and processes decompressing images",
+    )
+    parser.add_argument(
+        "-x",
+        "--index",
+        type=str,
+        default=None,
+        help="DICOM header index (CSV). Read if it exists, otherwise built and "
+        "saved here",
+    )
     args = parser.parse_args()
 
     input_path = args.input_path
@@ -75,75 +257,17 @@ if __name__ == "__main__":
     # Get the absolute path of the directory provided. Use os.path.join() to avoid slash direction issues between Mac, Linux, and Windows
     input_path_abs = os.path.abspath(input_path)
 
-    # Get the number of files in a directory for the progress bar
-    l = len(
-        [
-            name
-            for name in os.listdir(input_path_abs)
-            if os.path.isfile(os.path.join(input_path_abs, name))
-        ]
-    )
-
-    # Counter for the progress bar
-    i = 0
-
-    # Loop through all DICOMs in the provided directory, rename, decompress, and copy to the appropriate directory
-    for file in os.listdir(input_path_abs):
-        filename = os.fsdecode(file)
+    index = None
+    if args.index is not None and os.path.isfile(args.index):
+        index = DicomIndex.load(args.index)
 
-        current_file_path = os.path.join(input_path_abs, filename)
+    index, failures = sort_dicom_series(input_path_abs, index, args.workers)
 
-        # Check if we have a file
-        if os.path.isfile(current_file_path):
+    if args.index is not None and not os.path.isfile(args.index):
+        index.save(args.index)
 
-            # Read the DICOM file. Make sure we have a valid DICOM file...
-            try:
-                dicom = pydicom.dcmread(current_file_path)
-            except InvalidDicomError:
-                continue
-
-            # Check transfer syntax tag in DICOM header to see if file is compressed or not
-            # If the file is already decompressed, skip it
-            tsUID = dicom.file_meta.TransferSyntaxUID
-
-            # Get the file's tag and parse out the series description
-            # Series description is located at [0x0008, 0x103e]
-            # Use the instance number located at [0x0020, 0x0013] to rename the images
-            series_description = str(dicom[0x0008, 0x103E].value).upper()
-            instance_number = dicom[0x0020, 0x0013].value
-
-            # Make the instance number have the same number of digits for all images
-            instance_number_str = str(instance_number).rjust(4, "0")
-
-            series_file_path = os.path.join(input_path_abs, series_description)
-            new_file_name = "IM_" + instance_number_str + ".dcm"
-
-            # Uncompressed Implicit VR Little-endian = 1.2.840.10008.1.2
-            # Uncompressed Explicit VR Little-endian = 1.2.840.10008.1.2.1
-            # Uncompressed Explicit VR Big-endian = 1.2.840.10008.1.2.2
-            if not (
-                (tsUID == "1.2.840.10008.1.2")
-                or (tsUID == "1.2.840.10008.1.2.1")
-                or (tsUID == "1.2.840.10008.1.2.2")
-            ):
-                dicom.decompress()
-
-            # If the series description directory doesn't already exist, create one
-            if not os.path.exists(series_file_path):
-                os.makedirs(series_file_path)
-
-            output_file_path = os.path.join(series_file_path, new_file_name)
-
-            # Save the decompressed file
-            try:
-                dicom.save_as(output_file_path)
-            except OSError as e:
-                if e.errno != errno.ENOENT:  # No such file or directory error
-                    print("ERROR: No such file or directory named " + output_file_path)
-                    raise
-
-            # Update progress bar
-            print_progress(
-                i + 1, l, prefix="Progress:", suffix="Complete", bar_length=50
-            )
-            i = i + 1
+    if failures:
+        print("ERROR: {} image(s) failed:".format(len(failures)))
+        for file_path, error in failures:
+            print("\t {}: {}".format(file_path, error))
+        sys.exit(1)
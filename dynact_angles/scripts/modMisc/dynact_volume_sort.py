@@ -4,8 +4,8 @@ dynact_volume_sort.py
 Created by: Michael Kuczynski
 Created on: July 20, 2020
 
-Description: Sorts uncompressed DICOM images from dynamic CT scans by 
-             frame/volume. The number of volumes is calculated as follows: 
+Description: Sorts uncompressed DICOM images from dynamic CT scans by
+             frame/volume. The number of volumes is calculated as follows:
                 Volumes = (total # images) / (# images per volume)
                 Volumes = (total # images) / (total collimation width / slice thickness)
 """
@@ -14,17 +14,26 @@ import os
 import math
 import errno
 import shutil
-import pydicom
 import argparse
 
+try:
+    from .dicom_index import DicomIndex
+except ImportError:
+    # Running as a script
+    from dicom_index import DicomIndex
 
-def move_dicom(img_path, image_per_volume, input_dir):
+
+def move_dicom(img_path, instance_num, image_per_volume, input_dir):
     """
     Moves DICOM images to a new directory.
 
     Parameters
     ----------
     img_path : string
+        Current path of the image (as stored in the DICOM index)
+
+    instance_num : int
+        Instance number of the image (from the DICOM index)
 
     image_per_volume : int
 
@@ -32,18 +41,18 @@ def move_dicom(img_path, image_per_volume, input_dir):
 
     Returns
     -------
-
+    new_path : string
     """
-    ds = pydicom.dcmread(img_path)
-    instance_num = int(ds.InstanceNumber)
-
     image_volume = math.ceil(instance_num / image_per_volume)
 
     copyDir = os.path.join(input_dir, "Volume_" + str(image_volume))
-    shutil.move(os.path.join(input_dir, img_path), copyDir)
+    new_path = os.path.join(copyDir, os.path.basename(img_path))
+    shutil.move(img_path, new_path)
 
+    return new_path
 
-def sort_dynact_volumes(input_directory):
+
+def sort_dynact_volumes(input_directory, index=None, workers=1):
     """
     Sorts DICOM images into separate folders for each volume.
     # volumes = (total # images) / (total collimation width / slice thickness)
@@ -52,89 +61,95 @@ def sort_dynact_volumes(input_directory):
     ----------
     input_directory : string
 
+    index : DicomIndex
+        Headers of the .dcm files in input_directory. Built if None.
+
+    workers : int
+        Number of threads reading headers
+
     Returns
     -------
-
+    index : DicomIndex
+        Index with the new path of each image
     """
-    # Calculate the number of volumes in the series using the first image in the directory as input
-    # First count the number of DICOM files in the provided directory
-    list_of_files = os.listdir(input_directory)
-    num_images = len([x for x in list_of_files if x.endswith(".dcm")])
-
-    collimation_width = 0
-    slice_thickness = 0
-    image_per_volume = 0
-    num_volumes = 0
-
-    # Use a boolean variable to get collimation width and slice thickness from the first DICOM read in
-    first_image = True
-
-    # Loop through the entire input folder
-    # Get the tag of each DICOM image to analyze the series description
-    # Finally, place the image into the correct volume directory
-    for dicom_file in os.listdir(input_directory):
-        # Get the next item in the directory
-        next_item = os.fsdecode(dicom_file)
-
-        # Skip any directories and loop over files only
-        if os.path.isdir(next_item):
-            print("Skipping directory: " + next_item)
-            continue
-
-        filename, extension = os.path.splitext(next_item)
-
-        if first_image and extension == ".dcm":
-            first_image = False
-            image = os.path.join(input_directory, next_item)
-            ds = pydicom.dcmread(image)
-            collimation_width = int(ds.TotalCollimationWidth)
-            slice_thickness = float(ds.SliceThickness)
-            image_per_volume = int(collimation_width / slice_thickness)
-            num_volumes = int(num_images / image_per_volume)
-
-            print(
-                "Total number of DICOM images in provided driectory: " + str(num_images)
-            )
-            print("Found a total collimation width of: " + str(collimation_width))
-            print("Found a slice thickness of: " + str(slice_thickness))
-            print("Number of images per volume: " + str(image_per_volume))
-            print("Number of volumes is: " + str(num_volumes))
-
-            # Now create a new sub-directory for each volume
-            for i in range(1, num_volumes + 1, 1):
-                temp_dir = os.path.join(input_directory, "Volume_" + str(i))
-                try:
-                    os.mkdir(temp_dir)
-                except OSError as e:
-                    if e.errno != errno.EEXIST:  # File already exists error
-                        raise
+    # Read the header of every image once (no pixel data)
+    if index is None:
+        index = DicomIndex.build(input_directory, ".dcm", workers)
+
+    num_images = len(index)
+    if num_images == 0:
+        print("No DICOM images found in: " + str(input_directory))
+        return index
+
+    # Calculate the number of volumes in the series using the first image
+    first_row = index.rows[0]
+    if first_row["collimation_width"] is None or first_row["slice_thickness"] is None:
+        raise ValueError(
+            "Missing total collimation width or slice thickness in "
+            + str(first_row["path"])
+        )
+    collimation_width = int(first_row["collimation_width"])
+    slice_thickness = first_row["slice_thickness"]
+    image_per_volume = int(collimation_width / slice_thickness)
+    num_volumes = int(num_images / image_per_volume)
+
+    print("Total number of DICOM images in provided driectory: " + str(num_images))
+    print("Found a total collimation width of: " + str(collimation_width))
+    print("Found a slice thickness of: " + str(slice_thickness))
+    print("Number of images per volume: " + str(image_per_volume))
+    print("Number of volumes is: " + str(num_volumes))
+
+    # Now create a new sub-directory for each volume
+    for i in range(1, num_volumes + 1, 1):
+        temp_dir = os.path.join(input_directory, "Volume_" + str(i))
+        try:
+            os.mkdir(temp_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:  # File already exists error
+                raise
 
     print("Moving images...")
 
-    for dicom_file in os.listdir(input_directory):
-        # Get the next item in the directory
-        next_item = os.fsdecode(dicom_file)
-
-        # Skip any directories and loop over files only
-        if os.path.isdir(next_item):
-            print("Skipping directory: " + next_item)
+    # Place each image into the correct volume directory using the instance
+    # number from the index
+    for row in index:
+        if row["instance_number"] is None:
+            print("Skipping image without an instance number: " + str(row["path"]))
             continue
+        row["path"] = move_dicom(
+            row["path"], row["instance_number"], image_per_volume, input_directory
+        )
 
-        filename, extension = os.path.splitext(next_item)
-
-        # Now loop through the images and copy them to the correct volume directory
-        if extension == ".dcm":
-            image = os.path.join(input_directory, next_item)
-            move_dicom(image, image_per_volume, input_directory)
+    return index
 
 
 if __name__ == "__main__":
     # Read in the input DICOM directory
     parser = argparse.ArgumentParser()
     parser.add_argument("input_directory", type=str, help="The input DICOM directory")
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="Number of threads reading headers"
+    )
+    parser.add_argument(
+        "-x",
+        "--index",
+        type=str,
+        default=None,
+        help="DICOM header index (CSV). Read if it exists, otherwise built and "
+        "saved here (with the sorted paths)",
+    )
     args = parser.parse_args()
 
-    input_directory = args.input_directory
+    # Use the absolute path so the index paths do not depend on the working
+    # directory
+    input_directory = os.path.abspath(args.input_directory)
+
+    index = None
+    if args.index is not None and os.path.isfile(args.index):
+        index = DicomIndex.load(args.index)
+
+    index = sort_dynact_volumes(input_directory, index, args.workers)
 
-    sort_dynact_volumes(input_directory)
+    if args.index is not None and not os.path.isfile(args.index):
+        index.save(args.index)
     print("DONE!")
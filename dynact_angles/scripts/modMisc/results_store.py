@@ -0,0 +1,172 @@
+"""
+results_store.py
+
+Created on: Oct. 18, 2026
+
+Description: SQLite results store for cohort-level evaluations. Results are
+             appended to tables with one row per measurement, tagged with the
+             run they came from, so repeated runs build up a history that can
+             be queried later. The store also caches values computed from input
+             files (e.g., fiducial centroids), keyed on a hash of the file
+             contents, so unchanged files are not processed again.
+"""
+
+import json
+import hashlib
+import sqlite3
+import datetime
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """
+    Computes the SHA-1 hash of the contents of a file.
+
+    Parameters
+    ----------
+    file_path : string
+
+    chunk_size : int
+        Number of bytes read at once
+
+    Returns
+    -------
+    string
+    """
+    sha1 = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+
+class ResultsStore:
+    """
+    Appends results to an SQLite database and caches values keyed on file
+    hashes.
+
+    Parameters
+    ----------
+    db_path : string
+    """
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self.connection = sqlite3.connect(db_path)
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS runs "
+            "(run_id INTEGER PRIMARY KEY, started TEXT, description TEXT)"
+        )
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS file_cache "
+            "(hash TEXT, kind TEXT, value TEXT, PRIMARY KEY (hash, kind))"
+        )
+        self.connection.commit()
+
+    def new_run(self, description=""):
+        """
+        Adds a run to the runs table.
+
+        Parameters
+        ----------
+        description : string
+
+        Returns
+        -------
+        run_id : int
+        """
+        started = datetime.datetime.now().isoformat(timespec="seconds")
+        cursor = self.connection.execute(
+            "INSERT INTO runs (started, description) VALUES (?, ?)",
+            (started, description),
+        )
+        self.connection.commit()
+
+        return cursor.lastrowid
+
+    def append(self, table, batch):
+        """
+        Appends rows to a table. The table is created with the columns of the
+        first batch.
+
+        Parameters
+        ----------
+        table : string
+
+        batch : dict
+            Maps each column name to a list of values (one per row). Scalars
+            are repeated for every row.
+        """
+        columns = list(batch.keys())
+        lengths = [len(v) for v in batch.values() if isinstance(v, (list, tuple))]
+        num_rows = max(lengths) if lengths else 1
+
+        data = []
+        for name in columns:
+            value = batch[name]
+            if isinstance(value, (list, tuple)):
+                data.append(value)
+            else:
+                data.append([value] * num_rows)
+
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS {} ({})".format(table, ", ".join(columns))
+        )
+        self.connection.executemany(
+            "INSERT INTO {} ({}) VALUES ({})".format(
+                table, ", ".join(columns), ", ".join("?" * len(columns))
+            ),
+            zip(*data),
+        )
+        self.connection.commit()
+
+    def cached(self, kind=None):
+        """
+        Reads the cached values.
+
+        Parameters
+        ----------
+        kind : string
+            Only return values of this kind. Returns all values if None.
+
+        Returns
+        -------
+        cache : dict
+            Maps (hash, kind) to the cached value
+        """
+        query = "SELECT hash, kind, value FROM file_cache"
+        params = ()
+        if kind is not None:
+            query += " WHERE kind = ?"
+            params = (kind,)
+
+        return {
+            (h, k): json.loads(v) for h, k, v in self.connection.execute(query, params)
+        }
+
+    def cache(self, entries):
+        """
+        Adds values to the cache.
+
+        Parameters
+        ----------
+        entries : dict
+            Maps (hash, kind) to a JSON serializable value
+        """
+        self.connection.executemany(
+            "INSERT OR REPLACE INTO file_cache (hash, kind, value) VALUES (?, ?, ?)",
+            [(h, k, json.dumps(v)) for (h, k), v in entries.items()],
+        )
+        self.connection.commit()
+
+    def close(self):
+        """
+        Closes the database.
+        """
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,334 @@
+"""
+scan_layout.py
+
+Created on: Oct. 18, 2026
+
+Description: Resolves the points, registration, and model paths of a scan from a
+             layout file (YAML) instead of building them in each script. The
+             data directories are indexed once with a single os.scandir walk, so
+             existence checks, the list of scans, and the DYNACT series of each
+             scan are answered from memory. The default layout is
+             scan_layout.yml beside this module.
+"""
+
+import os
+import re
+import string
+import yaml
+
+default_layout_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "scan_layout.yml"
+)
+
+# Layouts that have been loaded, keyed on the root directory and layout file
+layout_cache = {}
+
+
+class ScanLayout:
+    """
+    Path templates of a data root and an index of the files below it.
+
+    Parameters
+    ----------
+    root : string
+        Directory with the points, reg, and models directories
+
+    layout_path : string
+        Path to the YAML layout. Uses the default layout if None.
+    """
+
+    def __init__(self, root, layout_path=None):
+        if layout_path is None:
+            layout_path = default_layout_path
+
+        with open(layout_path, "r") as f:
+            layout = yaml.safe_load(f) or {}
+
+        self.root = os.path.abspath(root)
+        self.layout_path = layout_path
+        self.index_dirs = layout.get("index") or []
+        self.values = layout.get("values") or {}
+        self.templates = layout.get("paths") or {}
+        self.scans_path = layout.get("scans_path")
+        self.series_path = layout.get("series_path")
+        self.series_dict = {
+            str(k): str(v).upper() for k, v in (layout.get("series") or {}).items()
+        }
+
+        for name in [self.scans_path, self.series_path]:
+            if name is not None and name not in self.templates:
+                raise ValueError(
+                    "Unknown path {} in layout {}".format(name, layout_path)
+                )
+
+        # Maps each indexed directory (relative to the root, with / separators)
+        # to a dictionary of its entries and whether they are directories
+        self.index = {}
+        self.refresh()
+
+    def refresh(self):
+        """
+        Indexes all files and directories below the indexed top-level
+        directories with one os.scandir walk.
+        """
+        self.index = {"": {}}
+        stack = []
+        for top in self.index_dirs:
+            if os.path.isdir(os.path.join(self.root, top)):
+                self.index[""][top] = True
+                stack.append(top)
+
+        while stack:
+            rel_dir = stack.pop()
+            entries = {}
+            try:
+                with os.scandir(os.path.join(self.root, rel_dir)) as it:
+                    for entry in it:
+                        is_dir = entry.is_dir()
+                        entries[entry.name] = is_dir
+                        if is_dir:
+                            stack.append(rel_dir + "/" + entry.name)
+            except OSError:
+                pass
+            self.index[rel_dir] = entries
+
+    def relative_path(self, name, **fields):
+        """
+        Fills in a path template.
+
+        Parameters
+        ----------
+        name : string
+            Name of the path in the layout (e.g., dynact_reg_dir)
+
+        fields : dict
+            Values for the scan, series, rater, and bone placeholders
+
+        Returns
+        -------
+        string
+            Path relative to the root, with / separators
+        """
+        if name not in self.templates:
+            raise ValueError(
+                "Unknown path {} in layout {}".format(name, self.layout_path)
+            )
+
+        values = dict(self.values)
+        values.update(fields)
+        try:
+            return self.templates[name].format(**values)
+        except KeyError as e:
+            raise ValueError("Path {} needs a value for {}".format(name, e))
+
+    def path(self, name, **fields):
+        """
+        Returns the full path of a layout entry.
+
+        Parameters
+        ----------
+        name : string
+
+        fields : dict
+            Values for the scan, series, rater, and bone placeholders
+
+        Returns
+        -------
+        string
+        """
+        rel_path = self.relative_path(name, **fields)
+        return os.path.join(self.root, *rel_path.split("/"))
+
+    def exists(self, name, **fields):
+        """
+        Checks the index for a layout entry. Paths outside of the indexed
+        directories are checked on disk.
+
+        Parameters
+        ----------
+        name : string
+
+        fields : dict
+            Values for the scan, series, rater, and bone placeholders
+
+        Returns
+        -------
+        bool
+        """
+        rel_path = self.relative_path(name, **fields)
+        if rel_path.split("/")[0] not in self.index_dirs:
+            return os.path.exists(self.path(name, **fields))
+
+        parent, _, base = rel_path.rpartition("/")
+        return base in self.index.get(parent, {})
+
+    def match(self, name, dirs_only=False, **fields):
+        """
+        Finds the values of the placeholders that are not given in fields for
+        which the path exists in the index.
+
+        Parameters
+        ----------
+        name : string
+
+        dirs_only : bool
+            Only match paths that are directories
+
+        fields : dict
+            Known placeholder values
+
+        Returns
+        -------
+        matches : list
+            Dictionary of the missing placeholder values for each existing path
+        """
+        values = dict(self.values)
+        values.update(fields)
+
+        matches = [({}, "")]
+        parts = self.templates[name].split("/")
+        for i, part in enumerate(parts):
+            pattern, keys = _part_pattern(part, values)
+            last_part = i == len(parts) - 1
+            next_matches = []
+            for found, rel_dir in matches:
+                entries = self.index.get(rel_dir, {})
+                if dirs_only and last_part:
+                    entries = {e: is_dir for e, is_dir in entries.items() if is_dir}
+                if not keys:
+                    if pattern in entries:
+                        next_matches.append((found, _join(rel_dir, pattern)))
+                    continue
+
+                for entry in entries:
+                    m = pattern.fullmatch(entry)
+                    if m is None:
+                        continue
+                    new_found = dict(found)
+                    new_found.update(m.groupdict())
+                    next_matches.append((new_found, _join(rel_dir, entry)))
+            matches = next_matches
+
+        return [found for found, _ in matches]
+
+    def scans(self):
+        """
+        Lists the scan directories in the data root. Files (e.g., README.md)
+        are not scans.
+
+        Returns
+        -------
+        list
+        """
+        return sorted({m["scan"] for m in self.match(self.scans_path, dirs_only=True)})
+
+    def series(self, scan):
+        """
+        Finds the DYNACT series of a scan from the layout or the index.
+
+        Parameters
+        ----------
+        scan : string
+
+        Returns
+        -------
+        string
+        """
+        if scan in self.series_dict:
+            return self.series_dict[scan]
+
+        series_list = sorted(
+            {m["series"] for m in self.match(self.series_path, scan=scan)}
+        )
+        if len(series_list) == 1:
+            return series_list[0]
+
+        if not series_list:
+            raise ValueError(
+                "No DYNACT series found for {} ({})".format(
+                    scan, self.relative_path(self.series_path, scan=scan, series="*")
+                )
+            )
+        raise ValueError(
+            "{} has more than one DYNACT series ({}). Set the series in the cohort "
+            "manifest or the layout file".format(scan, ", ".join(series_list))
+        )
+
+
+def get_layout(root, layout_path=None):
+    """
+    Returns the layout of a data root, reusing the index built by an earlier
+    call in the same process.
+
+    Parameters
+    ----------
+    root : string
+
+    layout_path : string
+
+    Returns
+    -------
+    layout : ScanLayout
+    """
+    key = (os.path.abspath(root), layout_path)
+    if key not in layout_cache:
+        layout_cache[key] = ScanLayout(root, layout_path)
+
+    return layout_cache[key]
+
+
+def _part_pattern(part, values):
+    """
+    Converts one component of a path template to an exact name (if all of its
+    placeholders are known) or a regular expression with a named group for
+    each unknown placeholder.
+
+    Parameters
+    ----------
+    part : string
+
+    values : dict
+
+    Returns
+    -------
+    pattern : string or re.Pattern
+
+    keys : list
+        Unknown placeholders
+    """
+    keys = []
+    regex = ""
+    for literal, key, _, _ in string.Formatter().parse(part):
+        regex += re.escape(literal)
+        if key is None:
+            continue
+        if key in values:
+            regex += re.escape(str(values[key]))
+        elif key in keys:
+            regex += "(?P={})".format(key)
+        else:
+            keys.append(key)
+            regex += "(?P<{}>.+?)".format(key)
+
+    if not keys:
+        return part.format(**values), keys
+    return re.compile(regex), keys
+
+
+def _join(rel_dir, name):
+    """
+    Joins index paths.
+
+    Parameters
+    ----------
+    rel_dir : string
+
+    name : string
+
+    Returns
+    -------
+    string
+    """
+    if not rel_dir:
+        return name
+    return rel_dir + "/" + name
@@ -0,0 +1,159 @@
+"""
+table_writer.py
+
+Created on: Oct. 18, 2026
+
+Description: Writes a long-format table incrementally. Each batch of rows is
+             appended to a CSV file as soon as it is available, and optionally
+             to a Parquet or Feather (Arrow IPC) file. Parquet and Feather output
+             require pyarrow, which is only imported when one of them is used.
+"""
+
+import csv
+
+# Optional table formats written alongside the CSV
+table_formats = ["parquet", "feather"]
+
+
+class TableWriter:
+    """
+    Streams batches of rows with a fixed set of columns to a CSV file and an
+    optional Parquet or Feather file.
+
+    Parameters
+    ----------
+    csv_path : string
+
+    columns : list
+        Column names, in the order they are written
+
+    table_path : string
+        Optional path for the Parquet or Feather file
+
+    table_format : string
+        parquet or feather. Required if table_path is given.
+    """
+
+    def __init__(self, csv_path, columns, table_path=None, table_format=None):
+        self.columns = list(columns)
+        self.num_rows = 0
+
+        self.pa = None
+        self.table_path = table_path
+        self.table_format = table_format
+        self.table_writer = None
+        if table_path is not None:
+            if table_format not in table_formats:
+                raise ValueError(
+                    "Unknown table format {}. Options are: {}".format(
+                        table_format, ", ".join(table_formats)
+                    )
+                )
+            try:
+                import pyarrow
+            except ImportError:
+                raise ImportError(
+                    "pyarrow is required to write {} files".format(table_format)
+                )
+            self.pa = pyarrow
+
+        self.csv_file = open(csv_path, "w", newline="")
+        self.csv_writer = csv.writer(self.csv_file)
+        self.csv_writer.writerow(self.columns)
+
+    def write(self, batch):
+        """
+        Appends a batch of rows to the table.
+
+        Parameters
+        ----------
+        batch : dict
+            Maps every column name to a list or 1D numpy.array. Scalars are
+            repeated for every row of the batch.
+        """
+        lengths = [len(v) for v in batch.values() if not _is_scalar(v)]
+        num_rows = max(lengths) if lengths else 1
+        data = []
+        for name in self.columns:
+            value = batch[name]
+            if _is_scalar(value):
+                data.append([value] * num_rows)
+            elif hasattr(value, "tolist"):
+                # Python numbers for the csv and pyarrow modules
+                data.append(value.tolist())
+            else:
+                data.append(list(value))
+
+        self.csv_writer.writerows(zip(*data))
+        self.csv_file.flush()
+        self.num_rows += num_rows
+
+        if self.pa is not None:
+            self.write_arrow(data)
+
+    def write_arrow(self, data):
+        """
+        Appends a batch to the Parquet or Feather file. The file is created
+        with the schema of the first batch.
+
+        Parameters
+        ----------
+        data : list
+            One list of values per column
+        """
+        record_batch = self.pa.RecordBatch.from_arrays(
+            [self.pa.array(values) for values in data], names=self.columns
+        )
+
+        if self.table_writer is None:
+            if self.table_format == "parquet":
+                import pyarrow.parquet
+
+                self.table_writer = pyarrow.parquet.ParquetWriter(
+                    self.table_path, record_batch.schema
+                )
+            else:
+                import pyarrow.ipc
+
+                self.table_writer = pyarrow.ipc.new_file(
+                    self.table_path, record_batch.schema
+                )
+
+        if self.table_format == "parquet":
+            self.table_writer.write_table(self.pa.Table.from_batches([record_batch]))
+        else:
+            self.table_writer.write_batch(record_batch)
+
+    def close(self):
+        """
+        Closes the output files.
+        """
+        self.csv_file.close()
+        if self.table_writer is not None:
+            self.table_writer.close()
+            self.table_writer = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def _is_scalar(value):
+    """
+    Checks if a batch value is a single value rather than a column of values.
+
+    Parameters
+    ----------
+    value : object
+
+    Returns
+    -------
+    bool
+    """
+    return (
+        value is None
+        or isinstance(value, (str, int, float))
+        or getattr(value, "ndim", 1) == 0
+    )
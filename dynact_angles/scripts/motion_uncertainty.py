@@ -0,0 +1,297 @@
+"""
+motion_uncertainty.py
+
+Created on:   Oct. 18, 2026
+
+Description: Estimates the uncertainty of the joint angles and translations of
+             compute_motion.py caused by landmark picking. Each rater's MC1 and
+             TRP landmarks are perturbed with a fiducial localization error
+             (FLE) and the samples are moved through the cached XCT -> DYNACT
+             transform chain of the scan. The per-frame mean, standard
+             deviation, and confidence interval of each joint motion component
+             are written to a long-format table.
+
+Usage:
+  python motion_uncertainty.py Scan [Scan ...] -e FLE
+
+Optional arguments:
+  -e FLE [FLE]              FLE in mm for both bones, or for the MC1 and TRP
+  -r rater [rater ...]      Raters whose landmarks are used (default = all)
+  -n num_samples            Number of Monte Carlo samples (default = 10000)
+  -c confidence             Confidence interval coverage (default = 0.95)
+  -s seed                   Seed for reproducible samples
+  -w workers                Number of processes (default = 1)
+  -m manifest               Cohort manifest with the DYNACT series of each scan
+  -l layout                 Scan layout file
+  -o output_csv             Default = output/motion_uncertainty.csv
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+
+import compute_motion
+from scs_differences import read_rater_points
+from modBiomech.landmark_uncertainty import monte_carlo_motion, motion_names
+from modImgProc.transform_store import transform_store
+from modMisc.colours import Colours
+from modMisc.cohort import read_cohort
+from modMisc.scan_layout import get_layout
+from modMisc.table_writer import TableWriter, table_formats
+
+# Columns of the output table
+uncertainty_columns = [
+    "scan",
+    "series",
+    "rater",
+    "frame",
+    "motion",
+    "nominal",
+    "mean",
+    "std",
+    "lower",
+    "upper",
+]
+
+
+def scan_uncertainty(
+    next_scan,
+    series,
+    raters,
+    layout,
+    mc1_fle,
+    trp_fle,
+    num_samples=10000,
+    confidence=0.95,
+    workers=1,
+    seed=None,
+):
+    """
+    Runs the Monte Carlo estimate for each rater of a scan.
+
+    Parameters
+    ----------
+    next_scan : string
+
+    series : string
+
+    raters : list
+
+    layout : ScanLayout
+
+    mc1_fle : float
+
+    trp_fle : float
+
+    num_samples : int
+
+    confidence : float
+
+    workers : int
+
+    seed : int
+
+    Returns
+    -------
+    result_dict : dict
+        Output of monte_carlo_motion for each rater
+    """
+    scan_fields = {"scan": next_scan, "series": series}
+    mc1_pnts, trp_pnts = read_rater_points(layout, scan_fields, raters)
+
+    # Nifti to ITK World coordinates (Flip X and Y axes to go from VTK to ITK coordinates)
+    mc1_pnts[:, :, :2] *= -1
+    trp_pnts[:, :, :2] *= -1
+
+    reg_dirs = [
+        layout.path("ct2xct_reg_dir", **scan_fields),
+        layout.path("ct2dynact_reg_dir", **scan_fields),
+        layout.path("dynact_reg_dir", **scan_fields),
+    ]
+    mc1_matrices = transform_store.chain(*reg_dirs, "MC1")["composed"]
+    trp_matrices = transform_store.chain(*reg_dirs, "TRP")["composed"]
+
+    result_dict = {}
+    for i, rater in enumerate(raters):
+        result_dict[rater] = monte_carlo_motion(
+            mc1_pnts[i],
+            trp_pnts[i],
+            mc1_matrices,
+            trp_matrices,
+            mc1_fle,
+            trp_fle,
+            num_samples,
+            confidence,
+            workers=workers,
+            seed=seed,
+        )
+
+    return result_dict
+
+
+def write_uncertainty(writer, next_scan, series, result_dict):
+    """
+    Appends the uncertainty of each rater and joint motion component to the
+    output table.
+
+    Parameters
+    ----------
+    writer : TableWriter
+
+    next_scan : string
+
+    series : string
+
+    result_dict : dict
+        Output of scan_uncertainty
+    """
+    for rater, result in result_dict.items():
+        frame_arr = np.arange(result["nominal"].shape[0])
+        for i, name in enumerate(motion_names):
+            batch = {
+                "scan": next_scan,
+                "series": series,
+                "rater": rater,
+                "frame": frame_arr,
+                "motion": name,
+            }
+            for key in uncertainty_columns[5:]:
+                batch[key] = result[key][:, i]
+            writer.write(batch)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scans", type=str, nargs="+", help="Scans to process")
+    parser.add_argument(
+        "-e",
+        "--fle",
+        type=float,
+        nargs="+",
+        required=True,
+        help="Fiducial localization error (RMS, mm). One value for both bones or "
+        "two values for the MC1 and TRP",
+    )
+    parser.add_argument(
+        "-r",
+        "--raters",
+        type=str,
+        nargs="+",
+        default=compute_motion.rater_list,
+        help="Raters whose landmarks are used. Default = "
+        + " ".join(compute_motion.rater_list),
+    )
+    parser.add_argument(
+        "-n",
+        "--num-samples",
+        type=int,
+        default=10000,
+        help="Number of Monte Carlo samples. Default = 10000",
+    )
+    parser.add_argument(
+        "-c",
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="Coverage of the confidence intervals. Default = 0.95",
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=None, help="Seed for reproducible samples"
+    )
+    parser.add_argument(
+        "-w", "--workers", type=int, default=1, help="Number of processes"
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        default=None,
+        help="Cohort manifest (YAML) with the root directory and DYNACT series",
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        type=str,
+        default=None,
+        help="Scan layout file (YAML). Default = modMisc/scan_layout.yml",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Output CSV. Default = output/motion_uncertainty.csv",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default=None,
+        choices=table_formats,
+        help="Also write the table as Parquet or Feather (requires pyarrow)",
+    )
+    args = parser.parse_args()
+
+    if len(args.fle) > 2:
+        parser.error("--fle takes one or two values")
+    mc1_fle = args.fle[0]
+    trp_fle = args.fle[-1]
+
+    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    series_dict = {}
+    if args.manifest is not None:
+        cohort = read_cohort(args.manifest)
+        parent_dir = cohort["root"]
+        series_dict = {scan["scan"]: scan["series"] for scan in cohort["scans"]}
+    layout = get_layout(parent_dir, args.layout)
+
+    output_path = args.output
+    if output_path is None:
+        output_path = os.path.join(layout.path("output_dir"), "motion_uncertainty.csv")
+    table_path = None
+    if args.format is not None:
+        table_path = os.path.splitext(output_path)[0] + "." + args.format
+
+    failures = []
+    with TableWriter(
+        output_path, uncertainty_columns, table_path, args.format
+    ) as writer:
+        for next_scan in args.scans:
+            print(
+                Colours.BOLD
+                + "Computing joint motion uncertainty for "
+                + str(next_scan)
+                + "..."
+                + Colours.WHITE
+            )
+            try:
+                series = series_dict.get(next_scan) or layout.series(next_scan)
+                result_dict = scan_uncertainty(
+                    next_scan,
+                    series,
+                    args.raters,
+                    layout,
+                    mc1_fle,
+                    trp_fle,
+                    args.num_samples,
+                    args.confidence,
+                    args.workers,
+                    args.seed,
+                )
+            except (OSError, ValueError) as e:
+                print(Colours.RED + "ERROR: {}".format(e) + Colours.WHITE)
+                failures.append([next_scan, str(e)])
+                continue
+
+            write_uncertainty(writer, next_scan, series, result_dict)
+
+    print("Writing to {}".format(output_path))
+    if table_path is not None:
+        print("Writing to {}".format(table_path))
+
+    if failures:
+        print(Colours.RED + "{} scan(s) failed:".format(len(failures)) + Colours.WHITE)
+        for next_scan, error in failures:
+            print("\t {}: {}".format(next_scan, error))
+        sys.exit(1)
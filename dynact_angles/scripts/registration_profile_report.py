@@ -0,0 +1,208 @@
+"""
+registration_profile_report.py
+
+Created on:   Oct. 18, 2026
+
+Description: Summarizes the runtime and accuracy of sequential registration runs
+             made with different registration profiles. Each run's output
+             directory holds a run manifest (RUN_MANIFEST.sqlite) with the
+             per-frame runtime, optimizer iterations, and full resolution metric.
+
+             If a reference run (e.g., the accurate profile) and the bone masks
+             are given, the bone voxels are mapped into every frame with both
+             runs' transforms and the mean and max displacement between them is
+             reported as the transform error.
+
+Usage:
+  python registration_profile_report.py Output_dir [Output_dir ...]
+
+Optional arguments:
+  -r reference_dir          Output directory of the reference run
+  -s MC1_seg TRP_seg         Bone masks on the reference frame (needed with -r)
+"""
+
+import os
+import sqlite3
+import argparse
+import numpy as np
+import SimpleITK as sitk
+
+from modImgProc.transform_matrix import transform_to_matrix
+
+
+def read_stats(output_dir):
+    """
+    Reads the per-frame registration statistics from a run manifest.
+
+    Parameters
+    ----------
+    output_dir : string
+
+    Returns
+    -------
+    rows : list
+        List of (bone, frame_num, profile, runtime, iterations, metric) rows
+    """
+    manifest_path = os.path.join(output_dir, "RUN_MANIFEST.sqlite")
+    conn = sqlite3.connect(manifest_path)
+    rows = conn.execute(
+        "SELECT bone, frame_num, profile, runtime, iterations, metric "
+        "FROM profile_stats ORDER BY bone, frame_num"
+    ).fetchall()
+    conn.close()
+
+    return rows
+
+
+def bone_points(seg_path, max_points=5000):
+    """
+    Gets the physical coordinates of (a random subset of) the bone voxels.
+
+    Parameters
+    ----------
+    seg_path : string
+
+    max_points : int
+
+    Returns
+    -------
+    points : numpy.ndarray
+        (N, 4) homogeneous coordinates
+    """
+    seg = sitk.ReadImage(seg_path)
+    index_arr = np.argwhere(sitk.GetArrayViewFromImage(seg) > 0)[:, ::-1]
+
+    if len(index_arr) > max_points:
+        rng = np.random.default_rng(0)
+        index_arr = index_arr[rng.choice(len(index_arr), max_points, replace=False)]
+
+    # Index to physical point: origin + direction * (spacing * index)
+    direction = np.array(seg.GetDirection()).reshape(3, 3)
+    points = (
+        np.array(seg.GetOrigin())
+        + (index_arr * np.array(seg.GetSpacing())) @ direction.T
+    )
+
+    return np.hstack([points, np.ones((len(points), 1))])
+
+
+def transform_error(output_dir, reference_dir, bone, frame_num, points):
+    """
+    Computes the displacement between the bone positions predicted by two runs
+    for one frame. The registration maps the current frame to the reference
+    frame, so the inverse transform moves the bone into the current frame.
+
+    Parameters
+    ----------
+    output_dir : string
+
+    reference_dir : string
+
+    bone : string
+
+    frame_num : int
+
+    points : numpy.ndarray
+        (N, 4) homogeneous bone coordinates on the reference frame
+
+    Returns
+    -------
+    mean_error : float
+
+    max_error : float
+    """
+    tfm_name = "VOLUME_REF_TO_" + str(frame_num) + "_" + bone + "_REG.tfm"
+    matrix = transform_to_matrix(
+        sitk.ReadTransform(os.path.join(output_dir, "FinalTFMs", tfm_name))
+    )
+    ref_matrix = transform_to_matrix(
+        sitk.ReadTransform(os.path.join(reference_dir, "FinalTFMs", tfm_name))
+    )
+
+    diff = (np.linalg.inv(matrix) - np.linalg.inv(ref_matrix)) @ points.T
+    dist = np.linalg.norm(diff[:3], axis=0)
+
+    return dist.mean(), dist.max()
+
+
+def main(output_dirs, reference_dir=None, seg_dict=None):
+    """
+    Prints the runtime and accuracy summary of each run.
+
+    Parameters
+    ----------
+    output_dirs : list
+
+    reference_dir : string
+
+    seg_dict : dict
+        Maps each bone to its mask on the reference frame
+
+    Returns
+    -------
+
+    """
+    points_dict = {}
+    if reference_dir is not None:
+        points_dict = {bone: bone_points(seg_dict[bone]) for bone in seg_dict}
+
+    for output_dir in output_dirs:
+        print(output_dir)
+
+        rows = read_stats(output_dir)
+        for bone in sorted(set(row[0] for row in rows)):
+            bone_rows = [row for row in rows if row[0] == bone]
+            profiles = sorted(set(row[2] for row in bone_rows))
+            runtime = np.array([row[3] for row in bone_rows])
+            iterations = np.array([row[4] for row in bone_rows])
+            metric = np.array([row[5] for row in bone_rows])
+
+            print(
+                "  {} ({} frames, profile {}): {:.2f} s total, {:.2f} s/frame, "
+                "{:.1f} iterations/frame, mean metric {:.4f}".format(
+                    bone,
+                    len(bone_rows),
+                    ", ".join(profiles),
+                    runtime.sum(),
+                    runtime.mean(),
+                    iterations.mean(),
+                    metric.mean(),
+                )
+            )
+
+            if bone not in points_dict:
+                continue
+
+            error_arr = np.array(
+                [
+                    transform_error(
+                        output_dir, reference_dir, bone, row[1], points_dict[bone]
+                    )
+                    for row in bone_rows
+                ]
+            )
+            print(
+                "    Transform error vs. {}: mean {:.4f} mm, max {:.4f} mm".format(
+                    reference_dir, error_arr[:, 0].mean(), error_arr[:, 1].max()
+                )
+            )
+
+
+if __name__ == "__main__":
+    # Parse input arguments
+    parser = argparse.ArgumentParser()
+    parser.add_argument("output_dirs", type=str, nargs="+")
+    parser.add_argument("-r", "--reference_dir", type=str, default=None)
+    parser.add_argument("-s", "--seg", type=str, nargs=2, default=None)
+    args = parser.parse_args()
+
+    output_dirs = args.output_dirs
+    reference_dir = args.reference_dir
+    seg_dict = None
+
+    if reference_dir is not None:
+        if args.seg is None:
+            parser.error("The MC1 and TRP masks (-s) are needed with -r")
+        seg_dict = {"MC1": args.seg[0], "TRP": args.seg[1]}
+
+    main(output_dirs, reference_dir, seg_dict)
@@ -0,0 +1,1008 @@
+"""
+run_pipeline.py
+
+Created on:   Oct. 18, 2026
+
+Description: Runs the DYNACT pipeline over a cohort. The scans (and the DYNACT
+             series used for each scan) are read from a cohort manifest (see
+             modMisc/cohort.py). Each scan is split into stages:
+
+               ct2xct_<bone>       xct2ct_reg.py (static CT to HR-pQCT)
+               seg2ct_<bone>       transform.py (HR-pQCT segmentation to CT)
+               ct2dynact_<bone>    xct2ct_reg.py (static CT to DYNACT frame 1)
+               seg2dynact_<bone>   transform.py (CT segmentation to DYNACT frame 1)
+               sequential_registration
+               compute_motion
+
+             Stages are run once their dependencies are done. A stage is skipped
+             if its outputs are newer than its inputs and it was last run with the
+             same parameters. Stages can be run on a local process pool or through
+             a file-based queue in a shared directory that several nodes pull from.
+             Queue workers refresh the job files of their running stages, and a
+             running job that has not been refreshed for a while (e.g., its node
+             died) is moved back to pending.
+
+Usage:
+  python run_pipeline.py run cohort.yml            Run on a local process pool
+  python run_pipeline.py submit cohort.yml QUEUE   Add all stages to a queue
+  python run_pipeline.py work QUEUE                Run stages from a queue
+
+Optional arguments:
+  -w workers                   Number of worker processes. Default = 1
+  -f stage [stage ...]         Rerun these stages (e.g., sequential_registration,
+                               ct2xct_MC1, or all) even if they are up to date
+  -n                           Only print the stages that would be run (run)
+  -s seconds                   Requeue running jobs not refreshed for this long
+                               (work). Default = 600
+"""
+
+import os
+import json
+import time
+import errno
+import socket
+import hashlib
+import argparse
+import threading
+import SimpleITK as sitk
+
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import transform
+import xct2ct_reg
+import compute_motion
+import sequential_registration
+from modMisc.cohort import read_cohort
+from modMisc.scan_layout import get_layout
+from modImgProc.registration_profiles import load_profile
+
+bone_list = ["MC1", "TRP"]
+
+# Queue subdirectories, one per job state
+queue_states = ["pending", "running", "done", "failed"]
+
+
+def scan_stages(root, scan, series, settings):
+    """
+    Creates the stages needed to compute joint motion for a scan. Directories are
+    resolved through the scan layout of the root (see modMisc/scan_layout.yml), so
+    the stage inputs and outputs are the paths compute_motion reads and writes.
+
+    Parameters
+    ----------
+    root : string
+        Directory with the models, reg, points, and output directories
+
+    scan : string
+
+    series : string
+        DYNACT series (B, C, or D). Found from the scan layout if None.
+
+    settings : dict
+        Pipeline settings from the cohort manifest
+
+    Returns
+    -------
+    stages : list
+        List of stage dictionaries with the stage ID ("id"), type ("type"),
+        dependencies ("deps"), inputs, outputs, and arguments ("args")
+    """
+    layout = get_layout(root)
+    if series is None:
+        series = layout.series(scan)
+    scan_fields = {"scan": scan, "series": series}
+
+    xct_model_dir = layout.path("xct_model_dir", **scan_fields)
+    ct_model_dir = layout.path("ct_model_dir", **scan_fields)
+    xct_reg_dir = layout.path("ct2xct_reg_dir", **scan_fields)
+    dynact_reg_dir = layout.path("ct2dynact_reg_dir", **scan_fields)
+    dynact_dir = os.path.join(
+        layout.path("dynact_model_dir", **scan_fields), series, "RESAMPLED"
+    )
+    dynact_ref = os.path.join(dynact_dir, "Volume_1_Resampled.nii")
+    pipeline_dir = layout.path("pipeline_dir", **scan_fields)
+    s = series.lower()
+
+    def stage(name, stage_type, deps, inputs, outputs, args):
+        return {
+            "id": scan + "/" + name,
+            "scan": scan,
+            "name": name,
+            "type": stage_type,
+            "deps": [scan + "/" + dep for dep in deps],
+            "inputs": inputs,
+            "outputs": outputs,
+            "args": args,
+            "stamp": os.path.join(pipeline_dir, name + ".json"),
+        }
+
+    stages = []
+    seg_dict = {}
+    for bone in bone_list:
+        xct_img = os.path.join(xct_model_dir, scan + "e_" + bone + ".nii")
+        xct_land = os.path.join(xct_model_dir, scan + "e_" + bone + "_LAND.nii")
+        xct_seg = os.path.join(xct_model_dir, scan + "e_" + bone + "_SEG.nii")
+        ct_img = os.path.join(ct_model_dir, scan + "a_BP_" + bone + ".nii")
+        ct_land = os.path.join(ct_model_dir, scan + "a_" + bone + "_LAND.nii")
+        dynact_land = os.path.join(dynact_dir, scan + s + "_" + bone + "_LAND.nii")
+
+        ct2xct_tfm = os.path.join(xct_reg_dir, "CT2XCT_" + bone + "_REG.tfm")
+        ct2xct_img = os.path.join(xct_reg_dir, "CT2XCT_" + bone + "_REG.nii")
+        ct_seg = os.path.join(xct_reg_dir, scan + "a_" + bone + "_SEG.nii")
+        ct2dynact_tfm = os.path.join(dynact_reg_dir, "CT2DYNACT_" + bone + "_REG.tfm")
+        ct2dynact_img = os.path.join(dynact_reg_dir, "CT2DYNACT_" + bone + "_REG.nii")
+        dynact_seg = os.path.join(dynact_reg_dir, scan + s + "_" + bone + "_SEG.nii")
+        seg_dict[bone] = dynact_seg
+
+        stages.append(
+            stage(
+                "ct2xct_" + bone,
+                "xct2ct_reg",
+                [],
+                [xct_img, xct_land, ct_img, ct_land],
+                [ct2xct_tfm, ct2xct_img],
+                [xct_land, ct_land, xct_img, ct_img, ct2xct_tfm, ct2xct_img],
+            )
+        )
+        stages.append(
+            stage(
+                "seg2ct_" + bone,
+                "transform",
+                ["ct2xct_" + bone],
+                [ct_img, xct_seg, ct2xct_tfm],
+                [ct_seg],
+                [ct_img, xct_seg, ct2xct_tfm, True, ct_seg],
+            )
+        )
+        stages.append(
+            stage(
+                "ct2dynact_" + bone,
+                "xct2ct_reg",
+                [],
+                [dynact_ref, dynact_land, ct_img, ct_land],
+                [ct2dynact_tfm, ct2dynact_img],
+                [
+                    dynact_land,
+                    ct_land,
+                    dynact_ref,
+                    ct_img,
+                    ct2dynact_tfm,
+                    ct2dynact_img,
+                ],
+            )
+        )
+        stages.append(
+            stage(
+                "seg2dynact_" + bone,
+                "transform",
+                ["seg2ct_" + bone, "ct2dynact_" + bone],
+                [dynact_ref, ct_seg, ct2dynact_tfm],
+                [dynact_seg],
+                [dynact_ref, ct_seg, ct2dynact_tfm, False, dynact_seg],
+            )
+        )
+
+    # Sequential registration of all DYNACT frames. The final transforms are
+    # written to FinalTFMs in the output directory, which is where compute_motion
+    # reads them (dynact_reg_dir).
+    frames_dir = os.path.dirname(layout.path("dynact_reg_dir", **scan_fields))
+    registration_args = {
+        "dynact_dir": dynact_dir,
+        "mc1_seg": seg_dict["MC1"],
+        "trp_seg": seg_dict["TRP"],
+        "output_dir": frames_dir,
+        "profile": settings.get("profile", "default"),
+        "profile_config": settings.get("profile_config"),
+        "workers": settings.get("registration_workers", 1),
+        "window": settings.get("window", 0),
+        "roi_margin": settings.get("roi_margin") if settings.get("roi") else None,
+        "warm_start": settings.get("warm_start", "none"),
+        "outputs": settings.get("outputs", sequential_registration.output_types),
+        "compress": settings.get("compress", False),
+    }
+    if settings.get("roi") and registration_args["roi_margin"] is None:
+        registration_args["roi_margin"] = [5, 5, 2]
+
+    stages.append(
+        stage(
+            "sequential_registration",
+            "sequential_registration",
+            ["seg2dynact_" + bone for bone in bone_list],
+            [dynact_dir, seg_dict["MC1"], seg_dict["TRP"]],
+            [os.path.join(frames_dir, "RUN_MANIFEST.sqlite")],
+            registration_args,
+        )
+    )
+
+    # Joint motion from the registered frames and the rater points
+    point_files = [
+        layout.path("scs_points", bone=bone, rater=rater, **scan_fields)
+        for rater in compute_motion.rater_list
+        for bone in bone_list
+    ]
+    stages.append(
+        stage(
+            "compute_motion",
+            "compute_motion",
+            ["ct2xct_" + bone for bone in bone_list]
+            + ["ct2dynact_" + bone for bone in bone_list]
+            + ["sequential_registration"],
+            point_files
+            + [os.path.join(xct_reg_dir, "CT2XCT_" + b + "_REG.tfm") for b in bone_list]
+            + [
+                os.path.join(dynact_reg_dir, "CT2DYNACT_" + b + "_REG.tfm")
+                for b in bone_list
+            ]
+            + [os.path.join(frames_dir, "RUN_MANIFEST.sqlite")],
+            [os.path.join(layout.path("output_dir"), scan + "_angles.csv")],
+            [scan, series, root],
+        )
+    )
+
+    return stages
+
+
+def cohort_stages(manifest_path):
+    """
+    Creates the stages of all scans in a cohort manifest.
+
+    Parameters
+    ----------
+    manifest_path : string
+
+    Returns
+    -------
+    stages : list
+    """
+    cohort = read_cohort(manifest_path)
+
+    stages = []
+    for scan in cohort["scans"]:
+        stages += scan_stages(
+            cohort["root"], scan["scan"], scan["series"], cohort["settings"]
+        )
+
+    return stages
+
+
+def params_hash(stage):
+    """
+    Hashes the stage type and arguments.
+
+    Parameters
+    ----------
+    stage : dict
+
+    Returns
+    -------
+    string
+    """
+    params = json.dumps([stage["type"], stage["args"]], sort_keys=True)
+    return hashlib.sha1(params.encode()).hexdigest()
+
+
+def newest_mtime(path):
+    """
+    Gets the modification time of a file, or of the newest file in a directory.
+
+    Parameters
+    ----------
+    path : string
+
+    Returns
+    -------
+    mtime : float
+    """
+    if not os.path.isdir(path):
+        return os.path.getmtime(path)
+
+    mtime = os.path.getmtime(path)
+    with os.scandir(path) as it:
+        for entry in it:
+            if entry.is_file():
+                mtime = max(mtime, entry.stat().st_mtime)
+
+    return mtime
+
+
+def stage_is_current(stage):
+    """
+    Checks if a stage is up to date: it was last run with the same parameters and
+    all of its outputs exist and are newer than its inputs.
+
+    Parameters
+    ----------
+    stage : dict
+
+    Returns
+    -------
+    bool
+    """
+    try:
+        with open(stage["stamp"], "r") as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return False
+
+    if stamp.get("params") != params_hash(stage):
+        return False
+
+    outputs = stage["outputs"] + [stage["stamp"]]
+    if not all(os.path.exists(path) for path in outputs):
+        return False
+
+    # Missing inputs are reported when the stage runs
+    inputs = [path for path in stage["inputs"] if os.path.exists(path)]
+    if len(inputs) != len(stage["inputs"]):
+        return False
+
+    oldest_output = min(os.path.getmtime(path) for path in outputs)
+    newest_input = max([newest_mtime(path) for path in inputs] + [0])
+
+    return oldest_output >= newest_input
+
+
+def write_stamp(stage, runtime):
+    """
+    Records a completed stage.
+
+    Parameters
+    ----------
+    stage : dict
+
+    runtime : float
+
+    Returns
+    -------
+
+    """
+    stamp = {
+        "params": params_hash(stage),
+        "host": socket.gethostname(),
+        "runtime": runtime,
+        "completed": time.strftime("%Y-%m-%d %H:%M:%S"),
+    }
+
+    tmp_path = stage["stamp"] + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(stamp, f, indent=2)
+    os.replace(tmp_path, stage["stamp"])
+
+
+def make_dirs(path_list):
+    """
+    Creates the parent directories of a list of files.
+
+    Parameters
+    ----------
+    path_list : list
+
+    Returns
+    -------
+
+    """
+    for path in path_list:
+        try:
+            os.makedirs(os.path.dirname(path))
+        except OSError as e:
+            if e.errno != errno.EEXIST:  # Directory already exists error
+                raise
+
+
+def run_xct2ct_reg(args):
+    """
+    Runs an xct2ct_reg.py stage and writes the registered image.
+
+    Parameters
+    ----------
+    args : list
+        Fixed and moving landmarks, fixed and moving images, and output transform
+        and registered image paths
+
+    Returns
+    -------
+
+    """
+    (
+        fixed_landmarks,
+        moving_landmarks,
+        fixed_img,
+        moving_img,
+        tfm_path,
+        registered_path,
+    ) = args
+    moving_resampled = xct2ct_reg.main(
+        fixed_landmarks, moving_landmarks, fixed_img, moving_img, tfm_path
+    )
+
+    print("Writing to {}".format(registered_path))
+    sitk.WriteImage(moving_resampled, registered_path)
+
+
+def run_transform(args):
+    """
+    Runs a transform.py stage (nearest neighbour) and writes the transformed image.
+
+    Parameters
+    ----------
+    args : list
+        Fixed image, moving image, transform, invert transform flag, and output
+        image path
+
+    Returns
+    -------
+
+    """
+    fixed_img, moving_img, tfm_path, inverse_tfm, output_path = args
+    transformed_img = transform.main(
+        fixed_img, moving_img, tfm_path, inverse_tfm, sitk.sitkNearestNeighbor
+    )
+
+    print("Writing to {}".format(output_path))
+    sitk.WriteImage(transformed_img, output_path)
+
+
+def run_sequential_registration(args):
+    """
+    Runs a sequential_registration.py stage.
+
+    Parameters
+    ----------
+    args : dict
+        sequential_registration.main arguments (the profile is given by name)
+
+    Returns
+    -------
+
+    """
+    profile = load_profile(args["profile"], args["profile_config"])
+    sequential_registration.main(
+        args["dynact_dir"],
+        args["mc1_seg"],
+        args["trp_seg"],
+        args["output_dir"],
+        profile,
+        args["workers"],
+        args["window"],
+        args["roi_margin"],
+        args["warm_start"],
+        False,
+        args["outputs"],
+        args["compress"],
+    )
+
+
+def run_compute_motion(args):
+    """
+    Runs a compute_motion.py stage for all raters of a scan.
+
+    Parameters
+    ----------
+    args : list
+        Scan, DYNACT series, and root directory
+
+    Returns
+    -------
+
+    """
+    scan, series, root = args
+    compute_motion.compute_scan(scan, series, root)
+
+
+# Functions that run each type of stage
+stage_dict = {
+    "xct2ct_reg": run_xct2ct_reg,
+    "transform": run_transform,
+    "sequential_registration": run_sequential_registration,
+    "compute_motion": run_compute_motion,
+}
+
+
+def run_stage(stage, force=False):
+    """
+    Runs a stage if it is not up to date. Runs in the worker processes.
+
+    Parameters
+    ----------
+    stage : dict
+
+    force : bool
+        Run the stage even if it is up to date
+
+    Returns
+    -------
+    status : string
+        Either "skipped", "done", or "failed: <error>"
+    """
+    if not force and stage_is_current(stage):
+        return "skipped"
+
+    missing = [path for path in stage["inputs"] if not os.path.exists(path)]
+    if missing:
+        return "failed: missing input(s) " + ", ".join(missing)
+
+    make_dirs(stage["outputs"] + [stage["stamp"]])
+
+    print("Running {}".format(stage["id"]))
+    start_time = time.perf_counter()
+    try:
+        stage_dict[stage["type"]](stage["args"])
+    except (Exception, SystemExit) as e:
+        return "failed: {}".format(e)
+
+    write_stamp(stage, time.perf_counter() - start_time)
+    return "done"
+
+
+def is_forced(stage, force_list):
+    """
+    Checks if a stage is in the list of stages to rerun.
+
+    Parameters
+    ----------
+    stage : dict
+
+    force_list : list
+        Stage names (e.g., sequential_registration or ct2xct_MC1), stage IDs
+        (e.g., DYNACT1_002/compute_motion), or all
+
+    Returns
+    -------
+    bool
+    """
+    return (
+        "all" in force_list
+        or stage["name"] in force_list
+        or stage["id"] in force_list
+        or stage["type"] in force_list
+    )
+
+
+def run_local(stages, workers=1, force_list=[], dry_run=False):
+    """
+    Runs all stages on a local process pool. A stage is submitted as soon as all
+    of its dependencies are done. Stages that depend on a failed stage, on a stage
+    that is not in the list, or that can never be scheduled (e.g., a dependency
+    cycle) are not run and are reported as failed.
+
+    Parameters
+    ----------
+    stages : list
+
+    workers : int
+
+    force_list : list
+
+    dry_run : bool
+        Only print the stages that would be run
+
+    Returns
+    -------
+    failed_dict : dict
+        Maps the ID of each failed stage to the reason
+    """
+    if dry_run:
+        # Stages are in dependency order. Stages after a stage that runs also run.
+        run_set = set()
+        for stage in stages:
+            current = (
+                stage_is_current(stage)
+                and not is_forced(stage, force_list)
+                and not any(dep in run_set for dep in stage["deps"])
+            )
+            if not current:
+                run_set.add(stage["id"])
+            print("{:45} {}".format(stage["id"], "up to date" if current else "run"))
+        return {}
+
+    pending = {stage["id"]: stage for stage in stages}
+    done = set()
+    failed_dict = {}
+    running = {}
+
+    stage_ids = set(pending)
+    for stage_id, stage in list(pending.items()):
+        unknown = [dep for dep in stage["deps"] if dep not in stage_ids]
+        if unknown:
+            failed_dict[stage_id] = "unknown dependency " + ", ".join(unknown)
+            print("{:45} {}".format(stage_id, failed_dict[stage_id]))
+            del pending[stage_id]
+
+    # Share the available cores between the workers
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        initializer=sequential_registration.init_worker,
+        initargs=(num_threads,),
+    ) as executor:
+        while pending or running:
+            for stage_id, stage in list(pending.items()):
+                if any(dep in failed_dict for dep in stage["deps"]):
+                    failed_dict[stage_id] = "blocked by a failed dependency"
+                    print("{:45} {}".format(stage_id, failed_dict[stage_id]))
+                    del pending[stage_id]
+                elif all(dep in done for dep in stage["deps"]):
+                    future = executor.submit(
+                        run_stage, stage, is_forced(stage, force_list)
+                    )
+                    running[future] = stage_id
+                    del pending[stage_id]
+
+            if not running:
+                break
+
+            finished, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in finished:
+                stage_id = running.pop(future)
+                try:
+                    status = future.result()
+                except Exception as e:
+                    status = "failed: {}".format(e)
+
+                print("{:45} {}".format(stage_id, status))
+                if status.startswith("failed"):
+                    failed_dict[stage_id] = status
+                else:
+                    done.add(stage_id)
+
+    # Nothing is running, so the dependencies of these stages can never finish
+    for stage_id, stage in pending.items():
+        waiting = [dep for dep in stage["deps"] if dep not in done]
+        failed_dict[stage_id] = "unsatisfied dependency " + ", ".join(waiting)
+        print("{:45} {}".format(stage_id, failed_dict[stage_id]))
+
+    return failed_dict
+
+
+def job_file_name(stage_id):
+    """
+    Gets the queue job file name of a stage.
+
+    Parameters
+    ----------
+    stage_id : string
+
+    Returns
+    -------
+    string
+    """
+    return stage_id.replace("/", "__") + ".json"
+
+
+def submit_queue(stages, queue_dir, force_list=[]):
+    """
+    Adds stages to a file-based queue. Each stage is written as a JSON job file in
+    the pending directory. Earlier results for the same stages are removed.
+
+    Parameters
+    ----------
+    stages : list
+
+    queue_dir : string
+
+    force_list : list
+
+    Returns
+    -------
+
+    """
+    for state in queue_states:
+        os.makedirs(os.path.join(queue_dir, state), exist_ok=True)
+
+    for stage in stages:
+        file_name = job_file_name(stage["id"])
+        for state in ["done", "failed"]:
+            try:
+                os.remove(os.path.join(queue_dir, state, file_name))
+            except FileNotFoundError:
+                pass
+
+        job = dict(stage)
+        job["force"] = is_forced(stage, force_list)
+
+        tmp_path = os.path.join(queue_dir, file_name + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(job, f, indent=2)
+        os.replace(tmp_path, os.path.join(queue_dir, "pending", file_name))
+
+    print("Submitted {} stages to {}".format(len(stages), queue_dir))
+
+
+def requeue_stale_jobs(queue_dir, stale_time):
+    """
+    Moves running jobs whose job file has not been refreshed for stale_time
+    seconds back to pending. Workers refresh the files of the jobs they run, so
+    these are jobs of workers that were killed or lost their node.
+
+    Parameters
+    ----------
+    queue_dir : string
+
+    stale_time : float
+
+    Returns
+    -------
+
+    """
+    running_dir = os.path.join(queue_dir, "running")
+    for file_name in os.listdir(running_dir):
+        running_path = os.path.join(running_dir, file_name)
+        try:
+            if time.time() - os.path.getmtime(running_path) < stale_time:
+                continue
+            # Another worker requeued it first if the rename fails
+            os.rename(running_path, os.path.join(queue_dir, "pending", file_name))
+        except FileNotFoundError:
+            continue
+        print("{:45} {}".format(file_name, "requeued (stale)"))
+
+
+def refresh_job(running_path, interval, stop_event):
+    """
+    Updates the modification time of a running job file until stop_event is
+    set, so other workers do not requeue the job. Runs on a thread of the
+    worker.
+
+    Parameters
+    ----------
+    running_path : string
+
+    interval : float
+        Seconds between updates
+
+    stop_event : threading.Event
+
+    Returns
+    -------
+
+    """
+    while not stop_event.wait(interval):
+        try:
+            os.utime(running_path)
+        except FileNotFoundError:
+            return
+
+
+def work_queue(queue_dir, poll_time=10, stale_time=600):
+    """
+    Runs stages from a file-based queue until no pending stages are left. Stages
+    are claimed by atomically moving the job file from pending to running, so any
+    number of workers on any number of nodes can share the queue. Running jobs
+    that are not refreshed for stale_time seconds are moved back to pending, and
+    jobs with a dependency that is not in the queue are failed.
+
+    Parameters
+    ----------
+    queue_dir : string
+
+    poll_time : float
+        Seconds to wait when all pending stages are waiting on running stages
+
+    stale_time : float
+        Seconds after which a running job that has not been refreshed is
+        requeued
+
+    Returns
+    -------
+    num_done : int
+        Number of stages run (or skipped) by this worker
+    """
+    pending_dir = os.path.join(queue_dir, "pending")
+    running_dir = os.path.join(queue_dir, "running")
+    done_dir = os.path.join(queue_dir, "done")
+    failed_dir = os.path.join(queue_dir, "failed")
+    state_dirs = [os.path.join(queue_dir, state) for state in queue_states]
+
+    worker_name = "{}-{}".format(socket.gethostname(), os.getpid())
+    num_done = 0
+
+    while True:
+        requeue_stale_jobs(queue_dir, stale_time)
+
+        pending = sorted(name for name in os.listdir(pending_dir))
+        if not pending:
+            return num_done
+
+        claimed = None
+        for file_name in pending:
+            with open(os.path.join(pending_dir, file_name), "r") as f:
+                try:
+                    job = json.load(f)
+                except ValueError:
+                    continue
+
+            dep_files = [job_file_name(dep) for dep in job["deps"]]
+            if any(os.path.exists(os.path.join(failed_dir, dep)) for dep in dep_files):
+                job["status"] = "failed: blocked by a failed dependency"
+                os.replace(
+                    os.path.join(pending_dir, file_name),
+                    os.path.join(failed_dir, file_name),
+                )
+                print("{:45} {}".format(job["id"], job["status"]))
+                continue
+
+            # A dependency that was never submitted can never finish
+            unknown = [
+                dep
+                for dep, dep_file in zip(job["deps"], dep_files)
+                if not any(
+                    os.path.exists(os.path.join(state_dir, dep_file))
+                    for state_dir in state_dirs
+                )
+            ]
+            if unknown:
+                job["status"] = "failed: unknown dependency " + ", ".join(unknown)
+                try:
+                    os.replace(
+                        os.path.join(pending_dir, file_name),
+                        os.path.join(failed_dir, file_name),
+                    )
+                except FileNotFoundError:
+                    continue
+                print("{:45} {}".format(job["id"], job["status"]))
+                continue
+
+            if not all(
+                os.path.exists(os.path.join(done_dir, dep)) for dep in dep_files
+            ):
+                continue
+
+            # Claim the job. Another worker got it first if the rename fails.
+            try:
+                os.rename(
+                    os.path.join(pending_dir, file_name),
+                    os.path.join(running_dir, file_name),
+                )
+            except FileNotFoundError:
+                continue
+
+            claimed = file_name
+            break
+
+        if claimed is None:
+            time.sleep(poll_time)
+            continue
+
+        # Keep the job file fresh while the stage runs so it is not requeued
+        running_path = os.path.join(running_dir, claimed)
+        try:
+            os.utime(running_path)
+        except FileNotFoundError:
+            # Requeued by another worker before it was refreshed
+            continue
+        stop_event = threading.Event()
+        refresher = threading.Thread(
+            target=refresh_job,
+            args=(running_path, max(1.0, stale_time / 4.0), stop_event),
+            daemon=True,
+        )
+        refresher.start()
+        try:
+            status = run_stage(job, job.get("force", False))
+        finally:
+            stop_event.set()
+            refresher.join()
+
+        job["status"] = status
+        job["worker"] = worker_name
+        print("{:45} {}".format(job["id"], status))
+
+        state_dir = failed_dir if status.startswith("failed") else done_dir
+        with open(os.path.join(running_dir, claimed), "w") as f:
+            json.dump(job, f, indent=2)
+        os.replace(os.path.join(running_dir, claimed), os.path.join(state_dir, claimed))
+        num_done += 1
+
+
+def print_failures(failed_dict):
+    """
+    Prints a summary of the failed stages.
+
+    Parameters
+    ----------
+    failed_dict : dict
+
+    Returns
+    -------
+
+    """
+    if not failed_dict:
+        print("All stages completed")
+        return
+
+    print()
+    print("{} stage(s) failed:".format(len(failed_dict)))
+    for stage_id, status in sorted(failed_dict.items()):
+        print("  {}: {}".format(stage_id, status))
+
+
+if __name__ == "__main__":
+    # Parse input arguments
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="command")
+    subparsers.required = True
+
+    run_parser = subparsers.add_parser("run", help="Run on a local process pool")
+    run_parser.add_argument("manifest", type=str)
+
+    submit_parser = subparsers.add_parser("submit", help="Add all stages to a queue")
+    submit_parser.add_argument("manifest", type=str)
+    submit_parser.add_argument("queue_dir", type=str)
+
+    work_parser = subparsers.add_parser("work", help="Run stages from a queue")
+    work_parser.add_argument("queue_dir", type=str)
+    work_parser.add_argument(
+        "-p",
+        "--poll",
+        type=float,
+        default=10,
+        help="Seconds between checks for stages that are ready. Default = 10",
+    )
+    work_parser.add_argument(
+        "-s",
+        "--stale",
+        type=float,
+        default=600,
+        help="Requeue running stages whose job file has not been refreshed for "
+        "this many seconds (e.g., their node died). Default = 600",
+    )
+
+    for sub_parser in [run_parser, work_parser]:
+        sub_parser.add_argument(
+            "-w",
+            "--workers",
+            type=int,
+            default=1,
+            help="Number of worker processes. Default = 1",
+        )
+    for sub_parser in [run_parser, submit_parser]:
+        sub_parser.add_argument(
+            "-f",
+            "--force",
+            type=str,
+            nargs="+",
+            default=[],
+            help="Stages to rerun even if they are up to date (stage names, "
+            "types, IDs, or all)",
+        )
+    run_parser.add_argument(
+        "-n",
+        "--dry-run",
+        dest="dry_run",
+        action="store_true",
+        help="Only print the stages that would be run",
+    )
+    args = parser.parse_args()
+
+    if args.command == "run":
+        stages = cohort_stages(args.manifest)
+        failed_dict = run_local(stages, args.workers, args.force, args.dry_run)
+        if not args.dry_run:
+            print_failures(failed_dict)
+
+    elif args.command == "submit":
+        stages = cohort_stages(args.manifest)
+        submit_queue(stages, args.queue_dir, args.force)
+
+    elif args.command == "work":
+        num_threads = max(1, (os.cpu_count() or 1) // args.workers)
+        with ProcessPoolExecutor(
+            max_workers=args.workers,
+            initializer=sequential_registration.init_worker,
+            initargs=(num_threads,),
+        ) as executor:
+            futures = [
+                executor.submit(work_queue, args.queue_dir, args.poll, args.stale)
+                for _ in range(args.workers)
+            ]
+            num_done = sum(future.result() for future in futures)
+
+        print("Ran {} stages".format(num_done))
+        failed_dir = os.path.join(args.queue_dir, "failed")
+        print_failures(
+            {
+                name[: -len(".json")].replace("__", "/"): "see " + failed_dir
+                for name in os.listdir(failed_dir)
+            }
+        )
@@ -10,24 +10,135 @@ Description: Calculates the angle between each axis of a SCS between two raters.
 import os
 import sys
 import argparse
+import itertools
 import numpy as np
-import SimpleITK as sitk
 
-from modBiomech.calc_coord_systems import (
-    calculate_mc1_scs,
-    calculate_trp_scs,
-    transform_point,
+from modBiomech.joint_motion import (
+    calculate_mc1_scs_batch,
+    calculate_trp_scs_batch,
+    transform_points_batch,
 )
-from modBiomech.scs_diff import scs_diff
+from modBiomech.scs_diff import scs_diff_pairwise
+from modImgProc.transform_store import transform_store
 from modMisc.colours import Colours
+from modMisc.cohort import read_cohort
+from modMisc.scan_layout import get_layout
+from modMisc.table_writer import TableWriter, table_formats
 
 # Global variable for debugging
 debug = False
 
+# Raters whose points are compared for each scan
+rater_list = ["JJT", "TB", "MTK001", "MTK002", "MTK003"]
+
+# Rater pairs (and column headers) of the <scan>_scs.csv output
+pair_list = [
+    ["JJT", "TB"],
+    ["JJT", "MTK001"],
+    ["TB", "MTK001"],
+    ["MTK001", "MTK002"],
+    ["MTK001", "MTK003"],
+    ["MTK002", "MTK003"],
+]
+header_arr = np.array(
+    [
+        [
+            "Frame",
+            "JJT_TB_XCT_MC1_X",
+            "JJT_TB_XCT_MC1_Y",
+            "JJT_TB_XCT_MC1_Z",
+            "JJT_TB_XCT_TRP_X",
+            "JJT_TB_XCT_TRP_Y",
+            "JJT_TB_XCT_TRP_Z",
+            "JJT_TB_MC1_X",
+            "JJT_TB_MC1_Y",
+            "JJT_TB_MC1_Z",
+            "JJT_TB_TRP_X",
+            "JJT_TB_TRP_Y",
+            "JJT_TB_TRP_Z",
+            "JJT_MTK1_XCT_MC1_X",
+            "JJT_MTK1_XCT_MC1_Y",
+            "JJT_MTK1_XCT_MC1_Z",
+            "JJT_MTK1_XCT_TRP_X",
+            "JJT_MTK1_XCT_TRP_Y",
+            "JJT_MTK1_XCT_TRP_Z",
+            "JJT_MTK1_MC1_X",
+            "JJT_MTK1_MC1_Y",
+            "JJT_MTK1_MC1_Z",
+            "JJT_MTK1_TRP_X",
+            "JJT_MTK1_TRP_Y",
+            "JJT_MTK1_TRP_Z",
+            "TB_MTK1_XCT_MC1_X",
+            "TB_MTK1_XCT_MC1_Y",
+            "TB_MTK1_XCT_MC1_Z",
+            "TB_MTK1_XCT_TRP_X",
+            "TB_MTK1_XCT_TRP_Y",
+            "TB_MTK1_XCT_TRP_Z",
+            "TB_MTK1_MC1_X",
+            "TB_MTK1_MC1_Y",
+            "TB_MTK1_MC1_Z",
+            "TB_MTK1_TRP_X",
+            "TB_MTK1_TRP_Y",
+            "TB_MTK1_TRP_Z",
+            "MTK1_MTK2_XCT_MC1_X",
+            "MTK1_MTK2_XCT_MC1_Y",
+            "MTK2_MTK1_MC1_Z",
+            "MTK1_MTK2_XCT_TRP_X",
+            "MTK1_MTK2_XCT_TRP_Y",
+            "MTK1_MTK2_XCT_TRP_Z",
+            "MTK1_MTK2_MC1_X",
+            "MTK1_MTK2_MC1_Y",
+            "MTK2_MTK1_MC1_Z",
+            "MTK1_MTK2_TRP_X",
+            "MTK1_MTK2_TRP_Y",
+            "MTK1_MTK2_TRP_Z",
+            "MTK1_MTK3_XCT_MC1_X",
+            "MTK1_MTK3_XCT_MC1_Y",
+            "MTK1_MTK3_XCT_MC1_Z",
+            "MTK1_MTK3_XCT_TRP_X",
+            "MTK1_MTK3_XCT_TRP_Y",
+            "MTK1_MTK3_XCT_TRP_Z",
+            "MTK1_MTK3_MC1_X",
+            "MTK1_MTK3_MC1_Y",
+            "MTK1_MTK3_MC1_Z",
+            "MTK1_MTK3_TRP_X",
+            "MTK1_MTK3_TRP_Y",
+            "MTK1_MTK3_TRP_Z",
+            "MTK2_MTK3_XCT_MC1_X",
+            "MTK2_MTK3_XCT_MC1_Y",
+            "MTK2_MTK3_XCT_MC1_Z",
+            "MTK2_MTK3_XCT_TRP_X",
+            "MTK2_MTK3_XCT_TRP_Y",
+            "MTK2_MTK3_XCT_TRP_Z",
+            "MTK2_MTK3_MC1_X",
+            "MTK2_MTK3_MC1_Y",
+            "MTK2_MTK3_MC1_Z",
+            "MTK2_MTK3_TRP_X",
+            "MTK2_MTK3_TRP_Y",
+            "MTK2_MTK3_TRP_Z",
+        ]
+    ],
+    dtype=object,
+)
 
-def main(rater1, rater2, next_scan):
+# Columns of the long-format table written with --all-pairs
+pair_columns = [
+    "scan",
+    "series",
+    "rater1",
+    "rater2",
+    "bone",
+    "space",
+    "frame",
+    "x",
+    "y",
+    "z",
+]
+
+
+def main(rater1, rater2, next_scan, series=None, parent_dir=None, layout_path=None):
     """
-    Main function to find the SCS differences between raters.
+    Main function to find the SCS differences between two raters.
 
     Parameters
     ----------
@@ -37,706 +148,375 @@ def main(rater1, rater2, next_scan):
 
     next_scan : string
 
+    series : string
+        DYNACT series (B, C, or D) used for the scan. If None, the series is
+        taken from the layout file or the registration directories of the scan.
+
+    parent_dir : string
+        Directory with the points, reg, and models directories. Defaults to the
+        parent of the scripts directory.
+
+    layout_path : string
+        Scan layout file. Uses the default layout if None.
+
     Returns
     -------
     arr : numpy.array
+        (F - 1, 12) array (see pair_array)
     """
-    # -------------------------------------------------------#
-    #   Step 1: Setup inputs                                #
-    # -------------------------------------------------------#
-    parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    point_dir = os.path.join(parent_dir, "points")
-    point_dir = os.path.join(point_dir, "points_July2021")
-    reg_dir = os.path.join(parent_dir, "reg")
-    model_dir = os.path.join(parent_dir, "models")
-
-    # HR-pQCT directories:
-    xct_pnts_dir = os.path.join(point_dir, next_scan)
-    xct_pnts_dir = os.path.join(xct_pnts_dir, "HR-pQCT")
-    ct2xct_reg_dir = os.path.join(reg_dir, next_scan)
-    ct2xct_reg_dir = os.path.join(ct2xct_reg_dir, "staticCT_to_HR-pQCT")
-    xct_model_dir = os.path.join(model_dir, next_scan)
-    xct_model_dir = os.path.join(xct_model_dir, "HR-pQCT")
-
-    # Static CT directories:
-    ct_pnts_dir = os.path.join(point_dir, next_scan)
-    ct_pnts_dir = os.path.join(ct_pnts_dir, "staticCT")
-    ct2dynact_reg_dir = os.path.join(reg_dir, next_scan)
-    ct2dynact_reg_dir = os.path.join(ct2dynact_reg_dir, "staticCT_to_dynamicCT")
-    ct2dynact_reg_dir = os.path.join(ct2dynact_reg_dir, "B")
-    if "9" in next_scan:
-        ct2dynact_reg_dir = os.path.join(reg_dir, next_scan)
-        ct2dynact_reg_dir = os.path.join(ct2dynact_reg_dir, "staticCT_to_dynamicCT")
-        ct2dynact_reg_dir = os.path.join(ct2dynact_reg_dir, "C")
-
-    ct_model_dir = os.path.join(model_dir, os.path.join(next_scan, "staticCT"))
-
-    # Dyanmic CT directories:
-    dynact_pnts_dir = os.path.join(point_dir, next_scan)
-    dynact_pnts_dir = os.path.join(dynact_pnts_dir, "dynamicCT")
-    dynactReg_dir = os.path.join(reg_dir, next_scan)
-    dynactReg_dir = os.path.join(dynactReg_dir, "dynamicCT_frames")
-    dynactReg_dir = os.path.join(dynactReg_dir, os.path.join("B", "FinalTFMs"))
-    if "9" in next_scan:
-        dynactReg_dir = os.path.join(reg_dir, next_scan)
-        dynactReg_dir = os.path.join(dynactReg_dir, "dynamicCT_frames")
-        dynactReg_dir = os.path.join(dynactReg_dir, os.path.join("C", "FinalTFMs"))
-
-    dynact_model_dir = os.path.join(model_dir, os.path.join(next_scan, "dynamicCT"))
-
-    # -------------------------------------------------------#
-    #   Step 2: Read in the points from text file           #
-    # -------------------------------------------------------#
-    # There should be 3 points for the MC1 and 4 for the TRP
-    # Points are picked in the XCT space
-
-    # ---------------#
-    # Rater 1 Data  #
-    # ---------------#
-    mc1_pnts_file1 = os.path.join(
-        point_dir, str(next_scan) + "e_MC1_SCS_" + str(rater1) + ".txt"
-    )
-    trp_pnts_file1 = os.path.join(
-        point_dir, str(next_scan) + "e_TRP_SCS_" + str(rater1) + ".txt"
+    diff_dict = scan_differences(
+        next_scan, [rater1, rater2], series, parent_dir, layout_path
     )
+    return pair_array(diff_dict, 0, 1)
 
-    mc1_pnts_list1 = [None] * 3
-    trp_pnts_list1 = [None] * 4
 
-    print(
-        Colours.BLUE
-        + "\t Reading in MC1 points: "
-        + Colours.WHITE
-        + "{}".format(mc1_pnts_file1)
-    )
-    try:
-        with open(mc1_pnts_file1) as f:
-            mc1_pnts_list1 = [line.rstrip("\n") for line in f]
-    except FileNotFoundError:
-        print(Colours.RED + "ERROR: File does not exist!" + Colours.WHITE)
-        sys.exit(1)
-
-    print(
-        Colours.BLUE
-        + "\t Reading in TRP points: "
-        + Colours.WHITE
-        + "{}".format(trp_pnts_file1)
-    )
-    try:
-        with open(trp_pnts_file1) as f:
-            trp_pnts_list1 = [line.rstrip("\n") for line in f]
-    except FileNotFoundError:
-        print(Colours.RED + "ERROR: File does not exist!" + Colours.WHITE)
-        sys.exit(1)
+def read_rater_points(layout, scan_fields, raters):
+    """
+    Reads the MC1 and TRP landmarks of all raters for a scan.
 
-    # ---------------#
-    # Rater 2 Data  #
-    # ---------------#
-    mc1_pnts_file2 = os.path.join(
-        point_dir, str(next_scan) + "e_MC1_SCS_" + str(rater2) + ".txt"
-    )
-    trp_pnts_file2 = os.path.join(
-        point_dir, str(next_scan) + "e_TRP_SCS_" + str(rater2) + ".txt"
-    )
+    Parameters
+    ----------
+    layout : ScanLayout
 
-    mc1_pnts_list2 = [None] * 3
-    trp_pnts_list2 = [None] * 4
+    scan_fields : dict
+        Scan and series of the scan
 
-    print(
-        Colours.BLUE
-        + "\t Reading in MC1 points: "
-        + Colours.WHITE
-        + "{}".format(mc1_pnts_file2)
-    )
-    try:
-        with open(mc1_pnts_file2) as f:
-            mc1_pnts_list2 = [line.rstrip("\n") for line in f]
-    except FileNotFoundError:
-        print(Colours.RED + "ERROR: File does not exist!" + Colours.WHITE)
-        sys.exit(1)
+    raters : list
 
-    print(
-        Colours.BLUE
-        + "\t Reading in TRP points: "
-        + Colours.WHITE
-        + "{}".format(trp_pnts_file2)
-    )
-    try:
-        with open(trp_pnts_file2) as f:
-            trp_pnts_list2 = [line.rstrip("\n") for line in f]
-    except FileNotFoundError:
-        print(Colours.RED + "ERROR: File does not exist!" + Colours.WHITE)
-        sys.exit(1)
+    Returns
+    -------
+    mc1_pnts : numpy.array
+        (R, 3, 3) array of the MC1 landmarks of each rater
 
-    # Put the directories into lists to cleanly pass to the computeAngles function
-    xct_dir_list = [xct_pnts_dir, ct2xct_reg_dir, xct_model_dir]
-    ct_dir_list = [ct_pnts_dir, ct2dynact_reg_dir, ct_model_dir]
-    dynact_dir_list = [dynact_pnts_dir, dynactReg_dir, dynact_model_dir]
-
-    # -------------------------------------------------------#
-    #   Step 3: Transform XCT points to DYNACT space        #
-    # -------------------------------------------------------#
-    arr = xct2Dynact_transform(
-        xct_dir_list,
-        ct_dir_list,
-        dynact_dir_list,
-        mc1_pnts_list1,
-        trp_pnts_list1,
-        mc1_pnts_list2,
-        trp_pnts_list2,
-    )
+    trp_pnts : numpy.array
+        (R, 4, 3) array of the TRP landmarks of each rater
+    """
+    pnts_dict = {"MC1": [], "TRP": []}
+    for rater in raters:
+        for bone, num_pnts in [("MC1", 3), ("TRP", 4)]:
+            pnts_file = layout.path("scs_points", bone=bone, rater=rater, **scan_fields)
+            print(
+                Colours.BLUE
+                + "\t Reading in "
+                + bone
+                + " points: "
+                + Colours.WHITE
+                + "{}".format(pnts_file)
+            )
+            with open(pnts_file) as f:
+                pnts_list = [line.rstrip("\n") for line in f]
+            pnts_dict[bone].append(
+                [[float(s) for s in line.split(",")] for line in pnts_list[:num_pnts]]
+            )
 
-    return arr
+    mc1_pnts = np.array(pnts_dict["MC1"])
+    trp_pnts = np.array(pnts_dict["TRP"])
+    return mc1_pnts, trp_pnts
 
 
-def xct2Dynact_transform(
-    xct_dir_list,
-    ct_dir_list,
-    dynact_dir_list,
-    mc1_pnts_list1,
-    trp_pnts_list1,
-    mc1_pnts_list2,
-    trp_pnts_list2,
-):
+def rater_frame_points(matrices, pnts):
     """
-    Transforms from the XCT image space to the DYNACT image space (including
-    between frame transformation). This is done for both the MC1 and TRP.
+    Moves the landmarks of every rater to every frame in one matrix product.
 
     Parameters
     ----------
-    xct_dir_list : list
+    matrices : numpy.array
+        (F, 4, 4) array of transform matrices
 
-    ct_dir_list : list
+    pnts : numpy.array
+        (R, P, 3) array of the landmarks of each rater
 
-    dynact_dir_list : list
+    Returns
+    -------
+    numpy.array
+        (R, F, P, 3) array of the landmarks of each rater at each frame
+    """
+    num_raters, num_pnts = pnts.shape[:2]
+    frame_pnts = transform_points_batch(matrices, pnts.reshape(-1, 3))
+    frame_pnts = frame_pnts.reshape(len(matrices), num_raters, num_pnts, 3)
+    return frame_pnts.transpose(1, 0, 2, 3)
+
+
+def scan_differences(
+    next_scan, raters=rater_list, series=None, parent_dir=None, layout_path=None
+):
+    """
+    Finds the SCS differences between all pairs of raters for a scan. Each
+    rater's points are read once and the transforms of the scan are parsed
+    once, then the SCSs of all raters and frames are compared in one pass.
 
-    mc1_pnts_list1 : list
+    Frame 0 of the output is the XCT space and frames 1...F-1 are DYNACT frames
+    #2...#F (the same rows as the output of main).
 
-    trp_pnts_list1 : list
+    Parameters
+    ----------
+    next_scan : string
+
+    raters : list
 
-    mc1_pnts_list2 : list
+    series : string
+        DYNACT series (B, C, or D) used for the scan. If None, the series is
+        taken from the layout file or the registration directories of the scan.
 
-    trp_pnts_list2 : list
+    parent_dir : string
+        Directory with the points, reg, and models directories. Defaults to the
+        parent of the scripts directory.
+
+    layout_path : string
+        Scan layout file. Uses the default layout if None.
 
     Returns
     -------
-    arr : numpy.array
+    diff_dict : dict
+        Maps MC1 and TRP to an (R, R, F, 3) array of the X, Y, and Z axis
+        differences (in degrees) between rater i and rater j
     """
-    # ----------------------------------------------------------#
-    #   Step 1: Setup directories, points, and XCT images      #
-    # ----------------------------------------------------------#
-    # Unpack the directory lists
-    xct_pnts_dir = xct_dir_list[0]
-    ct2xct_reg_dir = xct_dir_list[1]
-    xct_model_dir = xct_dir_list[2]
-    ct_pnts_dir = ct_dir_list[0]
-    ct2dynact_reg_dir = ct_dir_list[1]
-    ct_model_dir = ct_dir_list[2]
-    dynact_pnts_dir = dynact_dir_list[0]
-    dynactReg_dir = dynact_dir_list[1]
-    dynact_model_dir = dynact_dir_list[2]
-
-    # Strip the list to create a seperate list for each point
-    # Rater 1
-    mc1_pnt1_R1 = [float(s) for s in mc1_pnts_list1[0].split(",")]
-    mc1_pnt2_R1 = [float(s) for s in mc1_pnts_list1[1].split(",")]
-    mc1_pnt3_R1 = [float(s) for s in mc1_pnts_list1[2].split(",")]
-
-    trp_pnt1_R1 = [float(s) for s in trp_pnts_list1[0].split(",")]
-    trp_pnt2_R1 = [float(s) for s in trp_pnts_list1[1].split(",")]
-    trp_pnt3_R1 = [float(s) for s in trp_pnts_list1[2].split(",")]
-    trp_pnt4_R1 = [float(s) for s in trp_pnts_list1[3].split(",")]
-
-    # Rater 2
-    mc1_pnt1_R2 = [float(s) for s in mc1_pnts_list2[0].split(",")]
-    mc1_pnt2_R2 = [float(s) for s in mc1_pnts_list2[1].split(",")]
-    mc1_pnt3_R2 = [float(s) for s in mc1_pnts_list2[2].split(",")]
-
-    trp_pnt1_R2 = [float(s) for s in trp_pnts_list2[0].split(",")]
-    trp_pnt2_R2 = [float(s) for s in trp_pnts_list2[1].split(",")]
-    trp_pnt3_R2 = [float(s) for s in trp_pnts_list2[2].split(",")]
-    trp_pnt4_R2 = [float(s) for s in trp_pnts_list2[3].split(",")]
-
-    # Sanity check
-    if debug:
-        print(Colours.PURPLE + "\t DEBUG: Directories being used:" + Colours.WHITE)
-        print("\t xct_pnts_dir: " + str(xct_pnts_dir))
-        print("\t ct2xct_reg_dir: " + str(ct2xct_reg_dir))
-        print("\t xct_model_dir: " + str(xct_model_dir))
-        print("\t ct_pnts_dir: " + str(ct_pnts_dir))
-        print("\t ct2dynact_reg_dir: " + str(ct2dynact_reg_dir))
-        print("\t ct_model_dir: " + str(ct_model_dir))
-        print("\t dynact_pnts_dir: " + str(dynact_pnts_dir))
-        print("\t dynactReg_dir: " + str(dynactReg_dir))
-        print("\t dynact_model_dir: " + str(dynact_model_dir))
-        print()
-        print(Colours.PURPLE + "\t DEBUG: Points read in:" + Colours.WHITE)
-        print("\t RATER 1:")
-        print("\t MC1:")
-        print("\t (" + str(mc1_pnt1_R1) + ")")
-        print("\t (" + str(mc1_pnt2_R1) + ")")
-        print("\t (" + str(mc1_pnt3_R1) + ")")
-        print("\t TRP:")
-        print("\t (" + str(trp_pnt1_R1) + ")")
-        print("\t (" + str(trp_pnt2_R1) + ")")
-        print("\t (" + str(trp_pnt3_R1) + ")")
-        print("\t (" + str(trp_pnt4_R1) + ")")
-        print()
-        print("\t RATER 2:")
-        print("\t MC1:")
-        print("\t (" + str(mc1_pnt1_R2) + ")")
-        print("\t (" + str(mc1_pnt2_R2) + ")")
-        print("\t (" + str(mc1_pnt3_R2) + ")")
-        print("\t TRP:")
-        print("\t (" + str(trp_pnt1_R2) + ")")
-        print("\t (" + str(trp_pnt2_R2) + ")")
-        print("\t (" + str(trp_pnt3_R2) + ")")
-        print("\t (" + str(trp_pnt4_R2) + ")")
-        print()
-
-    # ----------------------------------------------------------#
-    #   Step 2: Get the SCS difference in the XCT space        #
-    # ----------------------------------------------------------#
-    # First create the SCSs in the XCT space and get the angle between SCS axes
-    # between rater. Do this agin in the DYNACT space.
-    # Use [0, 0, 0] as the origin of the SCS (i.e., move all axes to this origin)
-    # This origin will be used as its the origin of prinicple axes of each bone
-    # Matricies from these functions are returned in the following format:
-    # [Xx  Xy  Xz]
-    # [Yx  Yy  Yz]
-    # [Zx  Zy  Zz]
-    xct_mc1_scs_R1 = np.array(
-        calculate_mc1_scs([mc1_pnt1_R1, mc1_pnt2_R1, mc1_pnt3_R1], [0, 0, 0])
-    )
-    xct_trp_scs_R1 = np.array(
-        calculate_trp_scs(
-            [trp_pnt1_R1, trp_pnt2_R1, trp_pnt3_R1, trp_pnt4_R1], [0, 0, 0]
-        )
-    )
+    if parent_dir is None:
+        parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    layout = get_layout(parent_dir, layout_path)
 
-    xct_mc1_scs_R2 = np.array(
-        calculate_mc1_scs([mc1_pnt1_R2, mc1_pnt2_R2, mc1_pnt3_R2], [0, 0, 0])
-    )
-    xct_trp_scs_R2 = np.array(
-        calculate_trp_scs(
-            [trp_pnt1_R2, trp_pnt2_R2, trp_pnt3_R2, trp_pnt4_R2], [0, 0, 0]
+    if series is None:
+        series = layout.series(next_scan)
+
+    scan_fields = {"scan": next_scan, "series": series}
+    mc1_pnts, trp_pnts = read_rater_points(layout, scan_fields, raters)
+
+    # Nifti to ITK World coordinates (Flip X and Y axes to go from VTK to ITK coordinates)
+    # The flip is a rotation, so it does not change the XCT space differences
+    mc1_pnts[:, :, :2] *= -1
+    trp_pnts[:, :, :2] *= -1
+
+    ct2xct_reg_dir = layout.path("ct2xct_reg_dir", **scan_fields)
+    ct2dynact_reg_dir = layout.path("ct2dynact_reg_dir", **scan_fields)
+    dynact_reg_dir = layout.path("dynact_reg_dir", **scan_fields)
+
+    diff_dict = {}
+    for bone, pnts, calculate_scs in [
+        ("MC1", mc1_pnts, calculate_mc1_scs_batch),
+        ("TRP", trp_pnts, calculate_trp_scs_batch),
+    ]:
+        chain = transform_store.chain(
+            ct2xct_reg_dir, ct2dynact_reg_dir, dynact_reg_dir, bone
         )
-    )
 
-    # Rater differences
-    # X
-    x_diff_mc1 = str(scsDiff(xct_mc1_scs_R1[0], xct_mc1_scs_R2[0]))
-    x_diff_trp = str(scsDiff(xct_trp_scs_R1[0], xct_trp_scs_R2[0]))
+        # XCT space followed by XCT to DYNACT frame #2...#F
+        matrices = np.concatenate([np.eye(4)[np.newaxis], chain["composed"][1:]])
 
-    # Y
-    y_diff_mc1 = str(scsDiff(xct_mc1_scs_R1[1], xct_mc1_scs_R2[1]))
-    y_diff_trp = str(scsDiff(xct_trp_scs_R1[1], xct_trp_scs_R2[1]))
+        # (R, F, P, 3) landmarks -> (R, F, 3, 3) SCSs
+        frame_pnts = rater_frame_points(matrices, pnts)
+        scs_arr = calculate_scs(frame_pnts.reshape((-1,) + pnts.shape[1:]))
+        scs_arr = scs_arr.reshape(frame_pnts.shape[:2] + (3, 3))
 
-    # Z
-    z_diff_mc1 = str(scsDiff(xct_mc1_scs_R1[2], xct_mc1_scs_R2[2]))
-    z_diff_trp = str(scsDiff(xct_trp_scs_R1[2], xct_trp_scs_R2[2]))
+        diff_dict[bone] = scs_diff_pairwise(scs_arr)
 
-    xct_arr = np.zeros(shape=(58, 6))
-    xct_arr[0] = np.array(
-        [x_diff_mc1, y_diff_mc1, z_diff_mc1, x_diff_trp, y_diff_trp, z_diff_trp]
-    )
+    return diff_dict
 
-    # ----------------------------------------------------------#
-    #   Step 3: Transform points from XCT to CT image space    #
-    # ----------------------------------------------------------#
-    # Read in the CT to XCT transform
-    # Nifti to ITK World coordinates (Flip X and Y axes to go from VTK to ITK coordinates)
-    mc1_pnt1_R1 = [-1 * mc1_pnt1_R1[0], -1 * mc1_pnt1_R1[1], mc1_pnt1_R1[2]]
-    mc1_pnt2_R1 = [-1 * mc1_pnt2_R1[0], -1 * mc1_pnt2_R1[1], mc1_pnt2_R1[2]]
-    mc1_pnt3_R1 = [-1 * mc1_pnt3_R1[0], -1 * mc1_pnt3_R1[1], mc1_pnt3_R1[2]]
-    trp_pnt1_R1 = [-1 * trp_pnt1_R1[0], -1 * trp_pnt1_R1[1], trp_pnt1_R1[2]]
-    trp_pnt2_R1 = [-1 * trp_pnt2_R1[0], -1 * trp_pnt2_R1[1], trp_pnt2_R1[2]]
-    trp_pnt3_R1 = [-1 * trp_pnt3_R1[0], -1 * trp_pnt3_R1[1], trp_pnt3_R1[2]]
-    trp_pnt4_R1 = [-1 * trp_pnt4_R1[0], -1 * trp_pnt4_R1[1], trp_pnt4_R1[2]]
-
-    mc1_pnt1_R2 = [-1 * mc1_pnt1_R2[0], -1 * mc1_pnt1_R2[1], mc1_pnt1_R2[2]]
-    mc1_pnt2_R2 = [-1 * mc1_pnt2_R2[0], -1 * mc1_pnt2_R2[1], mc1_pnt2_R2[2]]
-    mc1_pnt3_R2 = [-1 * mc1_pnt3_R2[0], -1 * mc1_pnt3_R2[1], mc1_pnt3_R2[2]]
-    trp_pnt1_R2 = [-1 * trp_pnt1_R2[0], -1 * trp_pnt1_R2[1], trp_pnt1_R2[2]]
-    trp_pnt2_R2 = [-1 * trp_pnt2_R2[0], -1 * trp_pnt2_R2[1], trp_pnt2_R2[2]]
-    trp_pnt3_R2 = [-1 * trp_pnt3_R2[0], -1 * trp_pnt3_R2[1], trp_pnt3_R2[2]]
-    trp_pnt4_R2 = [-1 * trp_pnt4_R2[0], -1 * trp_pnt4_R2[1], trp_pnt4_R2[2]]
-
-    # MC1
-    ct2xct_path_mc1 = os.path.join(ct2xct_reg_dir, "CT2XCT_MC1_REG.tfm")
-    ct2xct_mc1_tfm = sitk.ReadTransform(ct2xct_path_mc1)
-    xct2ct_mc1_tfm = ct2xct_mc1_tfm.GetInverse()
-
-    mc1_pnt1_ct_R1 = transform_point(xct2ct_mc1_tfm, mc1_pnt1_R1)
-    mc1_pnt2_ct_R1 = transform_point(xct2ct_mc1_tfm, mc1_pnt2_R1)
-    mc1_pnt3_ct_R1 = transform_point(xct2ct_mc1_tfm, mc1_pnt3_R1)
-
-    mc1_pnt1_ct_R2 = transform_point(xct2ct_mc1_tfm, mc1_pnt1_R2)
-    mc1_pnt2_ct_R2 = transform_point(xct2ct_mc1_tfm, mc1_pnt2_R2)
-    mc1_pnt3_ct_R2 = transform_point(xct2ct_mc1_tfm, mc1_pnt3_R2)
-
-    # TRP
-    ct2xct_path_trp = os.path.join(ct2xct_reg_dir, "CT2XCT_TRP_REG.tfm")
-    ct2xct_trp_tfm = sitk.ReadTransform(ct2xct_path_trp)
-    xct2ct_trp_tfm = ct2xct_trp_tfm.GetInverse()
-
-    trp_pnt1_ct_R1 = transform_point(xct2ct_trp_tfm, trp_pnt1_R1)
-    trp_pnt2_ct_R1 = transform_point(xct2ct_trp_tfm, trp_pnt2_R1)
-    trp_pnt3_ct_R1 = transform_point(xct2ct_trp_tfm, trp_pnt3_R1)
-    trp_pnt4_ct_R1 = transform_point(xct2ct_trp_tfm, trp_pnt4_R1)
-
-    trp_pnt1_ct_R2 = transform_point(xct2ct_trp_tfm, trp_pnt1_R2)
-    trp_pnt2_ct_R2 = transform_point(xct2ct_trp_tfm, trp_pnt2_R2)
-    trp_pnt3_ct_R2 = transform_point(xct2ct_trp_tfm, trp_pnt3_R2)
-    trp_pnt4_ct_R2 = transform_point(xct2ct_trp_tfm, trp_pnt4_R2)
-
-    if debug:
-        print(
-            Colours.PURPLE + "\t DEBUG: Points transformed to CT space:" + Colours.WHITE
-        )
-        print("\t RATER 1:")
-        print("\t MC1:")
-        print("\t mc1Point1CT: " + str(mc1_pnt1_ct_R1))
-        print("\t mc1Point2CT: " + str(mc1_pnt2_ct_R1))
-        print("\t mc1Point3CT: " + str(mc1_pnt3_ct_R1))
-        print("\t TRP:")
-        print("\t trpPoint1CT: " + str(trp_pnt1_ct_R1))
-        print("\t trpPoint2CT: " + str(trp_pnt2_ct_R1))
-        print("\t trpPoint3CT: " + str(trp_pnt3_ct_R1))
-        print("\t trpPoint4CT: " + str(trp_pnt4_ct_R1))
-        print()
-        print("\t RATER 1:")
-        print("\t MC1:")
-        print("\t mc1Point1CT: " + str(mc1_pnt1_ct_R2))
-        print("\t mc1Point2CT: " + str(mc1_pnt2_ct_R2))
-        print("\t mc1Point3CT: " + str(mc1_pnt3_ct_R2))
-        print("\t TRP:")
-        print("\t trpPoint1CT: " + str(trp_pnt1_ct_R2))
-        print("\t trpPoint2CT: " + str(trp_pnt2_ct_R2))
-        print("\t trpPoint3CT: " + str(trp_pnt3_ct_R2))
-        print("\t trpPoint4CT: " + str(trp_pnt4_ct_R2))
-        print()
-
-    # ----------------------------------------------------------#
-    #   Step 3: Transform points from CT to DYNACT image space #
-    # ----------------------------------------------------------#
-    # Read in the CT to DYNACT (first frame) transform
-    # MC1
-    ct2dynact_path_mc1 = os.path.join(ct2dynact_reg_dir, "CT2DYNACT_MC1_REG.tfm")
-    ct2dynact_mc1_tfm = sitk.ReadTransform(ct2dynact_path_mc1)
-
-    mc1_pnt1_dynact_R1 = transform_point(ct2dynact_mc1_tfm, mc1_pnt1_ct_R1)
-    mc1_pnt2_dynact_R1 = transform_point(ct2dynact_mc1_tfm, mc1_pnt2_ct_R1)
-    mc1_pnt3_dynact_R1 = transform_point(ct2dynact_mc1_tfm, mc1_pnt3_ct_R1)
-
-    mc1_pnt1_dynact_R2 = transform_point(ct2dynact_mc1_tfm, mc1_pnt1_ct_R2)
-    mc1_pnt2_dynact_R2 = transform_point(ct2dynact_mc1_tfm, mc1_pnt2_ct_R2)
-    mc1_pnt3_dynact_R2 = transform_point(ct2dynact_mc1_tfm, mc1_pnt3_ct_R2)
-
-    # TRP
-    ct2dynact_path_trp = os.path.join(ct2dynact_reg_dir, "CT2DYNACT_TRP_REG.tfm")
-    ct2dynact_trp_tfm = sitk.ReadTransform(ct2dynact_path_trp)
-
-    trp_pnt1_dynact_R1 = transform_point(ct2dynact_trp_tfm, trp_pnt1_ct_R1)
-    trp_pnt2_dynact_R1 = transform_point(ct2dynact_trp_tfm, trp_pnt2_ct_R1)
-    trp_pnt3_dynact_R1 = transform_point(ct2dynact_trp_tfm, trp_pnt3_ct_R1)
-    trp_pnt4_dynact_R1 = transform_point(ct2dynact_trp_tfm, trp_pnt4_ct_R1)
-
-    trp_pnt1_dynact_R2 = transform_point(ct2dynact_trp_tfm, trp_pnt1_ct_R2)
-    trp_pnt2_dynact_R2 = transform_point(ct2dynact_trp_tfm, trp_pnt2_ct_R2)
-    trp_pnt3_dynact_R2 = transform_point(ct2dynact_trp_tfm, trp_pnt3_ct_R2)
-    trp_pnt4_dynact_R2 = transform_point(ct2dynact_trp_tfm, trp_pnt4_ct_R2)
-
-    if debug:
-        print(
-            Colours.PURPLE
-            + "\t DEBUG: Points transformed to DYNACT space:"
-            + Colours.WHITE
-        )
-        print("\t RATER 1:")
-        print("\t MC1:")
-        print("\t mc1Point1DYNACT: " + str(mc1_pnt1_dynact_R1))
-        print("\t mc1Point2DYNACT: " + str(mc1_pnt2_dynact_R1))
-        print("\t mc1Point3DYNACT: " + str(mc1_pnt3_dynact_R1))
-        print("\t TRP:")
-        print("\t trpPoint1DYNACT: " + str(trp_pnt1_dynact_R1))
-        print("\t trpPoint2DYNACT: " + str(trp_pnt2_dynact_R1))
-        print("\t trpPoint3DYNACT: " + str(trp_pnt3_dynact_R1))
-        print("\t trpPoint4DYNACT: " + str(trp_pnt4_dynact_R1))
-        print()
-        print("\t RATER 2:")
-        print("\t MC1:")
-        print("\t mc1Point1DYNACT: " + str(mc1_pnt1_dynact_R2))
-        print("\t mc1Point2DYNACT: " + str(mc1_pnt2_dynact_R2))
-        print("\t mc1Point3DYNACT: " + str(mc1_pnt3_dynact_R2))
-        print("\t TRP:")
-        print("\t trpPoint1DYNACT: " + str(trp_pnt1_dynact_R2))
-        print("\t trpPoint2DYNACT: " + str(trp_pnt2_dynact_R2))
-        print("\t trpPoint3DYNACT: " + str(trp_pnt3_dynact_R2))
-        print("\t trpPoint4DYNACT: " + str(trp_pnt4_dynact_R2))
-        print()
-
-    # ----------------------------------------------------------#
-    #   Step 4: Transform between DYNACT frames                #
-    # ----------------------------------------------------------#
-    diff_mc1_arr = np.zeros(shape=(58, 3))
-    diff_trp_arr = np.zeros(shape=(58, 3))
-
-    for i in range(2, 60):
-        # Transform to the next DYNACT frame
-        # MC1
-        dynact_reg_path_mc1 = os.path.join(
-            dynactReg_dir, "VOLUME_REF_TO_" + str(i) + "_MC1_REG.tfm"
-        )
-        dynact_next_reg_mc1_tfm = sitk.ReadTransform(dynact_reg_path_mc1)
 
-        mc1_pnt1_dynact_frame_R1 = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt1_dynact_R1
-        )
-        mc1_pnt2_dynact_frame_R1 = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt2_dynact_R1
-        )
-        mc1_pnt3_dynact_frame_R1 = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt3_dynact_R1
-        )
+def pair_array(diff_dict, i, j):
+    """
+    Arranges the differences between two raters in the same format as the
+    output of main.
 
-        mc1_pnt1_dynact_frame_R2 = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt1_dynact_R2
-        )
-        mc1_pnt2_dynact_frame_R2 = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt2_dynact_R2
-        )
-        mc1_pnt3_dynact_frame_R2 = transform_point(
-            dynact_next_reg_mc1_tfm, mc1_pnt3_dynact_R2
-        )
+    Parameters
+    ----------
+    diff_dict : dict
+        Output of scan_differences
 
-        # TRP
-        dynact_reg_path_trp = os.path.join(
-            dynactReg_dir, "VOLUME_REF_TO_" + str(i) + "_TRP_REG.tfm"
-        )
-        dynact_next_reg_trp_tfm = sitk.ReadTransform(dynact_reg_path_trp)
+    i : int
+        Index of rater 1
 
-        trp_pnt1_dynact_frame_R1 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt1_dynact_R1
-        )
-        trp_pnt2_dynact_frame_R1 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt2_dynact_R1
-        )
-        trp_pnt3_dynact_frame_R1 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt3_dynact_R1
-        )
-        trp_pnt4_dynact_frame_R1 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt4_dynact_R1
-        )
+    j : int
+        Index of rater 2
 
-        trp_pnt1_dynact_frame_R2 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt1_dynact_R2
-        )
-        trp_pnt2_dynact_frame_R2 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt2_dynact_R2
-        )
-        trp_pnt3_dynact_frame_R2 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt3_dynact_R2
-        )
-        trp_pnt4_dynact_frame_R2 = transform_point(
-            dynact_next_reg_trp_tfm, trp_pnt4_dynact_R2
-        )
+    Returns
+    -------
+    arr : numpy.array
+        (F - 1, 12) array for F DYNACT frames
+    """
+    num_rows = diff_dict["MC1"].shape[2] - 1
+    xct_arr = np.zeros(shape=(num_rows, 6))
+    xct_arr[0] = np.hstack([diff_dict["MC1"][i, j, 0], diff_dict["TRP"][i, j, 0]])
 
-        # Use [0, 0, 0] as the origin of the SCS (i.e., move all axes to this origin)
-        # This origin will be used as its the origin of prinicple axes of each bone
-        # Matricies from these functions are returned in the following format:
-        # [Xx  Xy  Xz]
-        # [Yx  Yy  Yz]
-        # [Zx  Zy  Zz]
-        xct_mc1_scs_R1 = np.array(
-            calculate_mc1_scs(
-                [
-                    mc1_pnt1_dynact_frame_R1,
-                    mc1_pnt2_dynact_frame_R1,
-                    mc1_pnt3_dynact_frame_R1,
-                ],
-                [0, 0, 0],
-            )
-        )
-        xct_trp_scs_R1 = np.array(
-            calculate_trp_scs(
-                [
-                    trp_pnt1_dynact_frame_R1,
-                    trp_pnt2_dynact_frame_R1,
-                    trp_pnt3_dynact_frame_R1,
-                    trp_pnt4_dynact_frame_R1,
-                ],
-                [0, 0, 0],
-            )
-        )
+    arr = np.hstack([xct_arr, diff_dict["MC1"][i, j, 1:], diff_dict["TRP"][i, j, 1:]])
+    return arr
 
-        xct_mc1_scs_R2 = np.array(
-            calculate_mc1_scs(
-                [
-                    mc1_pnt1_dynact_frame_R2,
-                    mc1_pnt2_dynact_frame_R2,
-                    mc1_pnt3_dynact_frame_R2,
-                ],
-                [0, 0, 0],
-            )
-        )
-        xct_trp_scs_R2 = np.array(
-            calculate_trp_scs(
-                [
-                    trp_pnt1_dynact_frame_R2,
-                    trp_pnt2_dynact_frame_R2,
-                    trp_pnt3_dynact_frame_R2,
-                    trp_pnt4_dynact_frame_R2,
-                ],
-                [0, 0, 0],
-            )
-        )
 
-        # Rater differences
-        # X
-        x_diff_mc1 = str(scsDiff(xct_mc1_scs_R1[0], xct_mc1_scs_R2[0]))
-        x_diff_trp = str(scsDiff(xct_trp_scs_R1[0], xct_trp_scs_R2[0]))
+def write_pairs(writer, next_scan, series, raters, diff_dict):
+    """
+    Appends the differences between every pair of raters of a scan to a
+    long-format table.
 
-        # Y
-        y_diff_mc1 = str(scsDiff(xct_mc1_scs_R1[1], xct_mc1_scs_R2[1]))
-        y_diff_trp = str(scsDiff(xct_trp_scs_R1[1], xct_trp_scs_R2[1]))
+    Parameters
+    ----------
+    writer : TableWriter
 
-        # Z
-        z_diff_mc1 = str(scsDiff(xct_mc1_scs_R1[2], xct_mc1_scs_R2[2]))
-        z_diff_trp = str(scsDiff(xct_trp_scs_R1[2], xct_trp_scs_R2[2]))
+    next_scan : string
 
-        diff_mc1_arr[i - 2] = np.array([x_diff_mc1, y_diff_mc1, z_diff_mc1])
-        diff_trp_arr[i - 2] = np.array([x_diff_trp, y_diff_trp, z_diff_trp])
+    series : string
 
-    arr = np.hstack([xct_arr, diff_mc1_arr, diff_trp_arr])
-    return arr
+    raters : list
+
+    diff_dict : dict
+        Output of scan_differences
+    """
+    num_frames = diff_dict["MC1"].shape[2]
+    space_arr = ["XCT"] + ["DYNACT"] * (num_frames - 1)
+    frame_arr = np.hstack([[0], np.arange(2, num_frames + 1)])
+
+    for i, j in itertools.combinations(range(len(raters)), 2):
+        for bone in ["MC1", "TRP"]:
+            diff_arr = diff_dict[bone][i, j]
+            batch = {
+                "scan": next_scan,
+                "series": series,
+                "rater1": raters[i],
+                "rater2": raters[j],
+                "bone": bone,
+                "space": space_arr,
+                "frame": frame_arr,
+                "x": diff_arr[:, 0],
+                "y": diff_arr[:, 1],
+                "z": diff_arr[:, 2],
+            }
+            writer.write(batch)
 
 
 if __name__ == "__main__":
     # Allow for extra output for debugging
     parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "scans",
+        type=str,
+        nargs="*",
+        help="Scans to process. Default = all scans in the cohort manifest, or all "
+        "directories in the models directory",
+    )
+    parser.add_argument(
+        "-m",
+        "--manifest",
+        type=str,
+        default=None,
+        help="Cohort manifest (YAML) with the scans and DYNACT series to process",
+    )
+    parser.add_argument(
+        "-l",
+        "--layout",
+        type=str,
+        default=None,
+        help="Scan layout file (YAML). Default = modMisc/scan_layout.yml",
+    )
+    parser.add_argument(
+        "-r",
+        "--raters",
+        type=str,
+        nargs="+",
+        default=rater_list,
+        help="Raters to compare. <scan>_scs.csv is only written if all of the "
+        "default raters are included. Default = " + " ".join(rater_list),
+    )
+    parser.add_argument(
+        "-a",
+        "--all-pairs",
+        action="store_true",
+        help="Also write the differences between every pair of raters to "
+        "output/scs_pairs.csv (one row per scan, rater pair, bone, and frame)",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default=None,
+        choices=table_formats,
+        help="Also write the --all-pairs table as Parquet or Feather (requires "
+        "pyarrow)",
+    )
     parser.add_argument("-d", "--debug", nargs="?", type=bool, default=False)
     args = parser.parse_args()
     debug = args.debug
 
     parent_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-    model_dir = os.path.join(parent_dir, "models")
-    output_dir = os.path.join(parent_dir, "output")
-
-    raters = ["JJT", "TB", "MTK001", "MTK002", "MTK003"]
-    header_arr = np.array(
-        [
-            [
-                "Frame",
-                "JJT_TB_XCT_MC1_X",
-                "JJT_TB_XCT_MC1_Y",
-                "JJT_TB_XCT_MC1_Z",
-                "JJT_TB_XCT_TRP_X",
-                "JJT_TB_XCT_TRP_Y",
-                "JJT_TB_XCT_TRP_Z",
-                "JJT_TB_MC1_X",
-                "JJT_TB_MC1_Y",
-                "JJT_TB_MC1_Z",
-                "JJT_TB_TRP_X",
-                "JJT_TB_TRP_Y",
-                "JJT_TB_TRP_Z",
-                "JJT_MTK1_XCT_MC1_X",
-                "JJT_MTK1_XCT_MC1_Y",
-                "JJT_MTK1_XCT_MC1_Z",
-                "JJT_MTK1_XCT_TRP_X",
-                "JJT_MTK1_XCT_TRP_Y",
-                "JJT_MTK1_XCT_TRP_Z",
-                "JJT_MTK1_MC1_X",
-                "JJT_MTK1_MC1_Y",
-                "JJT_MTK1_MC1_Z",
-                "JJT_MTK1_TRP_X",
-                "JJT_MTK1_TRP_Y",
-                "JJT_MTK1_TRP_Z",
-                "TB_MTK1_XCT_MC1_X",
-                "TB_MTK1_XCT_MC1_Y",
-                "TB_MTK1_XCT_MC1_Z",
-                "TB_MTK1_XCT_TRP_X",
-                "TB_MTK1_XCT_TRP_Y",
-                "TB_MTK1_XCT_TRP_Z",
-                "TB_MTK1_MC1_X",
-                "TB_MTK1_MC1_Y",
-                "TB_MTK1_MC1_Z",
-                "TB_MTK1_TRP_X",
-                "TB_MTK1_TRP_Y",
-                "TB_MTK1_TRP_Z",
-                "MTK1_MTK2_XCT_MC1_X",
-                "MTK1_MTK2_XCT_MC1_Y",
-                "MTK2_MTK1_MC1_Z",
-                "MTK1_MTK2_XCT_TRP_X",
-                "MTK1_MTK2_XCT_TRP_Y",
-                "MTK1_MTK2_XCT_TRP_Z",
-                "MTK1_MTK2_MC1_X",
-                "MTK1_MTK2_MC1_Y",
-                "MTK2_MTK1_MC1_Z",
-                "MTK1_MTK2_TRP_X",
-                "MTK1_MTK2_TRP_Y",
-                "MTK1_MTK2_TRP_Z",
-                "MTK1_MTK3_XCT_MC1_X",
-                "MTK1_MTK3_XCT_MC1_Y",
-                "MTK1_MTK3_XCT_MC1_Z",
-                "MTK1_MTK3_XCT_TRP_X",
-                "MTK1_MTK3_XCT_TRP_Y",
-                "MTK1_MTK3_XCT_TRP_Z",
-                "MTK1_MTK3_MC1_X",
-                "MTK1_MTK3_MC1_Y",
-                "MTK1_MTK3_MC1_Z",
-                "MTK1_MTK3_TRP_X",
-                "MTK1_MTK3_TRP_Y",
-                "MTK1_MTK3_TRP_Z",
-                "MTK2_MTK3_XCT_MC1_X",
-                "MTK2_MTK3_XCT_MC1_Y",
-                "MTK2_MTK3_XCT_MC1_Z",
-                "MTK2_MTK3_XCT_TRP_X",
-                "MTK2_MTK3_XCT_TRP_Y",
-                "MTK2_MTK3_XCT_TRP_Z",
-                "MTK2_MTK3_MC1_X",
-                "MTK2_MTK3_MC1_Y",
-                "MTK2_MTK3_MC1_Z",
-                "MTK2_MTK3_TRP_X",
-                "MTK2_MTK3_TRP_Y",
-                "MTK2_MTK3_TRP_Z",
-            ]
-        ],
-        dtype=object,
-    )
-    frame_arr = np.arange(58).astype(str)
-    frame_arr.shape = (58, 1)
-
-    # Compute angles for each rater, for each scan
-    for sub_dir in next(os.walk(model_dir))[1]:
-        # Skip a few directories that aren't ready for processing
-        if "DYNACT1_011" in sub_dir or "DYNACT1_001" in sub_dir or "Marker" in sub_dir:
-            continue
 
+    # Scans (and their DYNACT series) to process
+    if args.manifest is not None:
+        cohort = read_cohort(args.manifest)
+        parent_dir = cohort["root"]
+        scan_list = [[scan["scan"], scan["series"]] for scan in cohort["scans"]]
+    else:
+        layout = get_layout(parent_dir, args.layout)
+        scan_list = [[sub_dir, None] for sub_dir in layout.scans()]
+
+    if args.scans:
+        series_dict = dict(scan_list)
+        scan_list = [[sub_dir, series_dict.get(sub_dir)] for sub_dir in args.scans]
+
+    layout = get_layout(parent_dir, args.layout)
+    output_dir = layout.path("output_dir")
+
+    # The <scan>_scs.csv output compares fixed pairs of the default raters
+    raters = args.raters
+    pair_index_list = None
+    if all(rater in raters for rater in rater_list):
+        pair_index_list = [
+            [raters.index(rater1), raters.index(rater2)] for rater1, rater2 in pair_list
+        ]
+
+    writer = None
+    if args.all_pairs:
+        output_path = os.path.join(output_dir, "scs_pairs.csv")
+        table_path = None
+        if args.format is not None:
+            table_path = os.path.splitext(output_path)[0] + "." + args.format
+        writer = TableWriter(output_path, pair_columns, table_path, args.format)
+
+    failures = []
+
+    # Compute the differences between all raters, for each scan
+    for sub_dir, series in scan_list:
         print(
             Colours.BOLD + "Computing SCS for " + str(sub_dir) + "..." + Colours.WHITE
         )
 
-        output_arr = frame_arr
-        # JJT vs TB
-        output_arr = np.hstack([output_arr, main(raters[0], raters[1], sub_dir)])
-        # JJT vs MTK1
-        output_arr = np.hstack([output_arr, main(raters[0], raters[2], sub_dir)])
-        # TB vs MTK1
-        output_arr = np.hstack([output_arr, main(raters[1], raters[2], sub_dir)])
-        # MTK1 vs MTK2
-        output_arr = np.hstack([output_arr, main(raters[2], raters[3], sub_dir)])
-        # MTK1 vs MTK3
-        output_arr = np.hstack([output_arr, main(raters[2], raters[4], sub_dir)])
-        # MTK2 vs MTK3
-        output_arr = np.hstack([output_arr, main(raters[3], raters[4], sub_dir)])
-        output_arr = np.vstack([header_arr, output_arr])
-        output_arr = output_arr.astype(str)
-
-        print(Colours.BOLD + "Writing out values to CSV..." + Colours.WHITE)
-        print()
-        output_csv = os.path.join(output_dir, str(sub_dir) + "_scs.csv")
-        np.savetxt(output_csv, output_arr, delimiter=",", fmt="%s")
+        try:
+            if series is None:
+                series = layout.series(sub_dir)
+            diff_dict = scan_differences(
+                sub_dir, raters, series, parent_dir, args.layout
+            )
+        except (OSError, ValueError) as e:
+            print(Colours.RED + "ERROR: {}".format(e) + Colours.WHITE)
+            failures.append([sub_dir, str(e)])
+            continue
+
+        if pair_index_list is not None:
+            pair_arrs = [pair_array(diff_dict, i, j) for i, j in pair_index_list]
+            num_rows = pair_arrs[0].shape[0]
+            frame_arr = np.arange(num_rows).reshape(num_rows, 1)
+            output_arr = np.hstack([frame_arr] + pair_arrs)
+
+            print(Colours.BOLD + "Writing out values to CSV..." + Colours.WHITE)
+            print()
+            output_csv = os.path.join(output_dir, str(sub_dir) + "_scs.csv")
+            np.savetxt(
+                output_csv,
+                output_arr,
+                delimiter=",",
+                header=",".join(header_arr[0]),
+                comments="",
+                fmt=["%d"] + ["%s"] * (output_arr.shape[1] - 1),
+            )
+
+        if writer is not None:
+            write_pairs(writer, sub_dir, series, raters, diff_dict)
+
+    if writer is not None:
+        writer.close()
+        print("Writing to {}".format(output_path))
 
     print()
+    if failures:
+        print(Colours.RED + "{} scan(s) failed:".format(len(failures)) + Colours.WHITE)
+        for sub_dir, error in failures:
+            print("\t {}: {}".format(sub_dir, error))
+        sys.exit(1)
+
     print(Colours.BOLD + "Done!")
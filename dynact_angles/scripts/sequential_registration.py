@@ -8,11 +8,31 @@ Description: Register dynamic CT image frames using sequential registration.
 """
 
 import os
+import json
+import time
 import errno
+import hashlib
+import sqlite3
 import argparse
 import numpy as np
 import SimpleITK as sitk
 
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from modImgProc.dynact_stack import DynactStack
+from modImgProc.roi import crop_to_mask
+from modImgProc.transform_matrix import transform_to_matrix, matrix_to_euler
+from modImgProc.async_writer import AsyncWriter
+from modImgProc.registration_profiles import load_profile, setup_registration
+from modImgProc.reference_context import (
+    ReferenceContext,
+    multi_resolution_registration,
+)
+
+# Side products that can be written for each registered frame. Only the TFMs and
+# full masks are used downstream (compute_motion.py).
+output_types = ["tfm", "fullmask", "resampled-gray"]
+
 
 def command_iteration(method):
     """
@@ -36,48 +56,6 @@ def command_iteration(method):
     )
 
 
-def get_dynact_images(dynact_dir):
-    """
-    Loads all DYNACT images into an array.
-
-    Parameters
-    ----------
-    dynact_dir : string
-
-    Returns
-    -------
-    dynact_img_list : list
-    """
-    # Read in DYNACT images into an array
-    # Array format:
-    #       -dynact_img_list[i] = [volume_num, [MC1_SEG, TRP_SEG], grayscale_img]
-    dynact_img_list = [None] * 60
-
-    for i in range(1, 60, 1):
-        # Get the next volume file
-        next_file = os.path.join(dynact_dir, "Volume_" + str(i) + "_Resampled.nii")
-        next_file_abs_path = os.path.join(dynact_dir, next_file)
-
-        if not os.path.isfile(next_file_abs_path):
-            continue
-
-        # Get the volume number
-        if next_file[-16] == "_":
-            volume_num = int(next_file[-15:-14])
-        else:
-            volume_num = int(next_file[-16:-14])
-
-        # Read the image
-        next_volume = sitk.ReadImage(next_file_abs_path, sitk.sitkFloat32)
-        # print("Reading: {}".format(next_file_abs_path))
-
-        # Add the SimpleITK image to the volume list
-        # Use the volume number to avoid sorting
-        dynact_img_list[volume_num - 1] = [volume_num - 1, [None] * 2, next_volume]
-
-    return dynact_img_list
-
-
 def binary_resample(ref, img):
     """
     Resamples an input image (binary) using a reference image.
@@ -195,9 +173,11 @@ def initialize_tfm(fixed, moving):
     return tmat
 
 
-def registration(init_tmat, fixed, moving):
+def registration(init_tmat, fixed, context, profile, sampling_scale=1.0):
     """
-    Performs image registration between a fixed and moving image.
+    Performs image registration between a fixed image and the moving (reference)
+    image. The moving image pyramid is taken from the reference context, so it is
+    only computed once for all frames.
 
     Parameters
     ----------
@@ -205,269 +185,923 @@ def registration(init_tmat, fixed, moving):
 
     fixed : SimpleITK.Image
 
-    moving : SimpleITK.Image
+    context : modImgProc.ReferenceContext
+        Moving image and its smoothed pyramid levels
+
+    profile : dict
+        Registration profile (pyramid, metric sampling, and optimizer settings)
+
+    sampling_scale : float
+        Factor applied to the profile's metric sampling percentages
 
     Returns
     -------
     final_tmat : SimpleITK.TFM
+
+    num_iterations : int
+        Total number of optimizer iterations over all resolution levels
     """
-    reg = sitk.ImageRegistrationMethod()
 
-    # Similarity metric settings:
-    reg.SetMetricAsMeanSquares()
-    reg.SetMetricSamplingStrategy(reg.RANDOM)
-    reg.SetMetricSamplingPercentage(0.0001)
+    def level_registration(level):
+        reg = sitk.ImageRegistrationMethod()
 
-    # Set Interpolator
-    reg.SetInterpolator(sitk.sitkLinear)
+        # Similarity metric settings:
+        reg.SetMetricAsMeanSquares()
 
-    # Optimizer settings.
-    reg.SetOptimizerAsPowell(numberOfIterations=100, valueTolerance=1e-22)
-    reg.SetOptimizerScalesFromPhysicalShift()
+        # Set Interpolator
+        reg.SetInterpolator(sitk.sitkLinear)
 
-    # Setup for the multi-resolution framework.
-    reg.SetShrinkFactorsPerLevel(shrinkFactors=[1, 1])
-    reg.SetSmoothingSigmasPerLevel(smoothingSigmas=[1, 0])
-    reg.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
+        # Metric sampling and optimizer settings for this resolution level
+        setup_registration(reg, profile, sampling_scale, level)
 
-    reg.AddCommand(sitk.sitkIterationEvent, lambda: command_iteration(reg))
+        reg.AddCommand(sitk.sitkIterationEvent, lambda: command_iteration(reg))
 
-    # Don't optimize in-place, we would possibly like to run this cell multiple times.
-    reg.SetInitialTransform(init_tmat, inPlace=False)
+        return reg
 
-    # FORMAT: registration.Execute(fixedImage, movingImage)
-    final_tmat = reg.Execute(fixed, moving)
+    final_tmat, level_iterations = multi_resolution_registration(
+        level_registration, init_tmat, fixed, context
+    )
+    num_iterations = sum(level_iterations)
 
-    # Output the final metric value and the reason for stopping the optimizer
     print()
-    print("Final metric value: {0}".format(reg.GetMetricValue()))
-    print(
-        "Optimizer's stopping condition, {0}".format(
-            reg.GetOptimizerStopConditionDescription()
-        )
-    )
+    print("Optimizer iterations: {0}".format(num_iterations))
     print()
 
-    return final_tmat
+    return final_tmat, num_iterations
 
 
-def main(dynact_dir, mc1_seg, trp_seg, output_dir):
+def evaluate_metric(tmat, fixed, moving):
     """
-    Main function to perform the sequential image registration.
+    Evaluates the mean squares metric of a transform on all voxels at full
+    resolution. Unlike the metric value reported by the optimizer, this does not
+    depend on the registration profile, so it can be used to compare profiles.
 
     Parameters
     ----------
-    dynact_dir : string
-
-    mc1_seg : string
+    tmat : SimpleITK.TFM
 
-    trp_seg : string
+    fixed : SimpleITK.Image
 
-    output_dir : string
+    moving : SimpleITK.Image
 
     Returns
     -------
+    metric_value : float
+    """
+    reg = sitk.ImageRegistrationMethod()
+    reg.SetMetricAsMeanSquares()
+    reg.SetMetricSamplingStrategy(reg.NONE)
+    reg.SetInterpolator(sitk.sitkLinear)
+    reg.SetInitialTransform(tmat, inPlace=False)
+
+    return reg.MetricEvaluate(fixed, moving)
 
+
+def create_output_dirs(output_dir):
     """
-    dynact_img_list = get_dynact_images(dynact_img_list)
+    Creates the output directories for the registered transforms and masks.
+
+    Parameters
+    ----------
+    output_dir : string
 
-    # Read masks
-    print("Reading in {}".format(mc1_seg))
-    mc1_seg_img = sitk.ReadImage(mc1_seg)
-    print("Reading in {}".format(trp_seg))
-    trp_seg_img = sitk.ReadImage(trp_seg)
+    Returns
+    -------
+    output_tmat_dir : string
 
-    # Create the output directories
+    output_seg_dir : string
+    """
     output_tmat_dir = os.path.join(output_dir, "FinalTFMs")
     output_initial_transf_dir = os.path.join(output_dir, "InitalTransformations")
     output_seg_dir = os.path.join(output_dir, "RegisteredMasks")
 
-    try:
-        os.mkdir(output_tmat_dir)
-    except OSError as e:
-        if e.errno != errno.EEXIST:  # Directory already exists error
-            raise
-    try:
-        os.mkdir(output_initial_transf_dir)
-    except OSError as e:
-        if e.errno != errno.EEXIST:  # Directory already exists error
-            raise
-    try:
-        os.mkdir(output_seg_dir)
-    except OSError as e:
-        if e.errno != errno.EEXIST:  # Directory already exists error
-            raise
-
-    # Resample the next MC1/TRP mask to match the DYNACT grayscale image
-    mc1_seg_img_resampled = binary_resample(dynact_img_list[0][2], mc1_seg_img)
-    trp_seg_img_resampled = binary_resample(dynact_img_list[0][2], trp_seg_img)
-
-    # Crop the MC1 and TRP from the first frame
-    # Dilate the MC1 and TRP segmentation masks
-    dynact_img_list[0][1][0] = dilate_mask(mc1_seg_img_resampled)
-    dynact_img_list[0][1][1] = dilate_mask(trp_seg_img_resampled)
-
-    # Mask out each bone from the first frame
-    masked_mc1_img = mask_bone(dynact_img_list[0][2], dynact_img_list[0][1][0])
-    masked_trp_img = mask_bone(dynact_img_list[0][2], dynact_img_list[0][1][1])
-
-    dynact_img_list[0][1][0] = mc1_seg_img_resampled
-    dynact_img_list[0][1][1] = trp_seg_img_resampled
-
-    dynact_full_mask_list = [None] * 60
-    dynact_full_mask_list[0] = [mc1_seg_img, trp_seg_img]
-
-    # Loop through all DYNACT frames and register the first volume to all other volumes
-    # Registration is performed on the MC1 and TRP individually (to get frame 1 to all other frames TMAT)
-    # Then, using ITK, find the transformation between each frame and the next frame using the centroid of each mask (to get between frame TMATs)
-    ref_frame = dynact_img_list[0][2]
-    ref_frame_mc1_mask = mc1_seg_img_resampled  # Only used for cropping
-    ref_frame_trp_mask = trp_seg_img_resampled  # Only used for cropping
-    ref_frame_mc1_masked = masked_mc1_img  # Masked reference MC1
-    ref_frame_trp_masked = masked_trp_img  # Masked reference TRP
-    ref_frame_mc1_full_mask = dynact_full_mask_list[0][0]  # What we actually transform
-    ref_frame_trp_full_mask = dynact_full_mask_list[0][1]  # What we actually transform
-
-    prev_frame_mc1_mask = mc1_seg_img_resampled
-    prev_frame_trp_mask = trp_seg_img_resampled
-
-    for i in range(0, len(dynact_img_list) - 2):
-        print("Registering volume {} to volume {}".format(i + 1, i + 2))
-
-        # Get the next frame
-        previous_frame = dynact_img_list[i][2]
-        current_frame = dynact_img_list[i + 1][2]
-
-        # Set the output file names
-        # Keep number to match the input volume numbering (i.e., 1...60, not 0...59)
-        mc1_inital_transf_path = os.path.join(
-            output_initial_transf_dir,
-            "VOLUME_REF_TO_" + str(i + 2) + "_MC1_INITAL_TRANSF.nii",
-        )
-        trp_inital_transf_path = os.path.join(
-            output_initial_transf_dir,
-            "VOLUME_REF_TO_" + str(i + 2) + "_TRP_INITAL_TRANSF.nii",
-        )
-        mc1_final_tfm_output_path = os.path.join(
-            output_tmat_dir, "VOLUME_REF_TO_" + str(i + 2) + "_MC1_REG.tfm"
-        )
-        trp_final_tfm_output_path = os.path.join(
-            output_tmat_dir, "VOLUME_REF_TO_" + str(i + 2) + "_TRP_REG.tfm"
-        )
-        mc1_final_image_output_path = os.path.join(
-            output_seg_dir, "VOLUME_REF_TO_" + str(i + 2) + "_MC1_REG.nii"
-        )
-        trp_final_image_output_path = os.path.join(
-            output_seg_dir, "VOLUME_REF_TO_" + str(i + 2) + "_TRP_REG.nii"
-        )
-        mc1_final_mask_output_path = os.path.join(
-            output_seg_dir, "VOLUME_REF_TO_" + str(i + 2) + "_MC1_MASK_REG.nii"
-        )
-        trp_final_mask_output_path = os.path.join(
-            output_seg_dir, "VOLUME_REF_TO_" + str(i + 2) + "_TRP_MASK_REG.nii"
-        )
-        mc1_final_full_mask_output_path = os.path.join(
-            output_seg_dir, "VOLUME_REF_TO_" + str(i + 2) + "_MC1_FULLMASK_REG.nii"
-        )
-        trp_final_full_mask_output_path = os.path.join(
-            output_seg_dir, "VOLUME_REF_TO_" + str(i + 2) + "_TRP_FULLMASK_REG.nii"
-        )
+    for next_dir in [output_tmat_dir, output_initial_transf_dir, output_seg_dir]:
+        try:
+            os.mkdir(next_dir)
+        except OSError as e:
+            if e.errno != errno.EEXIST:  # Directory already exists error
+                raise
 
-        # Initialize the registration by using the previous frame
-        inital_transform_prev_to_current = initialize_tfm(current_frame, previous_frame)
+    return output_tmat_dir, output_seg_dir
 
-        # Crop out the next_frame MC1 and TRP bones so the registration method has less area to iterate over
-        # Mask the current frame MC1 and TRP
-        mc1_seg_inital_transform_prev_to_curr = binary_resample_tfm(
-            current_frame, prev_frame_mc1_mask, inital_transform_prev_to_current
-        )
-        trp_seg_inital_transform_prev_to_curr = binary_resample_tfm(
-            current_frame, prev_frame_trp_mask, inital_transform_prev_to_current
-        )
 
-        mc1_current_frame_dilate_img = dilate_mask(
-            mc1_seg_inital_transform_prev_to_curr
-        )
-        trp_current_frame_dilate_img = dilate_mask(
-            trp_seg_inital_transform_prev_to_curr
-        )
+def frame_output_paths(output_dir, bone, frame_num, compress=False):
+    """
+    Gets the output file paths for a registered bone and frame.
 
-        mc1_current_frame_gray_masked = mask_bone(
-            current_frame, mc1_current_frame_dilate_img
-        )
-        trp_current_frame_gray_masked = mask_bone(
-            current_frame, trp_current_frame_dilate_img
-        )
+    Parameters
+    ----------
+    output_dir : string
 
-        inital_transform_ref_to_current_mc1 = initialize_tfm(
-            mc1_current_frame_gray_masked, ref_frame_mc1_masked
-        )
-        inital_transform_ref_to_current_trp = initialize_tfm(
-            trp_current_frame_gray_masked, ref_frame_trp_masked
-        )
+    bone : string
 
-        # Start the registration
-        # MC1
-        final_tfm_mc1 = registration(
-            inital_transform_ref_to_current_mc1,
-            mc1_current_frame_gray_masked,
-            ref_frame_mc1_masked,
-        )
-        final_tfm_trp = registration(
-            inital_transform_ref_to_current_trp,
-            trp_current_frame_gray_masked,
-            ref_frame_trp_masked,
-        )
+    frame_num : int
 
-        print("Writing to {}".format(mc1_final_tfm_output_path))
-        sitk.WriteTransform(final_tfm_mc1, mc1_final_tfm_output_path)
+    compress : bool
+        Use compressed NIfTI (.nii.gz) for the image outputs
 
-        print("Writing to {}".format(trp_final_tfm_output_path))
-        sitk.WriteTransform(final_tfm_trp, trp_final_tfm_output_path)
+    Returns
+    -------
+    tfm_path : string
+
+    image_path : string
+
+    full_mask_path : string
+    """
+    # Keep number to match the input volume numbering (i.e., 1...60, not 0...59)
+    prefix = "VOLUME_REF_TO_" + str(frame_num) + "_" + bone
+    ext = ".nii.gz" if compress else ".nii"
+    tfm_path = os.path.join(output_dir, "FinalTFMs", prefix + "_REG.tfm")
+    image_path = os.path.join(output_dir, "RegisteredMasks", prefix + "_REG" + ext)
+    full_mask_path = os.path.join(
+        output_dir, "RegisteredMasks", prefix + "_FULLMASK_REG" + ext
+    )
+
+    return tfm_path, image_path, full_mask_path
+
+
+def file_hash(file_path):
+    """
+    Computes the SHA-1 hash of a file.
+
+    Parameters
+    ----------
+    file_path : string
+
+    Returns
+    -------
+    string
+    """
+    sha = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            sha.update(chunk)
+
+    return sha.hexdigest()
+
+
+def open_manifest(output_dir):
+    """
+    Opens (or creates) the run manifest in the output directory. The manifest is
+    an SQLite database with one row per registered bone and frame, so several
+    workers can safely record their progress at the same time.
+
+    Parameters
+    ----------
+    output_dir : string
+
+    Returns
+    -------
+    conn : sqlite3.Connection
+    """
+    # Frames are recorded from the background writer thread
+    conn = sqlite3.connect(
+        os.path.join(output_dir, "RUN_MANIFEST.sqlite"),
+        timeout=60,
+        check_same_thread=False,
+    )
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS frames ("
+        "bone TEXT, frame_num INTEGER, input_hash TEXT, tfm_path TEXT, "
+        "full_mask_path TEXT, completed TEXT, PRIMARY KEY (bone, frame_num))"
+    )
+    # Runtime and accuracy of each registration profile
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS profile_stats ("
+        "bone TEXT, frame_num INTEGER, profile TEXT, runtime REAL, "
+        "iterations INTEGER, metric REAL, PRIMARY KEY (bone, frame_num, profile))"
+    )
+    conn.commit()
+
+    return conn
+
+
+def record_frame(conn, bone, frame_num, input_hash, tfm_path, full_mask_path):
+    """
+    Records a completed bone and frame in the run manifest. Only call this once
+    all outputs for the frame have been written.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+
+    bone : string
 
-        # Resample images
-        print("Resampling MC1")
-        mc1_current_gray_resampled = binary_resample_tfm(
-            current_frame, ref_frame_mc1_masked, final_tfm_mc1
+    frame_num : int
+
+    input_hash : string
+
+    tfm_path : string
+
+    full_mask_path : string
+
+    Returns
+    -------
+
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO frames VALUES (?, ?, ?, ?, ?, datetime('now'))",
+        (bone, frame_num, input_hash, tfm_path, full_mask_path),
+    )
+    conn.commit()
+
+
+def record_stats(conn, bone, frame_num, profile_name, runtime, iterations, metric):
+    """
+    Records the runtime and accuracy of a frame registration in the run manifest.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+
+    bone : string
+
+    frame_num : int
+
+    profile_name : string
+
+    runtime : float
+        Registration time (seconds)
+
+    iterations : int
+        Total number of optimizer iterations
+
+    metric : float
+        Full resolution mean squares metric of the final transform
+
+    Returns
+    -------
+
+    """
+    conn.execute(
+        "INSERT OR REPLACE INTO profile_stats VALUES (?, ?, ?, ?, ?, ?)",
+        (bone, frame_num, profile_name, runtime, iterations, metric),
+    )
+    conn.commit()
+
+
+def completed_frames(conn, bone, frame_nums, input_hash_dict):
+    """
+    Finds the leading frames of a run that were already registered with the same
+    inputs and whose outputs still exist.
+
+    Parameters
+    ----------
+    conn : sqlite3.Connection
+
+    bone : string
+
+    frame_nums : list
+        Consecutive volume numbers of the run
+
+    input_hash_dict : dict
+        Maps each volume number to the hash of its current inputs
+
+    Returns
+    -------
+    done_frames : list
+
+    path_dict : dict
+        Maps each done frame to the transform and full mask paths recorded in
+        the manifest. These are the files that were checked, so they are read
+        on resume even if output options (e.g., compression) have changed.
+    """
+    rows = conn.execute(
+        "SELECT frame_num, input_hash, tfm_path, full_mask_path FROM frames "
+        "WHERE bone = ?",
+        (bone,),
+    ).fetchall()
+    row_dict = {row[0]: row[1:] for row in rows}
+
+    done_frames = []
+    path_dict = {}
+    for frame_num in frame_nums:
+        row = row_dict.get(frame_num)
+        if (
+            row is None
+            or row[0] != input_hash_dict[frame_num]
+            or not os.path.isfile(row[1])
+            or not os.path.isfile(row[2])
+        ):
+            break
+        done_frames.append(frame_num)
+        path_dict[frame_num] = row[1:]
+
+    return done_frames, path_dict
+
+
+def prepare_reference(ref_frame, seg_img):
+    """
+    Resamples a bone mask to the reference (first) DYNACT frame and masks the
+    bone out of the reference frame.
+
+    Parameters
+    ----------
+    ref_frame : SimpleITK.Image
+
+    seg_img : SimpleITK.Image
+
+    Returns
+    -------
+    seg_img_resampled : SimpleITK.Image
+        Bone mask on the reference frame grid (only used for cropping)
+
+    masked_img : SimpleITK.Image
+        Masked reference bone
+
+    dilated_img : SimpleITK.Image
+        Dilated mask used to mask the reference bone
+    """
+    # Resample the MC1/TRP mask to match the DYNACT grayscale image
+    seg_img_resampled = binary_resample(ref_frame, seg_img)
+
+    # Dilate the segmentation mask and mask out the bone from the first frame
+    dilated_img = dilate_mask(seg_img_resampled)
+    masked_img = mask_bone(ref_frame, dilated_img)
+
+    return seg_img_resampled, masked_img, dilated_img
+
+
+def register_frame(
+    current_frame,
+    previous_frame,
+    prev_frame_mask,
+    ref_frame_masked,
+    ref_full_mask,
+    context,
+    profile,
+    roi_margin=None,
+    init_tfm=None,
+):
+    """
+    Registers a masked bone from the reference frame to the current frame. The
+    previous frame's mask is only used to crop the bone out of the current frame.
+
+    In ROI mode (roi_margin is provided), the fixed and moving images are cropped
+    to the bounding box of their dilated masks plus a margin before registration.
+
+    Parameters
+    ----------
+    current_frame : SimpleITK.Image
+
+    previous_frame : SimpleITK.Image
+
+    prev_frame_mask : SimpleITK.Image
+
+    ref_frame_masked : SimpleITK.Image
+
+    ref_full_mask : SimpleITK.Image
+
+    context : modImgProc.ReferenceContext
+        Moving image (the masked reference bone, cropped to its bounding box in
+        ROI mode) and its pyramid levels
+
+    profile : dict
+        Registration profile
+
+    roi_margin : list
+        Number of voxels to pad the bounding box by. None disables ROI mode.
+
+    init_tfm : SimpleITK.TFM
+        Initial reference to current frame transform (warm start). If None, the
+        transform is initialized by matching the image geometric centres.
+
+    Returns
+    -------
+    final_tfm : SimpleITK.TFM
+
+    gray_resampled : SimpleITK.Image
+
+    full_mask_resampled : SimpleITK.Image
+
+    num_iterations : int
+
+    metric_value : float
+        Full resolution metric of the final transform
+    """
+    # Initialize the registration by using the previous frame
+    inital_transform_prev_to_current = initialize_tfm(current_frame, previous_frame)
+
+    # Crop out the bone in the current frame so the registration method has less area to iterate over
+    seg_inital_transform_prev_to_curr = binary_resample_tfm(
+        current_frame, prev_frame_mask, inital_transform_prev_to_current
+    )
+    current_frame_dilate_img = dilate_mask(seg_inital_transform_prev_to_curr)
+    current_frame_gray_masked = mask_bone(current_frame, current_frame_dilate_img)
+
+    if init_tfm is None:
+        inital_transform_ref_to_current = initialize_tfm(
+            current_frame_gray_masked, ref_frame_masked
         )
-        mc1_current_seg_full_resampled = sitk.Resample(
-            ref_frame_mc1_full_mask,
-            current_frame.GetSize(),
-            final_tfm_mc1,
-            sitk.sitkNearestNeighbor,
-            ref_frame_mc1_full_mask.GetOrigin(),
-            ref_frame_mc1_full_mask.GetSpacing(),
-            ref_frame_mc1_full_mask.GetDirection(),
-            0,
-            ref_frame_mc1_full_mask.GetPixelID(),
+    else:
+        inital_transform_ref_to_current = init_tfm
+
+    # Only register the bounding box of the dilated masks in ROI mode. Cropping
+    # keeps the physical coordinates, so the transform is valid for the full images.
+    fixed = current_frame_gray_masked
+    sampling_scale = 1.0
+    if roi_margin is not None:
+        fixed = crop_to_mask(
+            current_frame_gray_masked, current_frame_dilate_img, roi_margin
         )
 
-        print("Writing to {}".format(mc1_final_image_output_path))
-        sitk.WriteImage(mc1_current_gray_resampled, mc1_final_image_output_path)
-        sitk.WriteImage(mc1_current_seg_full_resampled, mc1_final_full_mask_output_path)
+        # Keep the same number of metric samples as the full field-of-view
+        sampling_scale = current_frame.GetNumberOfPixels() / fixed.GetNumberOfPixels()
 
-        print("Resampling TRP")
-        trp_current_gray_resampled = binary_resample_tfm(
-            current_frame, ref_frame_trp_masked, final_tfm_trp
-        )
-        trp_current_seg_full_resampled = sitk.Resample(
-            ref_frame_trp_full_mask,
-            current_frame.GetSize(),
-            final_tfm_trp,
-            sitk.sitkNearestNeighbor,
-            ref_frame_trp_full_mask.GetOrigin(),
-            ref_frame_trp_full_mask.GetSpacing(),
-            ref_frame_trp_full_mask.GetDirection(),
-            0,
-            ref_frame_trp_full_mask.GetPixelID(),
+    # Start the registration
+    final_tfm, num_iterations = registration(
+        inital_transform_ref_to_current, fixed, context, profile, sampling_scale
+    )
+    metric_value = evaluate_metric(final_tfm, fixed, context.image)
+
+    # Resample images
+    gray_resampled = binary_resample_tfm(current_frame, ref_frame_masked, final_tfm)
+    full_mask_resampled = sitk.Resample(
+        ref_full_mask,
+        current_frame.GetSize(),
+        final_tfm,
+        sitk.sitkNearestNeighbor,
+        ref_full_mask.GetOrigin(),
+        ref_full_mask.GetSpacing(),
+        ref_full_mask.GetDirection(),
+        0,
+        ref_full_mask.GetPixelID(),
+    )
+
+    return final_tfm, gray_resampled, full_mask_resampled, num_iterations, metric_value
+
+
+def predict_tfm(prev_tfm_list, warm_start, center):
+    """
+    Predicts the initial reference to current frame transform from the solved
+    transforms of the previous frames.
+
+    Transforms map points from a frame to the reference frame (T_n). With a
+    constant-velocity prediction, the motion between the last two frames is
+    applied again: T_n = T_n-1 * inv(T_n-2) * T_n-1.
+
+    Parameters
+    ----------
+    prev_tfm_list : list
+        4x4 matrices of the solved transforms of the previous frames (oldest
+        first)
+
+    warm_start : string
+        Either "previous" or "velocity"
+
+    center : list
+        Centre of rotation of the predicted transform
+
+    Returns
+    -------
+    init_tfm : SimpleITK.Euler3DTransform
+        None if there are no previous transforms to start from
+    """
+    if not prev_tfm_list:
+        return None
+
+    matrix = prev_tfm_list[-1]
+    if warm_start == "velocity" and len(prev_tfm_list) > 1:
+        matrix = matrix.dot(np.linalg.inv(prev_tfm_list[-2])).dot(matrix)
+
+    return matrix_to_euler(matrix, center)
+
+
+def register_bone_frames(
+    dynact_dir,
+    seg_path,
+    bone,
+    frame_nums,
+    output_dir,
+    profile,
+    roi_margin=None,
+    warm_start="none",
+    resume=False,
+    outputs=output_types,
+    compress=False,
+    write_queue=8,
+):
+    """
+    Sequentially registers one bone from the reference frame to a contiguous run
+    of DYNACT frames. Each frame is cropped with the mask registered to the
+    previous frame of the run. The first frame of the run is cropped with the
+    reference frame mask. This is the unit of work handed to each worker.
+
+    Parameters
+    ----------
+    dynact_dir : string
+
+    seg_path : string
+        Path to the bone segmentation (on the reference frame)
+
+    bone : string
+        Either MC1 or TRP
+
+    frame_nums : list
+        Consecutive volume numbers to register (2...59)
+
+    output_dir : string
+
+    profile : dict
+        Registration profile (see modImgProc/registration_profiles.yml)
+
+    roi_margin : list
+        Bounding box margin (voxels) for ROI mode. None disables ROI mode.
+
+    warm_start : string
+        How to initialize each registration: "none" (match image centres),
+        "previous" (previous frame's solution), or "velocity" (previous frame's
+        solution plus a constant-velocity prediction)
+
+    resume : bool
+        Skip the leading frames of the run that the run manifest lists as
+        completed with the same inputs
+
+    outputs : list
+        Side products to write for each frame (see output_types). Resuming needs
+        both the TFMs and the full masks.
+
+    compress : bool
+        Write compressed NIfTI (.nii.gz) images
+
+    write_queue : int
+        Number of pending writes allowed on the background writer thread. 0 writes
+        on the registration thread.
+
+    Returns
+    -------
+    frame_nums : list
+        Volume numbers that were registered
+    """
+    # Frames are paged in from the memory-mapped stack cache
+    stack = DynactStack(dynact_dir).load()
+    ref_frame = stack.get_frame(stack.frame_nums[0])
+
+    print("Reading in {}".format(seg_path))
+    ref_full_mask = sitk.ReadImage(seg_path)  # What we actually transform
+    ref_frame_mask, ref_frame_masked, ref_frame_dilated = prepare_reference(
+        ref_frame, ref_full_mask
+    )
+
+    # The reference bone is the same for every frame, so only crop it and build
+    # its pyramid once
+    moving = ref_frame_masked
+    if roi_margin is not None:
+        moving = crop_to_mask(ref_frame_masked, ref_frame_dilated, roi_margin)
+
+    context = ReferenceContext(
+        moving,
+        profile["shrink_factors"],
+        profile["smoothing_sigmas"],
+        ref_frame_mask,
+        ref_frame_dilated,
+    )
+
+    # The first frame of every run is seeded from the reference frame
+    previous_frame = ref_frame
+    prev_frame_mask = context.mask
+
+    # Solved transforms of the last two frames (for warm starts). Warm starts
+    # rotate about the reference frame's geometric centre, like the cold start.
+    prev_tfm_list = []
+    tfm_center = ref_frame.TransformContinuousIndexToPhysicalPoint(
+        [(sz - 1) / 2.0 for sz in ref_frame.GetSize()]
+    )
+    # Iterations of the run's first (cold-started) frame, and the difference
+    # to it summed over the warm-started frames. This is not a measured saving:
+    # the warm-started frames are never registered cold, so frame-to-frame
+    # variation in difficulty is included.
+    first_frame_iterations = None
+    iteration_difference = 0
+    total_runtime = 0.0
+
+    # Hash the inputs of every frame: the bone mask, the reference and current
+    # frame files, and the registration settings (including the profile)
+    seg_hash = file_hash(seg_path)
+    sources = stack.source_info()
+    input_hash_dict = {}
+    for frame_num in frame_nums:
+        input_info = [
+            seg_hash,
+            sources[str(stack.frame_nums[0])],
+            sources[str(frame_num)],
+            roi_margin,
+            warm_start,
+            profile,
+        ]
+        input_hash_dict[frame_num] = hashlib.sha1(
+            json.dumps(input_info).encode()
+        ).hexdigest()
+
+    conn = open_manifest(output_dir)
+    try:
+        done_frames = []
+        if resume:
+            done_frames, path_dict = completed_frames(
+                conn, bone, frame_nums, input_hash_dict
+            )
+
+        # Continue from the last completed frame
+        if done_frames:
+            print(
+                "Resuming {} after volume {} ({} of {} volumes done)".format(
+                    bone, done_frames[-1], len(done_frames), len(frame_nums)
+                )
+            )
+            previous_frame = stack.get_frame(done_frames[-1])
+            prev_frame_mask = sitk.ReadImage(path_dict[done_frames[-1]][1])
+            prev_tfm_list = [
+                transform_to_matrix(sitk.ReadTransform(path_dict[num][0]))
+                for num in done_frames[-2:]
+            ]
+
+        # Writes overlap with the registration of the next frame. The writer is
+        # closed (finishing the queued writes and manifest records) even if a
+        # frame fails, so --resume can continue after the last written frame.
+        with AsyncWriter(write_queue) as writer:
+            for frame_num in frame_nums[len(done_frames) :]:
+                print("Registering {} volume 1 to volume {}".format(bone, frame_num))
+
+                (
+                    final_tfm_output_path,
+                    final_image_output_path,
+                    final_full_mask_output_path,
+                ) = frame_output_paths(output_dir, bone, frame_num, compress)
+
+                current_frame = stack.get_frame(frame_num)
+
+                init_tfm = None
+                if warm_start != "none":
+                    init_tfm = predict_tfm(prev_tfm_list, warm_start, tfm_center)
+
+                start_time = time.perf_counter()
+                (
+                    final_tfm,
+                    gray_resampled,
+                    full_mask_resampled,
+                    num_iterations,
+                    metric_value,
+                ) = register_frame(
+                    current_frame,
+                    previous_frame,
+                    prev_frame_mask,
+                    ref_frame_masked,
+                    ref_full_mask,
+                    context,
+                    profile,
+                    roi_margin,
+                    init_tfm,
+                )
+                runtime = time.perf_counter() - start_time
+                total_runtime += runtime
+                print(
+                    "Profile {}: {:.2f} s, {} iterations, full resolution metric {}".format(
+                        profile["name"], runtime, num_iterations, metric_value
+                    )
+                )
+
+                # Compare warm-started registrations to the cold-started first
+                # frame of this run (not to a cold start of the same frame)
+                if init_tfm is None:
+                    first_frame_iterations = num_iterations
+                elif first_frame_iterations is not None:
+                    iteration_difference += first_frame_iterations - num_iterations
+                    print(
+                        "Warm start ({}) used {} iterations (cold-started first "
+                        "frame: {})".format(
+                            warm_start, num_iterations, first_frame_iterations
+                        )
+                    )
+
+                prev_tfm_list = (prev_tfm_list + [transform_to_matrix(final_tfm)])[-2:]
+
+                if "tfm" in outputs:
+                    writer.write_transform(final_tfm, final_tfm_output_path)
+                if "resampled-gray" in outputs:
+                    writer.write_image(
+                        gray_resampled, final_image_output_path, compress
+                    )
+                if "fullmask" in outputs:
+                    writer.write_image(
+                        full_mask_resampled, final_full_mask_output_path, compress
+                    )
+
+                # Queued after the writes, so frames are only recorded once written
+                writer.submit(
+                    record_frame,
+                    conn,
+                    bone,
+                    frame_num,
+                    input_hash_dict[frame_num],
+                    final_tfm_output_path,
+                    final_full_mask_output_path,
+                )
+                writer.submit(
+                    record_stats,
+                    conn,
+                    bone,
+                    frame_num,
+                    profile["name"],
+                    runtime,
+                    num_iterations,
+                    metric_value,
+                )
+
+                # The next frame is cropped with the in-memory mask, not the
+                # written one
+                previous_frame = current_frame
+                prev_frame_mask = full_mask_resampled
+
+        if warm_start != "none" and first_frame_iterations is not None:
+            print(
+                "{} volumes {} to {}: {} fewer optimizer iterations than the "
+                "cold-started first frame, summed over the warm-started "
+                "frames".format(
+                    bone, frame_nums[0], frame_nums[-1], iteration_difference
+                )
+            )
+
+        print(
+            "{} volumes {} to {}: registered with profile {} in {:.2f} s".format(
+                bone, frame_nums[0], frame_nums[-1], profile["name"], total_runtime
+            )
         )
+    finally:
+        conn.close()
+
+    return frame_nums
+
+
+def schedule_tasks(frame_nums, window=0):
+    """
+    Splits the frames to register into independent tasks. The MC1 and TRP are
+    always registered independently. If a window size is given, each bone's
+    frames are further split into runs of that many consecutive frames.
+
+    Parameters
+    ----------
+    frame_nums : list
+        Volume numbers to register (2...59)
+
+    window : int
+        Number of consecutive frames per task. 0 keeps each bone's frames in a
+        single sequential run (i.e., full mask propagation).
+
+    Returns
+    -------
+    tasks : list
+        List of [bone, frame_nums] pairs
+    """
+    if window is None or window <= 0:
+        window = len(frame_nums)
 
-        print("Writing to {}".format(trp_final_image_output_path))
-        sitk.WriteImage(trp_current_gray_resampled, trp_final_image_output_path)
-        sitk.WriteImage(trp_current_seg_full_resampled, trp_final_full_mask_output_path)
+    tasks = []
+    for i in range(0, len(frame_nums), window):
+        for bone in ["MC1", "TRP"]:
+            tasks.append([bone, frame_nums[i : i + window]])
 
-        prev_frame_mc1_mask = mc1_current_seg_full_resampled
-        prev_frame_trp_mask = trp_current_seg_full_resampled
+    return tasks
+
+
+def init_worker(num_threads):
+    """
+    Limits the number of threads used by SimpleITK filters in each worker so the
+    workers do not oversubscribe the CPU.
+
+    Parameters
+    ----------
+    num_threads : int
+
+    Returns
+    -------
+
+    """
+    sitk.ProcessObject.SetGlobalDefaultNumberOfThreads(num_threads)
+
+
+def main(
+    dynact_dir,
+    mc1_seg,
+    trp_seg,
+    output_dir,
+    profile,
+    workers=1,
+    window=0,
+    roi_margin=None,
+    warm_start="none",
+    resume=False,
+    outputs=output_types,
+    compress=False,
+    write_queue=8,
+):
+    """
+    Main function to perform the sequential image registration.
+
+    Registration is performed on the MC1 and TRP individually to get the frame 1
+    to all other frames TMATs. Every frame is registered to the fixed reference
+    (first) frame, the previous frame's mask is only used for cropping. Each bone
+    (and optionally each window of frames) is therefore scheduled as a separate
+    task on a process pool.
+
+    Parameters
+    ----------
+    dynact_dir : string
+
+    mc1_seg : string
+
+    trp_seg : string
+
+    output_dir : string
+
+    profile : dict
+        Registration profile (see modImgProc/registration_profiles.yml)
+
+    workers : int
+        Number of worker processes
+
+    window : int
+        Number of consecutive frames registered per task (0 = all frames)
+
+    roi_margin : list
+        Bounding box margin (voxels) for ROI mode. None disables ROI mode.
+
+    warm_start : string
+        Registration initialization: "none", "previous", or "velocity"
+
+    resume : bool
+        Continue from the first frame missing from the run manifest
+
+    outputs : list
+        Side products to write for each frame (see output_types)
+
+    compress : bool
+        Write compressed NIfTI (.nii.gz) images
+
+    write_queue : int
+        Number of pending writes per worker (0 = synchronous writes)
+
+    Returns
+    -------
+
+    """
+    # Create the output directories and the run manifest
+    create_output_dirs(output_dir)
+    open_manifest(output_dir).close()
+
+    # Read all frames once (or reuse the cache) before starting any workers
+    stack = DynactStack(dynact_dir).load()
+
+    # Register the first volume to all other volumes
+    frame_nums = stack.frame_nums[1:]
+    seg_dict = {"MC1": mc1_seg, "TRP": trp_seg}
+
+    tasks = schedule_tasks(frame_nums, window)
+    print(
+        "Scheduling {} tasks for {} frames on {} worker(s)".format(
+            len(tasks), len(frame_nums), workers
+        )
+    )
+
+    task_args = [
+        [
+            dynact_dir,
+            seg_dict[bone],
+            bone,
+            task_frames,
+            output_dir,
+            profile,
+            roi_margin,
+            warm_start,
+            resume,
+            outputs,
+            compress,
+            write_queue,
+        ]
+        for bone, task_frames in tasks
+    ]
+
+    if workers <= 1:
+        for args in task_args:
+            register_bone_frames(*args)
+        return
+
+    # Share the available cores between the workers
+    num_threads = max(1, (os.cpu_count() or 1) // workers)
+
+    with ProcessPoolExecutor(
+        max_workers=workers, initializer=init_worker, initargs=(num_threads,)
+    ) as executor:
+        futures = {
+            executor.submit(register_bone_frames, *args): args[2] for args in task_args
+        }
+
+        for future in as_completed(futures):
+            done_frames = future.result()
+            print(
+                "Finished {} volumes {} to {}".format(
+                    futures[future], done_frames[0], done_frames[-1]
+                )
+            )
 
 
 if __name__ == "__main__":
@@ -477,11 +1111,128 @@ if __name__ == "__main__":
     parser.add_argument("mc1_seg", type=str)
     parser.add_argument("trp_seg", type=str)
     parser.add_argument("output_dir", type=str)
+    parser.add_argument(
+        "-p",
+        "--profile",
+        type=str,
+        default="default",
+        help="Registration profile (pyramid, metric sampling, and optimizer "
+        "settings), e.g., fast, default, accurate, or legacy. Default = default",
+    )
+    parser.add_argument(
+        "--profile-config",
+        dest="profile_config",
+        type=str,
+        default=None,
+        help="YAML file with the registration profiles. "
+        "Default = modImgProc/registration_profiles.yml",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of worker processes. Default = 1",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=0,
+        help="Number of consecutive frames registered per task. Each window is "
+        "seeded from the reference frame mask instead of the previous frame's "
+        "mask. Default = 0 (all frames in one sequential run per bone)",
+    )
+    parser.add_argument(
+        "--roi",
+        action="store_true",
+        help="Crop the fixed and moving images to the bounding box of the dilated "
+        "bone masks before registration",
+    )
+    parser.add_argument(
+        "--roi-margin",
+        dest="roi_margin",
+        nargs=3,
+        type=int,
+        default=[5, 5, 2],
+        help="Number of voxels (X, Y, Z) to pad the ROI bounding box by. "
+        "Default = 5 5 2",
+    )
+    parser.add_argument(
+        "--warm-start",
+        dest="warm_start",
+        choices=["none", "previous", "velocity"],
+        default="none",
+        help="Initialize each registration with the previous frame's solution "
+        "(previous), optionally with a constant-velocity prediction (velocity). "
+        "Default = none (match image centres)",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Skip frames already registered with the same inputs (from the run "
+        "manifest in the output directory) and continue from the first missing "
+        "frame",
+    )
+    parser.add_argument(
+        "--outputs",
+        type=str,
+        default=",".join(output_types),
+        help="Comma separated side products to write for each frame: "
+        + ", ".join(output_types)
+        + ". Only the TFMs and full masks are used by compute_motion.py. "
+        "Default = all",
+    )
+    parser.add_argument(
+        "--compress",
+        action="store_true",
+        help="Write compressed NIfTI (.nii.gz) images",
+    )
+    parser.add_argument(
+        "--write-queue",
+        dest="write_queue",
+        type=int,
+        default=8,
+        help="Number of pending writes per worker on the background writer "
+        "thread. 0 writes synchronously. Default = 8",
+    )
     args = parser.parse_args()
 
+    outputs = [name.strip() for name in args.outputs.split(",") if name.strip()]
+    for name in outputs:
+        if name not in output_types:
+            parser.error(
+                "Unknown output {}. Choose from {}".format(
+                    name, ", ".join(output_types)
+                )
+            )
+    if args.resume and not {"tfm", "fullmask"}.issubset(outputs):
+        parser.error("--resume needs the tfm and fullmask outputs")
+
     dynact_dir = args.dynact_dir
     mc1_seg = args.mc1_seg
     trp_seg = args.trp_seg
     output_dir = args.output_dir
-
-    main(dynact_dir, mc1_seg, trp_seg, output_dir)
+    profile = load_profile(args.profile, args.profile_config)
+    workers = args.workers
+    window = args.window
+    roi_margin = args.roi_margin if args.roi else None
+    warm_start = args.warm_start
+    resume = args.resume
+    compress = args.compress
+    write_queue = args.write_queue
+
+    main(
+        dynact_dir,
+        mc1_seg,
+        trp_seg,
+        output_dir,
+        profile,
+        workers,
+        window,
+        roi_margin,
+        warm_start,
+        resume,
+        outputs,
+        compress,
+        write_queue,
+    )
@@ -5,18 +5,17 @@ Created by: Michael Kuczynski
 Created on: Sept. 01, 2021
 """
 
-import itk
-import math
 import argparse
 import numpy as np
 import SimpleITK as sitk
 
-from modMisc.sitk_itk import sitk2itk
+from modImgProc.moments import principal_axes
 
 
 def get_landmarks(xct_landmark_img, ct_landmarks_img, fiducial_list):
     """
-    Converts a landmark image (binary) to a listy of points.
+    Converts the landmark images (labelled) and fiducial images (binary) to
+    arrays of points.
 
     Parameters
     ----------
@@ -25,133 +24,117 @@ def get_landmarks(xct_landmark_img, ct_landmarks_img, fiducial_list):
     ct_landmarks_img : SimpleITK.Image
 
     fiducial_list : list
-        List containing the fiducial images
+        List containing the fiducial images. The first half are the XCT
+        fiducials and the second half are the matching CT fiducials.
 
     Returns
     -------
-    xct_fiducials_flat : list
-        List containing the XCT fiducial points
+    xct_fiducials : numpy.array
+        (M, 3) array of the XCT fiducial centroids
 
-    ct_fiducials_flat : list
-        List containing the CT fiducial points
+    ct_fiducials : numpy.array
+        (M, 3) array of the CT fiducial centroids
 
-    xct_targets : list
-        List containing the XCT target points
+    xct_targets : numpy.array
+        (N, 3) array of the XCT target points
 
-    ct_targets : list
-        List containing the CT target points
+    ct_targets : numpy.array
+        (N, 3) array of the CT target points
     """
-    xct_F1_img = fiducial_list[0]
-    xct_F2_img = fiducial_list[1]
-    xct_F3_img = fiducial_list[2]
-    ct_F1_img = fiducial_list[0]
-    ct_F2_img = fiducial_list[1]
-    ct_F3_img = fiducial_list[2]
-
-    # Flatten landmarks
-    landmark_stats = sitk.LabelShapeStatisticsImageFilter()
-    landmark_stats.ComputeOrientedBoundingBoxOn()
-
-    # XCT landmarks
-    landmark_stats.Execute(xct_landmark_img)
+    if len(fiducial_list) % 2:
+        raise ValueError(
+            "Expected the same number of XCT and CT fiducials, got {} images".format(
+                len(fiducial_list)
+            )
+        )
+    num_fiducials = len(fiducial_list) // 2
 
-    xct_landmarks = []
-    for label in landmark_stats.GetLabels():
-        xct_landmarks.append(landmark_stats.GetOrientedBoundingBoxOrigin(label))
+    # XCT and CT landmarks
+    xct_targets = get_targets(xct_landmark_img)
+    ct_targets = get_targets(ct_landmarks_img)
 
-    xct_landmarks_flat = [c for p in xct_landmarks for c in p]
-    xct_target1 = np.array(
-        [xct_landmarks_flat[0], xct_landmarks_flat[1], xct_landmarks_flat[2]]
-    )
-    xct_target2 = np.array(
-        [xct_landmarks_flat[3], xct_landmarks_flat[4], xct_landmarks_flat[5]]
+    # ------------------------------------------------------------------------------------#
+    # Get the centroids of the beads in CT and XCT space
+    # Use these to find the "gold standard" transformation, Tgs
+    # ------------------------------------------------------------------------------------#
+    # XCT fiducial centroids (gold standard)
+    xct_fiducials = np.array(
+        [get_centroid(img) for img in fiducial_list[:num_fiducials]]
     )
-    xct_target3 = np.array(
-        [xct_landmarks_flat[6], xct_landmarks_flat[7], xct_landmarks_flat[8]]
+
+    # CT fiducial centroids (after registration)
+    ct_fiducials = np.array(
+        [get_centroid(img) for img in fiducial_list[num_fiducials:]]
     )
-    xct_targets = [xct_target1, xct_target2, xct_target3]
 
-    # CT Landmarks
-    landmark_stats.Execute(ct_landmarks_img)
+    return xct_fiducials, ct_fiducials, xct_targets, ct_targets
 
-    ct_landmarks = []
-    for label in landmark_stats.GetLabels():
-        ct_landmarks.append(landmark_stats.GetOrientedBoundingBoxOrigin(label))
 
-    ct_landmarks_flat = [c for p in ct_landmarks for c in p]
-    ct_target1 = np.array(
-        [ct_landmarks_flat[0], ct_landmarks_flat[1], ct_landmarks_flat[2]]
-    )
-    ct_target2 = np.array(
-        [ct_landmarks_flat[3], ct_landmarks_flat[4], ct_landmarks_flat[5]]
-    )
-    ct_target3 = np.array(
-        [ct_landmarks_flat[6], ct_landmarks_flat[7], ct_landmarks_flat[8]]
-    )
-    ct_targets = [ct_target1, ct_target2, ct_target3]
+def get_targets(landmark_img):
+    """
+    Converts a landmark image (labelled) to an array of points, one for each
+    label.
 
-    # ------------------------------------------------------------------------------------#
-    # Get the centroids of the beads in CT and XCT space
-    # Use these to find the "gold standard" transformation, Tgs
-    # ------------------------------------------------------------------------------------#
-    # Create a component map for each binary image, then compute image statistics
-    component_map = sitk.ConnectedComponentImageFilter()
-    shape_stats = sitk.LabelShapeStatisticsImageFilter()
+    Parameters
+    ----------
+    landmark_img : SimpleITK.Image
 
-    # XCT fiducial centroids (gold standard)
-    label = component_map.Execute(xct_F1_img)
-    shape_stats.Execute(label)
-    xct_F1_centroid = shape_stats.GetCentroid(1)
+    Returns
+    -------
+    numpy.array
+        (N, 3) array of target points
+    """
+    # Flatten landmarks
+    landmark_stats = sitk.LabelShapeStatisticsImageFilter()
+    landmark_stats.ComputeOrientedBoundingBoxOn()
+    landmark_stats.Execute(landmark_img)
 
-    label = component_map.Execute(xct_F2_img)
-    shape_stats.Execute(label)
-    xct_F2_centroid = shape_stats.GetCentroid(1)
+    targets = np.array(
+        [
+            landmark_stats.GetOrientedBoundingBoxOrigin(label)
+            for label in landmark_stats.GetLabels()
+        ]
+    )
+    return targets
 
-    label = component_map.Execute(xct_F3_img)
-    shape_stats.Execute(label)
-    xct_F3_centroid = shape_stats.GetCentroid(1)
 
-    xct_fiducials = [
-        [xct_F1_centroid[0], xct_F1_centroid[1], xct_F1_centroid[2]],
-        [xct_F2_centroid[0], xct_F2_centroid[1], xct_F2_centroid[2]],
-        [xct_F3_centroid[0], xct_F3_centroid[1], xct_F3_centroid[2]],
-    ]
-    xct_fiducials_flat = [c for p in xct_fiducials for c in p]
+def get_centroid(fiducial_img):
+    """
+    Computes the centroid of a fiducial (binary) image.
 
-    # CT fiducial centroids (after registration)
-    label = component_map.Execute(ct_F1_img)
-    shape_stats.Execute(label)
-    ct_F1_centroid = shape_stats.GetCentroid(1)
+    Parameters
+    ----------
+    fiducial_img : SimpleITK.Image
 
-    label = component_map.Execute(ct_F2_img)
-    shape_stats.Execute(label)
-    ct_F2_centroid = shape_stats.GetCentroid(1)
+    Returns
+    -------
+    tuple
+        Centroid in physical coordinates
+    """
+    # Create a component map for the binary image, then compute image statistics
+    component_map = sitk.ConnectedComponentImageFilter()
+    shape_stats = sitk.LabelShapeStatisticsImageFilter()
 
-    label = component_map.Execute(ct_F3_img)
+    label = component_map.Execute(fiducial_img)
     shape_stats.Execute(label)
-    ct_F3_centroid = shape_stats.GetCentroid(1)
-
-    ct_fiducials = [
-        [ct_F1_centroid[0], ct_F1_centroid[1], ct_F1_centroid[2]],
-        [ct_F2_centroid[0], ct_F2_centroid[1], ct_F2_centroid[2]],
-        [ct_F3_centroid[0], ct_F3_centroid[1], ct_F3_centroid[2]],
-    ]
-    ct_fiducials_flat = [c for p in ct_fiducials for c in p]
 
-    return xct_fiducials_flat, ct_fiducials_flat, xct_targets, ct_targets
+    return shape_stats.GetCentroid(1)
 
 
-def compute_TGS(xct_fiducials_flat, ct_fiducials_flat):
+def compute_TGS(xct_fiducials, ct_fiducials, output_tfm=None):
     """
     Computes the gold-standard transformation matrix using the fiducial points.
 
     Parameters
     ----------
-    xct_fiducials_flat :
-        A list of the XCT fiducial points
+    xct_fiducials : numpy.array
+        (M, 3) array of the XCT fiducial points
 
-    ct_fiducials_flat :
-        A list of the CT fiducial points
+    ct_fiducials : numpy.array
+        (M, 3) array of the CT fiducial points
+
+    output_tfm : string
+        Optional path to write the transformation to
 
     Returns
     -------
@@ -162,39 +145,61 @@ def compute_TGS(xct_fiducials_flat, ct_fiducials_flat):
     # Compute Tgs between CT and XCT
     # ------------------------------------------------------------#
     landmarkInitializer = sitk.LandmarkBasedTransformInitializerFilter()
-    landmarkInitializer.SetFixedLandmarks(xct_fiducials_flat)
-    landmarkInitializer.SetMovingLandmarks(ct_fiducials_flat)
+    landmarkInitializer.SetFixedLandmarks(np.ravel(xct_fiducials).tolist())
+    landmarkInitializer.SetMovingLandmarks(np.ravel(ct_fiducials).tolist())
     Tgs = landmarkInitializer.Execute(sitk.VersorRigid3DTransform())
 
-    sitk.WriteTransform(
-        Tgs,
-        "/Users/mkuczyns/OneDrive - University of Calgary/ManskeLabImages/DYNACT/04 - DYNACT1/reg/DYNACT1_011/staticCT_to_HR-pQCT/TGS.tfm",
-    )
+    if output_tfm is not None:
+        sitk.WriteTransform(Tgs, output_tfm)
 
     return Tgs
 
 
-def compute_FLE(rmse_fre):
+def transform_points(tfm, points):
     """
-    Computes the fiducial localization error.
+    Applies a transformation to an array of points.
 
     Parameters
     ----------
-    rmse_fre : float
+    tfm : SimpleITK.TFM
+
+    points : numpy.array
+        (N, 3) array of points
 
     Returns
     -------
-    fle : float
+    numpy.array
+        (N, 3) array of transformed points
     """
-    # Calculate the estimate of the FLE
-    Nf = 3  # Number of fiducials
+    return np.array([tfm.TransformPoint(p) for p in np.asarray(points).tolist()])
+
+
+def compute_FLE(rms_fre, Nf):
+    """
+    Computes the fiducial localization error from the expected relation
+    FRE^2 = (1 - 2 / Nf) * FLE^2.
 
-    fle = math.sqrt((Nf / (Nf - 2)) * rmse_fre)
+    Parameters
+    ----------
+    rms_fre : float or numpy.array
+
+    Nf : int
+        Number of fiducials
+
+    Returns
+    -------
+    fle : float or numpy.array
+    """
+    if Nf < 3:
+        raise ValueError("At least 3 fiducials are needed, got {}".format(Nf))
+
+    # Calculate the estimate of the FLE
+    fle = np.sqrt(Nf / (Nf - 2)) * rms_fre
 
     return fle
 
 
-def compute_FRE(T_gs, xct_centroids, ct_centroids):
+def compute_FRE(T_gs, xct_fiducials, ct_fiducials):
     """
     Computes the fiducial registration error.
 
@@ -203,11 +208,11 @@ def compute_FRE(T_gs, xct_centroids, ct_centroids):
     T_gs : SimpleITK.TFM
         The gold-standard transformation matrix
 
-    xct_centroids : list
-        List containing the XCT centroids
+    xct_fiducials : numpy.array
+        (M, 3) array of the XCT centroids
 
-    ct_centroids : list
-        List containing the CT centroids
+    ct_fiducials : numpy.array
+        (M, 3) array of the CT centroids
 
     Returns
     -------
@@ -217,95 +222,50 @@ def compute_FRE(T_gs, xct_centroids, ct_centroids):
     # Calculate the estimate of the FRE
     # Although FLE, FRE, and TRE are vector quantities, they are often
     # represented as scalar quantities by taking the RMS of the vector components
+    ct_fiducials_xct = transform_points(T_gs.GetInverse(), ct_fiducials)
+    fre = np.linalg.norm(ct_fiducials_xct - np.asarray(xct_fiducials), axis=-1)
 
-    Nf = 3  # Number of fiducials
-
-    xct_F1_centroid = xct_centroids[0]
-    xct_F2_centroid = xct_centroids[1]
-    xct_F3_centroid = xct_centroids[2]
-    ct_F1_centroid = ct_centroids[0]
-    ct_F2_centroid = ct_centroids[1]
-    ct_F3_centroid = ct_centroids[2]
-
-    ct_F1_centroid = T_gs.GetInverse().TransformPoint(ct_F1_centroid)
-    ct_F2_centroid = T_gs.GetInverse().TransformPoint(ct_F2_centroid)
-    ct_F3_centroid = T_gs.GetInverse().TransformPoint(ct_F3_centroid)
-
-    fre1 = math.sqrt(
-        (1 / Nf) * ((ct_F1_centroid[0] - xct_F1_centroid[0]) ** 2)
-        + ((ct_F1_centroid[1] - xct_F1_centroid[1]) ** 2)
-        + ((ct_F1_centroid[2] - xct_F1_centroid[2]) ** 2)
-    )
-    fre2 = math.sqrt(
-        (1 / Nf) * ((ct_F2_centroid[0] - xct_F2_centroid[0]) ** 2)
-        + ((ct_F2_centroid[1] - xct_F2_centroid[1]) ** 2)
-        + ((ct_F2_centroid[2] - xct_F2_centroid[2]) ** 2)
-    )
-    fre3 = math.sqrt(
-        (1 / Nf) * ((ct_F3_centroid[0] - xct_F3_centroid[0]) ** 2)
-        + ((ct_F3_centroid[1] - xct_F3_centroid[1]) ** 2)
-        + ((ct_F3_centroid[2] - xct_F3_centroid[2]) ** 2)
-    )
-
-    rms_fre = math.sqrt((1 / 3) * (fre1**2 + fre2**2 + fre3**2))
+    rms_fre = compute_RMSE(fre)
 
     return rms_fre
 
 
-def compute_TRE(Nf, dx, dy, dz, rms_fx, rms_fy, rms_fz, fle):
+def compute_TRE(Nf, d, rms_f, fle):
     """
-    Computes the target registration error.
+    Computes the expected target registration error:
+    TRE^2 = (FLE^2 / Nf) * (1 + (1 / 3) * sum_k(d_k^2 / f_k^2))
 
     Parameters
     ----------
     Nf : int
         Number of fiducials
 
-    dx : float
-        Distance between the PA and target (X-axis)
-
-    dy : float
-        Distance between the PA and target (Y-axis)
+    d : numpy.array
+        (..., 3) array of distances between the targets and the X, Y, and Z
+        PA
 
-    dz : float
-        Distance between the PA and target (Z-axis)
-
-    rms_fx : float
-        RMS distance of all fiducials to the PA (X-axis)
-
-    rms_fy : float
-        RMS distance of all fiducials to the PA (Y-axis)
-
-    rms_fz : float
-        RMS distance of all fiducials to the PA (Z-axis)
+    rms_f : numpy.array
+        (3,) array of RMS distances of all fiducials to the X, Y, and Z PA
 
     fle : float
         Fiducial localization error
 
     Returns
     -------
-    tre : float
+    tre : float or numpy.array
+        TRE of each target (shape of d without the last axis)
     """
-    tre = math.sqrt(
-        (1 / Nf)
-        * (
-            1
-            + (1 / 3)
-            * (
-                (dx**2) / (rms_fx**2)
-                + (dy**2) / (rms_fy**2)
-                + (dz**2) / (rms_fz**2)
-            )
-        )
-        * fle**2
-    )
+    d = np.asarray(d, dtype=float)
+    rms_f = np.asarray(rms_f, dtype=float)
+
+    tre = np.sqrt((1 / Nf) * (1 + (1 / 3) * np.sum(d**2 / rms_f**2, axis=-1)) * fle**2)
     return tre
 
 
 def compute_PA(combined_img):
     """
-    Computes the prinicpal axes (PA) for an input image. We need to convert
-    SimpleITKimages to ITK images before finding the PAs.
+    Computes the prinicpal axes (PA) for an input image from the moments of its
+    foreground voxels (see modImgProc.moments).
 
     Parameters
     ----------
@@ -313,218 +273,156 @@ def compute_PA(combined_img):
 
     Returns
     -------
-    pa : list
-        List containing the PAs
+    pa : numpy.array
+        (3, 3) array with the X, Y, and Z PA in the rows
     """
     # Compute the principal axes (PA) of the XCT fiducials (gold standard)
-    fiducial_img = sitk2itk(combined_img)
+    pa = principal_axes(combined_img)  # In physical coordinates
 
-    moments = itk.ImageMomentsCalculator.New(fiducial_img)
-    moments.Compute()
+    return pa
 
-    fiducial_img_PA = moments.GetPrincipalAxes()  # In physical coordinates
 
-    PA_x = np.array(
-        [fiducial_img_PA(0, 0), fiducial_img_PA(0, 1), fiducial_img_PA(0, 2)]
-    )
-    PA_y = np.array(
-        [fiducial_img_PA(1, 0), fiducial_img_PA(1, 1), fiducial_img_PA(1, 2)]
-    )
-    PA_z = np.array(
-        [fiducial_img_PA(2, 0), fiducial_img_PA(2, 1), fiducial_img_PA(2, 2)]
-    )
+def distance_to_axes(points, origin, axes):
+    """
+    Computes the distance of each point to each axis (line) through an origin.
 
-    pa = [PA_x, PA_y, PA_z]
+    Parameters
+    ----------
+    points : numpy.array
+        (N, 3) array of points
 
-    return pa
+    origin : numpy.array
+        (3,) point the axes pass through
 
+    axes : numpy.array
+        (K, 3) array of unit axis directions
 
-def get_distance_to_PA(T_gs, targets, PAs, F1_centroid, F2_centroid, F3_centroid):
+    Returns
+    -------
+    numpy.array
+        (N, K) array of distances
     """
-    Computes the distance between the PAs and the fiducial centroids.
+    rel = np.asarray(points, dtype=float) - np.asarray(origin, dtype=float)
+    proj = rel @ np.asarray(axes, dtype=float).T
 
-    Parameters
-    ----------
-    T_gs : SimpleITK.TFM
-        Gold standard transformation matrix
+    # Perpendicular distance from the squared length minus the squared projection
+    dist_sq = np.sum(rel**2, axis=-1)[..., np.newaxis] - proj**2
+    return np.sqrt(np.clip(dist_sq, 0, None))
 
-    targets : list
-        List of the targets
 
-    PAs : list
-        List of PAs in XCT space
+def get_distance_to_PA(targets, fiducials, PAs):
+    """
+    Computes the distance between the PAs and the targets and fiducial
+    centroids. The PAs pass through the centroid of the fiducial
+    configuration.
 
-    F1_centroid : list
-        List of centroids of the first fiducial
+    Parameters
+    ----------
+    targets : numpy.array
+        (N, 3) array of the targets in XCT space
 
-    F2_centroid : list
-        List of centroids of the second fiducial
+    fiducials : numpy.array
+        (M, 3) array of the fiducial centroids in XCT space
 
-    F3_centroid : list
-        List of centroids of the third fiducial
+    PAs : numpy.array
+        (3, 3) array of the X, Y, and Z PA in XCT space
 
     Returns
     -------
-    d : list
-        List of the RMSEs of the distances between target and PA
-
-    xct_F1_d : list
-        List of distances from the first fiducial to the PA axes
+    d : numpy.array
+        (N, 3) array of the distances from each target to the X, Y, and Z PA
 
-    xct_F2_d : list
-        List of distances from the second fiducial to the PA axes
-
-    xct_F3_d : list
-        List of distances from the third fiducial to the PA axes
+    f : numpy.array
+        (M, 3) array of the distances from each fiducial to the X, Y, and Z PA
     """
-    # Find the distance from the target to each axis of the PA (d)
-    xct_target1 = targets[0]
-    xct_target2 = targets[1]
-    xct_target3 = targets[2]
-    xctPA_x = PAs[0]
-    xctPA_y = PAs[1]
-    xctPA_z = PAs[2]
-    xct_F1_centroid = F1_centroid[0]
-    xct_F1_centroid = F1_centroid[1]
-    xct_F1_centroid = F1_centroid[2]
-    xct_F2_centroid = F2_centroid[0]
-    xct_F2_centroid = F2_centroid[1]
-    xct_F2_centroid = F2_centroid[2]
-    xct_F3_centroid = F3_centroid[0]
-    xct_F3_centroid = F3_centroid[1]
-    xct_F3_centroid = F3_centroid[2]
-
-    target1 = T_gs.GetInverse().TransformPoint(xct_target1)
-    target2 = T_gs.GetInverse().TransformPoint(xct_target2)
-    target3 = T_gs.GetInverse().TransformPoint(xct_target3)
-
-    dx1 = math.sqrt(
-        ((target1[0] - xctPA_x[0]) ** 2)
-        + ((target1[1] - xctPA_x[1]) ** 2)
-        + ((target1[2] - xctPA_x[2]) ** 2)
-    )
-    dy1 = math.sqrt(
-        ((target1[0] - xctPA_y[0]) ** 2)
-        + ((target1[1] - xctPA_y[1]) ** 2)
-        + ((target1[2] - xctPA_y[2]) ** 2)
-    )
-    dz1 = math.sqrt(
-        ((target1[0] - xctPA_z[0]) ** 2)
-        + ((target1[1] - xctPA_z[1]) ** 2)
-        + ((target1[2] - xctPA_z[2]) ** 2)
-    )
-
-    dx2 = math.sqrt(
-        ((target2[0] - xctPA_x[0]) ** 2)
-        + ((target2[1] - xctPA_x[1]) ** 2)
-        + ((target2[2] - xctPA_x[2]) ** 2)
-    )
-    dy2 = math.sqrt(
-        ((target2[0] - xctPA_y[0]) ** 2)
-        + ((target2[1] - xctPA_y[1]) ** 2)
-        + ((target2[2] - xctPA_y[2]) ** 2)
-    )
-    dz2 = math.sqrt(
-        ((target2[0] - xctPA_z[0]) ** 2)
-        + ((target2[1] - xctPA_z[1]) ** 2)
-        + ((target2[2] - xctPA_z[2]) ** 2)
-    )
+    fiducials = np.asarray(fiducials, dtype=float)
+    origin = fiducials.mean(axis=0)
 
-    dx3 = math.sqrt(
-        ((target3[0] - xctPA_x[0]) ** 2)
-        + ((target3[1] - xctPA_x[1]) ** 2)
-        + ((target3[2] - xctPA_x[2]) ** 2)
-    )
-    dy3 = math.sqrt(
-        ((target3[0] - xctPA_y[0]) ** 2)
-        + ((target3[1] - xctPA_y[1]) ** 2)
-        + ((target3[2] - xctPA_y[2]) ** 2)
-    )
-    dz3 = math.sqrt(
-        ((target3[0] - xctPA_z[0]) ** 2)
-        + ((target3[1] - xctPA_z[1]) ** 2)
-        + ((target3[2] - xctPA_z[2]) ** 2)
-    )
+    d = distance_to_axes(targets, origin, PAs)
+    f = distance_to_axes(fiducials, origin, PAs)
 
-    dx = compute_RMSE(dx1, dx2, dx3)
-    dy = compute_RMSE(dy1, dy2, dy3)
-    dz = compute_RMSE(dz1, dz2, dz3)
+    return d, f
 
-    # Find the distance from each XCT fiducial to each axis of the PA
-    xct_F1_dx = math.sqrt(
-        ((xct_F1_centroid[0] - xctPA_x[0]) ** 2)
-        + ((xct_F1_centroid[1] - xctPA_x[1]) ** 2)
-        + ((xct_F1_centroid[2] - xctPA_x[2]) ** 2)
-    )
-    xct_F1_dy = math.sqrt(
-        ((xct_F1_centroid[0] - xctPA_y[0]) ** 2)
-        + ((xct_F1_centroid[1] - xctPA_y[1]) ** 2)
-        + ((xct_F1_centroid[2] - xctPA_y[2]) ** 2)
-    )
-    xct_F1_dz = math.sqrt(
-        ((xct_F1_centroid[0] - xctPA_z[0]) ** 2)
-        + ((xct_F1_centroid[1] - xctPA_z[1]) ** 2)
-        + ((xct_F1_centroid[2] - xctPA_z[2]) ** 2)
-    )
 
-    xct_F2_dx = math.sqrt(
-        ((xct_F2_centroid[0] - xctPA_x[0]) ** 2)
-        + ((xct_F2_centroid[1] - xctPA_x[1]) ** 2)
-        + ((xct_F2_centroid[2] - xctPA_x[2]) ** 2)
-    )
-    xct_F2_dy = math.sqrt(
-        ((xct_F2_centroid[0] - xctPA_y[0]) ** 2)
-        + ((xct_F2_centroid[1] - xctPA_y[1]) ** 2)
-        + ((xct_F2_centroid[2] - xctPA_y[2]) ** 2)
-    )
-    xct_F2_dz = math.sqrt(
-        ((xct_F2_centroid[0] - xctPA_z[0]) ** 2)
-        + ((xct_F2_centroid[1] - xctPA_z[1]) ** 2)
-        + ((xct_F2_centroid[2] - xctPA_z[2]) ** 2)
-    )
+def compute_RMSE(values, axis=0):
+    """
+    Calculates the root mean square of an array of values.
 
-    xct_F3_dx = math.sqrt(
-        ((xct_F3_centroid[0] - xctPA_x[0]) ** 2)
-        + ((xct_F3_centroid[1] - xctPA_x[1]) ** 2)
-        + ((xct_F3_centroid[2] - xctPA_x[2]) ** 2)
-    )
-    xct_F3_dy = math.sqrt(
-        ((xct_F3_centroid[0] - xctPA_y[0]) ** 2)
-        + ((xct_F3_centroid[1] - xctPA_y[1]) ** 2)
-        + ((xct_F3_centroid[2] - xctPA_y[2]) ** 2)
-    )
-    xct_F3_dz = math.sqrt(
-        ((xct_F3_centroid[0] - xctPA_z[0]) ** 2)
-        + ((xct_F3_centroid[1] - xctPA_z[1]) ** 2)
-        + ((xct_F3_centroid[2] - xctPA_z[2]) ** 2)
-    )
+    Parameters
+    ----------
+    values : numpy.array
 
-    d = [dx, dy, dz]
-    xct_F1_d = [xct_F1_dx, xct_F1_dy, xct_F1_dz]
-    xct_F2_d = [xct_F2_dx, xct_F2_dy, xct_F2_dz]
-    xct_F3_d = [xct_F3_dx, xct_F3_dy, xct_F3_dz]
+    axis : int
+        Axis to average over
 
-    return d, xct_F1_d, xct_F2_d, xct_F3_d
+    Returns
+    -------
+    rmse : float or numpy.array
+    """
+    rmse = np.sqrt(np.mean(np.square(values), axis=axis))
+    return rmse
 
 
-def compute_RMSE(input1, input2, input3):
+def evaluate_TRE(xct_fiducials, ct_fiducials, xct_targets, ct_targets, PA_xct, T_r):
     """
-    Calculates the root mean square error between three inputs.
+    Computes the gold-standard transformation, FRE, FLE, and expected TRE of
+    each target, and the distance between the targets mapped with the
+    gold-standard and the intensity-based registration.
 
     Parameters
     ----------
-    input1 : float
+    xct_fiducials : numpy.array
+        (M, 3) array of the XCT fiducial centroids
+
+    ct_fiducials : numpy.array
+        (M, 3) array of the CT fiducial centroids
 
-    input2 : float
+    xct_targets : numpy.array
+        (N, 3) array of the XCT target points
 
-    input3 : float
+    ct_targets : numpy.array
+        (N, 3) array of the CT target points
+
+    PA_xct : numpy.array
+        (3, 3) array of the PA of the XCT fiducials
+
+    T_r : SimpleITK.TFM
+        Intensity-based registration
 
     Returns
     -------
-    rmse : float
+    result : dict
+        T_gs, fre, fle, tre (N,), and landmark_errors (N,)
     """
-    rmse = math.sqrt((1 / 3) * (input1**2 + input2**2 + input3**2))
-    return rmse
+    Nf = xct_fiducials.shape[0]
+    T_gs = compute_TGS(xct_fiducials, ct_fiducials)
+
+    # Calculate the TRE of the Tgs compared to the intensity-based registration (Tr)
+    transformed_ct_landmarks_Tr = transform_points(T_r, ct_targets)
+    transformed_ct_landmarks_Tgs = transform_points(T_gs, ct_targets)
+
+    errors = np.linalg.norm(
+        transformed_ct_landmarks_Tgs - transformed_ct_landmarks_Tr, axis=-1
+    )
+
+    rms_fre = compute_FRE(T_gs, xct_fiducials, ct_fiducials)
+    fle = compute_FLE(rms_fre, Nf)
+    d, f = get_distance_to_PA(xct_targets, xct_fiducials, PA_xct)
+
+    # Compute the RMS distance of all fiducials to each axis of the PA (f)
+    rms_f = compute_RMSE(f, axis=0)
+
+    # Calculate the estimate of the TRE
+    tre = compute_TRE(Nf, d, rms_f, fle)
+
+    result = {
+        "T_gs": T_gs,
+        "fre": rms_fre,
+        "fle": fle,
+        "tre": tre,
+        "landmark_errors": errors,
+    }
+    return result
 
 
 def main(image_list, fiducial_list, landmark_list, output_TGS, intensity_TFM):
@@ -536,6 +434,7 @@ def main(image_list, fiducial_list, landmark_list, output_TGS, intensity_TFM):
     image_list : list
 
     fiducial_list : list
+        XCT fiducial images followed by the matching CT fiducial images
 
     landmark_list : list
 
@@ -545,83 +444,44 @@ def main(image_list, fiducial_list, landmark_list, output_TGS, intensity_TFM):
 
     Returns
     -------
-    tre : float
+    tre : numpy.array
+        Expected TRE of each target
     """
     ct_img = sitk.ReadImage(image_list[0])
     xct_img = sitk.ReadImage(image_list[1])
-    xct_F1_img = sitk.ReadImage(fiducial_list[0])
-    xct_F2_img = sitk.ReadImage(fiducial_list[1])
-    xct_F3_img = sitk.ReadImage(fiducial_list[2])
-    ct_F1_img = sitk.ReadImage(fiducial_list[0])
-    ct_F2_img = sitk.ReadImage(fiducial_list[1])
-    ct_F3_img = sitk.ReadImage(fiducial_list[2])
+    fiducial_img_list = [sitk.ReadImage(fiducial) for fiducial in fiducial_list]
     xct_landmark_img = sitk.ReadImage(landmark_list[0], sitk.sitkUInt8)
     ct_landmarks_img = sitk.ReadImage(landmark_list[1], sitk.sitkUInt8)
     T_r = sitk.ReadTransform(intensity_TFM)
 
-    fiducial_img_list = [
-        xct_F1_img,
-        xct_F2_img,
-        xct_F3_img,
-        ct_F1_img,
-        ct_F2_img,
-        ct_F3_img,
-    ]
-
-    xct_fiducials_flat, ct_fiducials_flat, xct_targets, ct_targets = get_landmarks(
+    xct_fiducials, ct_fiducials, xct_targets, ct_targets = get_landmarks(
         xct_landmark_img, ct_landmarks_img, fiducial_img_list
     )
-    T_gs = compute_TGS(xct_fiducials_flat, ct_fiducials_flat)
+    Nf = xct_fiducials.shape[0]
 
-    # Transform CT image to XCT using Tgs
-    # sitk.Resample(imageToBeResampled, referenceImage, transformation, interpolator, defaultPixelValue, outputPixelType)
-    ct_transformed_Tgs = sitk.Resample(
-        ct_img, xct_img, T_gs, sitk.sitkLinear, 0.0, ct_img.GetPixelID()
-    )
-    sitk.WriteImage(ct_transformed_Tgs, output_TGS)
+    # Combine the marker images (binary) to get a single distribution of markers
+    combined_img_xct = fiducial_img_list[0]
+    for xct_F_img in fiducial_img_list[1:Nf]:
+        combined_img_xct = combined_img_xct + xct_F_img
 
-    # Calculate the TRE of the Tgs compared to the intensity-based registration (Tr)
-    transformed_ct_landmarks_Tr = [T_r.TransformPoint(p) for p in ct_landmarks]
-    transformed_ct_landmarks_Tgs = [T_gs.TransformPoint(p) for p in ct_landmarks]
+    PA_xct = compute_PA(combined_img_xct)
 
-    errors = [
-        (np.linalg.norm(np.array(p_fixed) - np.array(p_moving)))
-        for p_fixed, p_moving in zip(
-            transformed_ct_landmarks_Tgs, transformed_ct_landmarks_Tr
-        )
-    ]
-    min_errors = np.min(errors)
-    max_errors = np.max(errors)
+    result = evaluate_TRE(
+        xct_fiducials, ct_fiducials, xct_targets, ct_targets, PA_xct, T_r
+    )
     print(
         "TRE between gold-standard and intensity-based registration for landmarks = "
-        + str(errors)
+        + str(result["landmark_errors"].tolist())
     )
 
-    # Combine the 3 marker images (binary) to get a single distribution of markers
-    # Repeat for the CT image and XCT image
-    combined_img_xct = xct_F1_img + xct_F2_img + xct_F3_img
-    comb_img_ct = ct_F1_img + ct_F2_img + ct_F3_img
-
-    PA_xct = compute_PA(combined_img_xct)
-
-    rms_fre = compute_FRE(T_gs, xct_fiducials_flat, ct_fiducials_flat)
-    fle = compute_FLE(rms_fre)
-    d, xct_F1_d, xct_F2_d, xct_F3_d = get_distance_to_PA(
-        T_gs,
-        xct_targets,
-        PA_xct,
-        xct_fiducials_flat[0],
-        xct_fiducials_flat[1],
-        xct_fiducials_flat[2],
+    # Transform CT image to XCT using Tgs
+    # sitk.Resample(imageToBeResampled, referenceImage, transformation, interpolator, defaultPixelValue, outputPixelType)
+    ct_transformed_Tgs = sitk.Resample(
+        ct_img, xct_img, result["T_gs"], sitk.sitkLinear, 0.0, ct_img.GetPixelID()
     )
+    sitk.WriteImage(ct_transformed_Tgs, output_TGS)
 
-    # Compute the RMS distance of all fiducials to each axis of the PA (f)
-    rms_fx = compute_RMSE(xct_F1_d[0], xct_F2_d[0], xct_F3_d[0])
-    rms_fy = compute_RMSE(xct_F1_d[1], xct_F2_d[1], xct_F3_d[1])
-    rms_fz = compute_RMSE(xct_F1_d[2], xct_F2_d[2], xct_F3_d[2])
-
-    # Calculate the estimate of the TRE
-    tre = compute_TRE(3, d[0], d[1], d[2], rms_fx, rms_fy, rms_fz, fle)
+    tre = result["tre"]
 
     return tre
 
@@ -631,35 +491,43 @@ if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("ct", type=str)
     parser.add_argument("xct", type=str)
-    parser.add_argument("xct_F1", type=str)
-    parser.add_argument("xct_F2", type=str)
-    parser.add_argument("xct_F3", type=str)
-    parser.add_argument("ct_F1", type=str)
-    parser.add_argument("ct_F2", type=str)
-    parser.add_argument("ct_F3", type=str)
     parser.add_argument("xct_landmarks", type=str)
     parser.add_argument("ct_landmarks", type=str)
     parser.add_argument("output_TGS", type=str)
     parser.add_argument("intensity_TFM", type=str)
+    parser.add_argument(
+        "-x",
+        "--xct_fiducials",
+        type=str,
+        nargs="+",
+        required=True,
+        help="XCT fiducial images (binary), at least 3",
+    )
+    parser.add_argument(
+        "-c",
+        "--ct_fiducials",
+        type=str,
+        nargs="+",
+        required=True,
+        help="CT fiducial images (binary), in the same order as the XCT fiducials",
+    )
     args = parser.parse_args()
 
+    if len(args.xct_fiducials) != len(args.ct_fiducials):
+        parser.error("The number of XCT and CT fiducials must match")
+
     ct = args.ct
     xct = args.xct
-    xct_F1 = args.xct_F1
-    xct_F2 = args.xct_F2
-    xct_F3 = args.xct_F3
-    ct_F1 = args.ct_F1
-    ct_F2 = args.ct_F2
-    ct_F3 = args.ct_F3
     xct_landmarks = args.xct_landmarks
     ct_landmarks = args.ct_landmarks
     output_TGS = args.output_TGS
     intensity_TFM = args.intensity_TFM
 
     image_list = [ct, xct]
-    fiducial_list = [xct_F1, xct_F2, xct_F3, ct_F1, ct_F2, ct_F3]
+    fiducial_list = args.xct_fiducials + args.ct_fiducials
     landmark_list = [xct_landmarks, ct_landmarks]
 
     tre = main(image_list, fiducial_list, landmark_list, output_TGS, intensity_TFM)
 
-    print("TRE of gold-standard = " + str(tre))
+    print("TRE of gold-standard = " + str(tre.tolist()))
+    print("RMS TRE of gold-standard = " + str(compute_RMSE(tre)))
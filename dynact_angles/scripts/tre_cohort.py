@@ -0,0 +1,498 @@
+"""
+tre_cohort.py
+
+Created on: Oct. 18, 2026
+
+Description: Evaluates the target registration error (TRE) of every CT to XCT
+             registration listed in a cohort manifest. Registrations are
+             evaluated in parallel, and the FRE, FLE, expected TRE, and
+             landmark errors of each target are appended to an SQLite results
+             database. Fiducial centroids and moments and landmark points are
+             cached in the database per image hash, so re-running the cohort
+             only reads the images that changed. The gold-standard resampled CT
+             is only written when requested.
+
+             Each scan in the manifest lists its registrations under tre (one
+             registration or a list). Relative paths are relative to the root.
+
+Example manifest:
+  root: /path/to/phantom_study
+  scans:
+    - scan: DYNACT1_011
+      tre:
+        name: intensity
+        ct: reg/DYNACT1_011/staticCT.nii
+        xct: reg/DYNACT1_011/HR-pQCT.nii
+        xct_fiducials: [fid/xct_F1.nii, fid/xct_F2.nii, fid/xct_F3.nii]
+        ct_fiducials: [fid/ct_F1.nii, fid/ct_F2.nii, fid/ct_F3.nii]
+        xct_landmarks: fid/xct_landmarks.nii
+        ct_landmarks: fid/ct_landmarks.nii
+        intensity_tfm: reg/DYNACT1_011/staticCT_to_HR-pQCT/CT_to_XCT.tfm
+        output_tgs: reg/DYNACT1_011/staticCT_to_HR-pQCT/CT_Tgs.nii   # Optional
+
+Usage:
+  python tre_cohort.py manifest.yml [Scan ...]
+
+Optional arguments:
+  -w workers                Number of processes (default = 1)
+  -d database               Default = output/tre_results.sqlite
+  -r                        Write the gold-standard resampled CT images
+  -o output_csv             Also write the results of this run to a CSV file
+  -f format                 Also write the CSV as parquet or feather
+"""
+
+import os
+import sys
+import argparse
+import numpy as np
+import SimpleITK as sitk
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from target_reg_error import get_centroid, get_targets, evaluate_TRE
+from modImgProc.moments import image_moments, combine_moments
+from modMisc.colours import Colours
+from modMisc.cohort import read_cohort
+from modMisc.results_store import ResultsStore, file_hash
+from modMisc.table_writer import TableWriter, table_formats
+
+# Paths each registration needs
+registration_keys = [
+    "ct",
+    "xct",
+    "xct_fiducials",
+    "ct_fiducials",
+    "xct_landmarks",
+    "ct_landmarks",
+    "intensity_tfm",
+]
+
+# Columns of the results table (one row per target)
+tre_columns = [
+    "run_id",
+    "scan",
+    "registration",
+    "target",
+    "num_fiducials",
+    "fre",
+    "fle",
+    "tre",
+    "landmark_error",
+]
+
+
+def read_registrations(cohort, scans=None):
+    """
+    Lists the registrations of each scan in a cohort.
+
+    Parameters
+    ----------
+    cohort : dict
+        Output of read_cohort
+
+    scans : list
+        Only use these scans. Uses all scans if None.
+
+    Returns
+    -------
+    registration_list : list
+        [scan, name, paths] for each registration. Paths are absolute.
+    """
+    root = cohort["root"]
+
+    def full_path(p):
+        return p if os.path.isabs(p) else os.path.join(root, p)
+
+    registration_list = []
+    for scan in cohort["scans"]:
+        if scans and scan["scan"] not in scans:
+            continue
+
+        entries = scan.get("tre") or []
+        if isinstance(entries, dict):
+            entries = [entries]
+
+        for i, entry in enumerate(entries):
+            missing = [key for key in registration_keys if key not in entry]
+            if missing:
+                raise ValueError(
+                    "TRE entry {} of {} is missing {}".format(
+                        i, scan["scan"], ", ".join(missing)
+                    )
+                )
+            if len(entry["xct_fiducials"]) != len(entry["ct_fiducials"]):
+                raise ValueError(
+                    "TRE entry {} of {} has a different number of XCT and CT "
+                    "fiducials".format(i, scan["scan"])
+                )
+
+            paths = {}
+            for key in registration_keys + ["output_tgs"]:
+                if entry.get(key) is None:
+                    continue
+                if isinstance(entry[key], list):
+                    paths[key] = [full_path(p) for p in entry[key]]
+                else:
+                    paths[key] = full_path(entry[key])
+
+            name = str(entry.get("name", "reg{}".format(i + 1)))
+            registration_list.append([scan["scan"], name, paths])
+
+    return registration_list
+
+
+def registration_cache(paths, cache):
+    """
+    Hashes the fiducial and landmark images of a registration and picks their
+    entries from the cache, so a worker only receives the entries it needs.
+
+    Parameters
+    ----------
+    paths : dict
+        Paths of the registration (see read_registrations)
+
+    cache : dict
+        Output of ResultsStore.cached
+
+    Returns
+    -------
+    hashes : dict
+        Maps each fiducial and landmark image to its hash
+
+    entries : dict
+        Cache entries of these images
+    """
+    file_kinds = [(p, "fiducial") for p in paths["xct_fiducials"]]
+    file_kinds += [(p, "fiducial") for p in paths["ct_fiducials"]]
+    file_kinds += [
+        (paths[key], "landmarks") for key in ["xct_landmarks", "ct_landmarks"]
+    ]
+
+    hashes = {}
+    entries = {}
+    for file_path, kind in file_kinds:
+        if file_path not in hashes:
+            hashes[file_path] = file_hash(file_path)
+        key = (hashes[file_path], kind)
+        if key in cache:
+            entries[key] = cache[key]
+
+    return hashes, entries
+
+
+def evaluate_registration(args):
+    """
+    Evaluates the TRE of one registration. Fiducial and landmark images are
+    only read if they are not in the cache. Runs in the worker processes of
+    evaluate_cohort.
+
+    Parameters
+    ----------
+    args : list
+        Scan, registration name, paths, image hashes and cache entries (output
+        of registration_cache), and whether to write the gold-standard
+        resampled CT
+
+    Returns
+    -------
+    result : dict
+        fre, fle, tre, landmark_errors, num_fiducials, and the new cache
+        entries (cache)
+    """
+    next_scan, name, paths, hashes, cache, resample = args
+    new_cache = {}
+
+    def cached(file_path, kind, compute):
+        key = (hashes[file_path], kind)
+        if key in cache:
+            return cache[key]
+        if key not in new_cache:
+            new_cache[key] = compute(file_path)
+        return new_cache[key]
+
+    def fiducial(file_path):
+        img = sitk.ReadImage(file_path)
+        moments = image_moments(img)
+        value = {"centroid": list(get_centroid(img))}
+        for key in ["mass", "centroid", "second_moments"]:
+            value["moments_" + key] = moments[key].tolist()
+        return value
+
+    def landmarks(file_path):
+        img = sitk.ReadImage(file_path, sitk.sitkUInt8)
+        return get_targets(img).tolist()
+
+    xct_values = [cached(p, "fiducial", fiducial) for p in paths["xct_fiducials"]]
+    ct_values = [cached(p, "fiducial", fiducial) for p in paths["ct_fiducials"]]
+    xct_targets = cached(paths["xct_landmarks"], "landmarks", landmarks)
+    ct_targets = cached(paths["ct_landmarks"], "landmarks", landmarks)
+
+    # PA of the combined XCT fiducials from the moments of each fiducial
+    moments_list = [
+        {key: value["moments_" + key] for key in ["mass", "centroid", "second_moments"]}
+        for value in xct_values
+    ]
+    PA_xct = combine_moments(moments_list)["principal_axes"]
+
+    T_r = sitk.ReadTransform(paths["intensity_tfm"])
+    result = evaluate_TRE(
+        np.array([value["centroid"] for value in xct_values]),
+        np.array([value["centroid"] for value in ct_values]),
+        np.array(xct_targets),
+        np.array(ct_targets),
+        PA_xct,
+        T_r,
+    )
+
+    if resample:
+        output_tgs = paths.get("output_tgs")
+        if output_tgs is None:
+            output_tgs = os.path.splitext(paths["ct"])[0] + "_" + name + "_Tgs.nii"
+        ct_img = sitk.ReadImage(paths["ct"])
+        xct_img = sitk.ReadImage(paths["xct"])
+        ct_transformed_Tgs = sitk.Resample(
+            ct_img, xct_img, result["T_gs"], sitk.sitkLinear, 0.0, ct_img.GetPixelID()
+        )
+        print("Writing to {}".format(output_tgs))
+        sitk.WriteImage(ct_transformed_Tgs, output_tgs)
+
+    del result["T_gs"]
+    result["num_fiducials"] = len(xct_values)
+    result["cache"] = new_cache
+    return result
+
+
+def evaluate_cohort(
+    registration_list,
+    db_path,
+    workers=1,
+    resample=False,
+    output_path=None,
+    table_format=None,
+    description="",
+):
+    """
+    Evaluates the TRE of every registration and appends the results to the
+    results database as registrations finish. A failed registration is
+    reported and does not stop the others.
+
+    Parameters
+    ----------
+    registration_list : list
+        Output of read_registrations
+
+    db_path : string
+        SQLite results database
+
+    workers : int
+        Number of processes. 1 runs all registrations in this process.
+
+    resample : bool
+        Write the gold-standard resampled CT images
+
+    output_path : string
+        Optional CSV file for the results of this run
+
+    table_format : string
+        Also write the CSV as parquet or feather
+
+    description : string
+        Description of the run (e.g., the manifest)
+
+    Returns
+    -------
+    failures : list
+        [scan, registration, error] for each failed registration
+    """
+    store = ResultsStore(db_path)
+    run_id = store.new_run(description)
+    cache = store.cached()
+
+    writer = None
+    if output_path is not None:
+        table_path = None
+        if table_format is not None:
+            table_path = os.path.splitext(output_path)[0] + "." + table_format
+        writer = TableWriter(output_path, tre_columns, table_path, table_format)
+
+    print(
+        Colours.BOLD
+        + "Evaluating {} registrations (run {})...".format(
+            len(registration_list), run_id
+        )
+        + Colours.WHITE
+    )
+
+    failures = []
+
+    def finish_task(task, result, error):
+        next_scan, name = task[:2]
+        if error is not None:
+            print(
+                Colours.RED
+                + "ERROR: {} {}: {}".format(next_scan, name, error)
+                + Colours.WHITE
+            )
+            failures.append([next_scan, name, str(error)])
+            return
+
+        store.cache(result["cache"])
+        cache.update(result["cache"])
+
+        num_targets = len(result["tre"])
+        batch = {
+            "run_id": run_id,
+            "scan": next_scan,
+            "registration": name,
+            "target": list(range(1, num_targets + 1)),
+            "num_fiducials": result["num_fiducials"],
+            "fre": float(result["fre"]),
+            "fle": float(result["fle"]),
+            "tre": result["tre"].tolist(),
+            "landmark_error": result["landmark_errors"].tolist(),
+        }
+        store.append("tre_results", batch)
+        if writer is not None:
+            writer.write(batch)
+
+        print(
+            "{} {}: FRE = {:.4f}, FLE = {:.4f}, RMS TRE = {:.4f}".format(
+                next_scan,
+                name,
+                result["fre"],
+                result["fle"],
+                np.sqrt(np.mean(result["tre"] ** 2)),
+            )
+        )
+
+    def task_args(task):
+        # Hashes are computed here, so each task only carries its own entries
+        # and (when run in this process) sees the entries of earlier tasks
+        hashes, entries = registration_cache(task[2], cache)
+        return task + [hashes, entries, resample]
+
+    try:
+        if workers == 1:
+            for task in registration_list:
+                try:
+                    result, error = evaluate_registration(task_args(task)), None
+                except Exception as e:
+                    result, error = None, e
+                finish_task(task, result, error)
+        else:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                future_dict = {}
+                for task in registration_list:
+                    try:
+                        args = task_args(task)
+                    except Exception as e:
+                        finish_task(task, None, e)
+                        continue
+                    future_dict[executor.submit(evaluate_registration, args)] = task
+                for future in as_completed(future_dict):
+                    try:
+                        result, error = future.result(), None
+                    except Exception as e:
+                        result, error = None, e
+                    finish_task(future_dict[future], result, error)
+    finally:
+        store.close()
+        if writer is not None:
+            writer.close()
+
+    print("Writing to {}".format(db_path))
+    if writer is not None:
+        print("Writing to {}".format(output_path))
+        if writer.table_path is not None:
+            print("Writing to {}".format(writer.table_path))
+
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "manifest", type=str, help="Cohort manifest (YAML) with the registrations"
+    )
+    parser.add_argument(
+        "scans",
+        type=str,
+        nargs="*",
+        help="Scans to evaluate. Default = all scans in the manifest",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of registrations evaluated in parallel",
+    )
+    parser.add_argument(
+        "-d",
+        "--database",
+        type=str,
+        default=None,
+        help="SQLite results database. Default = output/tre_results.sqlite",
+    )
+    parser.add_argument(
+        "-r",
+        "--resample",
+        action="store_true",
+        help="Write the CT resampled to XCT with the gold-standard transformation",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        default=None,
+        help="Also write the results of this run to a CSV file",
+    )
+    parser.add_argument(
+        "-f",
+        "--format",
+        type=str,
+        default=None,
+        choices=table_formats,
+        help="Also write the CSV as Parquet or Feather (requires pyarrow)",
+    )
+    args = parser.parse_args()
+
+    cohort = read_cohort(args.manifest)
+
+    db_path = args.database
+    if db_path is None:
+        output_dir = os.path.join(cohort["root"], "output")
+        if not os.path.isdir(output_dir):
+            os.makedirs(output_dir)
+        db_path = os.path.join(output_dir, "tre_results.sqlite")
+
+    if args.format is not None and args.output is None:
+        parser.error("--format requires --output")
+
+    try:
+        registration_list = read_registrations(cohort, args.scans)
+    except ValueError as e:
+        print(Colours.RED + "ERROR: {}".format(e) + Colours.WHITE)
+        sys.exit(1)
+
+    failures = evaluate_cohort(
+        registration_list,
+        db_path,
+        args.workers,
+        args.resample,
+        args.output,
+        args.format,
+        os.path.abspath(args.manifest),
+    )
+
+    print()
+    if failures:
+        print(
+            Colours.RED
+            + "{} registration(s) failed:".format(len(failures))
+            + Colours.WHITE
+        )
+        for next_scan, name, error in failures:
+            print("\t {} {}: {}".format(next_scan, name, error))
+        sys.exit(1)
+
+    print(Colours.BOLD + "Done!")
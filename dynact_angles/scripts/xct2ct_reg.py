@@ -18,6 +18,15 @@ import os
 import argparse
 import SimpleITK as sitk
 
+from modImgProc.reference_context import (
+    ReferenceContext,
+    multi_resolution_registration,
+)
+
+# Multi-resolution pyramid used for the registration
+shrink_factors = [4, 2, 1]
+smoothing_sigmas = [2, 1, 0]
+
 
 def command_iteration(method):
     """
@@ -107,7 +116,7 @@ def initialize_registration(fixed_landmarks, moving_landmarks):
     return ref_transform
 
 
-def image_registration(fixed_img, moving_img, ref_transform):
+def image_registration(fixed_img, moving_img, ref_transform, context=None):
     """
     Function to perform the image registration.
 
@@ -119,50 +128,55 @@ def image_registration(fixed_img, moving_img, ref_transform):
 
     ref_transform : SimpleITK.TFM
 
+    context : modImgProc.ReferenceContext
+        Precomputed pyramid of the moving image. Pass the same context when
+        registering one moving image to several fixed images. Built from
+        moving_img if None.
+
     Returns
     -------
     final_transform : SimpleITK.TFM
     """
-    # Set up registration
-    reg = sitk.ImageRegistrationMethod()
+    if context is None:
+        context = ReferenceContext(moving_img, shrink_factors, smoothing_sigmas)
+
+    # Set up registration for each resolution level
+    def level_registration(level):
+        reg = sitk.ImageRegistrationMethod()
 
-    # Similarity metric settings:
-    reg.SetMetricAsMattesMutualInformation(numberOfHistogramBins=50)
-    reg.SetMetricSamplingStrategy(reg.RANDOM)
-    reg.SetMetricSamplingPercentage(0.01)
+        # Similarity metric settings:
+        reg.SetMetricAsMattesMutualInformation(numberOfHistogramBins=50)
+        reg.SetMetricSamplingStrategy(reg.RANDOM)
+        reg.SetMetricSamplingPercentage(0.01)
 
-    # Set Interpolator
-    reg.SetInterpolator(sitk.sitkLinear)
+        # Set Interpolator
+        reg.SetInterpolator(sitk.sitkLinear)
 
-    # Optimizer settings.
-    reg.SetOptimizerAsPowell(numberOfIterations=300, valueTolerance=1e-18)
-    reg.SetOptimizerScalesFromPhysicalShift()
+        # Optimizer settings.
+        reg.SetOptimizerAsPowell(numberOfIterations=300, valueTolerance=1e-18)
+        reg.SetOptimizerScalesFromPhysicalShift()
 
-    # Setup for the multi-resolution framework.
-    reg.SetShrinkFactorsPerLevel(shrinkFactors=[4, 2, 1])
-    reg.SetSmoothingSigmasPerLevel(smoothingSigmas=[2, 1, 0])
-    reg.SmoothingSigmasAreSpecifiedInPhysicalUnitsOn()
+        reg.AddCommand(sitk.sitkIterationEvent, lambda: command_iteration(reg))
 
-    reg.AddCommand(sitk.sitkIterationEvent, lambda: command_iteration(reg))
+        return reg
 
     # Perform the registration
-    # Don't optimize in-place, we would possibly like to run this cell multiple times.
-    reg.SetInitialTransform(ref_transform, inPlace=False)
     print("Start registration")
-
-    # registration.Execute(fixedImage, movingImage)
-    final_transform = reg.Execute(fixed_img, moving_img)
-    print("Final metric value: {0}".format(reg.GetMetricValue()))
-    print(
-        "Optimizer's stopping condition, {0}".format(
-            reg.GetOptimizerStopConditionDescription()
-        )
+    final_transform, level_iterations = multi_resolution_registration(
+        level_registration, ref_transform, fixed_img, context
     )
+    print("Optimizer iterations: {0}".format(sum(level_iterations)))
 
     return final_transform
 
 
-def main(fixed_landmarks_path, moving_landmarks_path, fixed_img_path, moving_img_path):
+def main(
+    fixed_landmarks_path,
+    moving_landmarks_path,
+    fixed_img_path,
+    moving_img_path,
+    moving_img_tmat_path,
+):
     """
     Main function to start the registration process.
 
@@ -176,6 +190,9 @@ def main(fixed_landmarks_path, moving_landmarks_path, fixed_img_path, moving_img
 
     moving_img_path : string
 
+    moving_img_tmat_path : string
+        Output path of the final transform
+
     Returns
     -------
     moving_resampled : SimpleITK.Image
@@ -278,7 +295,11 @@ if __name__ == "__main__":
     moving_img_tmat_path = os.path.join(output_path, scan + "_" + bone + "_REG.tfm")
 
     moving_resampled = main(
-        fixed_landmarks_path, moving_landmarks_path, fixed_img_path, moving_img_path
+        fixed_landmarks_path,
+        moving_landmarks_path,
+        fixed_img_path,
+        moving_img_path,
+        moving_img_tmat_path,
     )
 
     print("Writing to {}".format(moving_img_registered_path))
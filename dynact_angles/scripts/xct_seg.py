@@ -6,15 +6,51 @@ Created on:   Jan. 11, 2021
 """
 
 import os
-import sys
+import shutil
 import argparse
-import numpy as np
+import tempfile
+import yaml
 import SimpleITK as sitk
-
-# Some global variables for debugging
-debug = False
-output_path_debug = os.path.getcwd()
-bone_debug = ""
+from concurrent.futures import ThreadPoolExecutor
+
+from modImgProc.roi import apply_in_bounding_boxes
+from modImgProc.slab_filter import filter_slabs
+from modImgProc.stage_graph import StageGraph
+
+default_config_path = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "xct_seg.yml"
+)
+
+# Stages of the segmentation, in the order they run. The shared stages run once
+# per image and the bone stages once per bone.
+shared_stage_names = ["threshold", "median"]
+bone_stage_names = [
+    "open",
+    "close",
+    "fill",
+    "connected",
+    "final_close",
+    "final_fill",
+    "final_median",
+]
+stage_names = shared_stage_names + bone_stage_names
+
+# Kernels set for each bone in the config
+bone_kernel_names = [
+    "open_kernel",
+    "close_kernel",
+    "final_closing_kernel",
+    "final_median_kernel",
+]
+
+# Ways to choose the connected component kept as the bone: rank by size (1 =
+# largest) or a seed point (physical coordinates) inside the bone
+component_selectors = ["rank", "seed"]
+
+# Ways to restrict the morphology to the bone: bbox runs each stage inside the
+# padded bounding box of all of the foreground, blobs inside the padded box of
+# each connected component
+roi_modes = ["bbox", "blobs"]
 
 
 def xct_threshold(img, lower_thresh, upper_thresh):
@@ -35,16 +71,12 @@ def xct_threshold(img, lower_thresh, upper_thresh):
     """
     print("Running global threshold...")
     seg = sitk.BinaryThresholdImageFilter()
-    seg.SetLower_thresh(lower_thresh)
-    seg.SetUpper_thresh(upper_thresh)
+    seg.SetLowerThreshold(lower_thresh)
+    seg.SetUpperThreshold(upper_thresh)
     seg.SetOutsideValue(0)
     seg.SetInsideValue(1)
     seg_img = seg.Execute(img)
 
-    if debug:
-        output_img_path = os.path.join(output_path_debug, str(bone_debug) + "_SEG.nii")
-        sitk.WriteImage(seg_img, output_img_path)
-
     return seg_img
 
 
@@ -68,12 +100,6 @@ def xct_binary_median_filter(img, kernel=[3, 3, 3]):
     filt.SetRadius(kernel)
     filtered_img = filt.Execute(img)
 
-    if debug:
-        output_img_path = os.path.join(
-            output_path_debug, str(bone_debug) + "_FILTER.nii"
-        )
-        sitk.WriteImage(filtered_img, output_img_path)
-
     return filtered_img
 
 
@@ -94,10 +120,6 @@ def xct_binary_open(img, kernel):
     print("Applying binary opening operation...")
     open_img = sitk.BinaryOpeningByReconstruction(img, kernel)
 
-    if debug:
-        output_img_path = os.path.join(output_path_debug, str(bone_debug) + "_OPEN.nii")
-        sitk.WriteImage(open_img, output_img_path)
-
     return open_img
 
 
@@ -118,16 +140,10 @@ def xct_binary_close(img, kernel):
     print("Applying binary closing operation...")
     close_img = sitk.BinaryClosingByReconstruction(img, kernel)
 
-    if debug:
-        output_img_path = os.path.join(
-            output_path_debug, str(bone_debug) + "_CLOSE.nii"
-        )
-        sitk.WriteImage(close_img, output_img_path)
-
     return close_img
 
 
-def xct_binary_fill_holes(img, output_path):
+def xct_binary_fill_holes(img):
     """
     Runs a hole filling operation on a binary image.
 
@@ -144,24 +160,26 @@ def xct_binary_fill_holes(img, output_path):
     fill.SetForegroundValue(1)
     fill_img = fill.Execute(img)
 
-    if debug:
-        output_img_path = os.path.join(
-            output_path_debug, str(bone_debug) + "_FILLHOLE.nii"
-        )
-        sitk.WriteImage(fill_img, output_img_path)
-
     return fill_img
 
 
-def xct_connected_comp(img, output_path):
+def xct_connected_comp(img, rank=1, seed=None):
     """
-    Runs a connected component operation on a binary image and returns the largest
-    component (assumed to be the bone of interest).
+    Runs a connected component operation on a binary image and returns one
+    component: the component containing the seed point, or the component of
+    the given size rank (by default the largest).
 
     Parameters
     ----------
     img : SimpleITK.Image
 
+    rank : int
+        Size rank of the component to keep (1 = largest). Not used if a seed
+        point is given.
+
+    seed : list
+        Physical point [x, y, z] inside the bone of interest
+
     Returns
     -------
     one_label_img : SimpleITK.Image
@@ -178,16 +196,37 @@ def xct_connected_comp(img, output_path):
     print("Found {0} labels...".format(relabel.GetNumberOfObjects()))
     print(relabel.GetSizeOfObjectsInPixels())
 
-    if debug:
-        output_img_path = os.path.join(
-            output_path_debug, str(bone_debug) + "_RELABEL.nii"
+    if seed is not None:
+        index = relabel_img.TransformPhysicalPointToIndex([float(x) for x in seed])
+        size = relabel_img.GetSize()
+        label = 0
+        if all(0 <= index[i] < size[i] for i in range(len(size))):
+            label = relabel_img[index]
+        if label == 0:
+            raise ValueError(
+                "Seed point {} is not inside a connected component".format(seed)
+            )
+    else:
+        label = int(rank)
+        if not 1 <= label <= relabel.GetNumberOfObjects():
+            raise ValueError(
+                "Cannot keep component {} of {} components".format(
+                    label, relabel.GetNumberOfObjects()
+                )
+            )
+
+    # Labels are sorted by size, so the label is also the size rank. Printing the
+    # size of the kept component makes a swap of bones visible in the log.
+    print(
+        "Keeping component {} of {} ({} voxels)...".format(
+            label,
+            relabel.GetNumberOfObjects(),
+            relabel.GetSizeOfObjectsInPixels()[label - 1],
         )
-        sitk.WriteImage(relabel_img, output_img_path)
-
-    print("Removing extra labels...")
+    )
     one_label = sitk.BinaryThresholdImageFilter()
-    one_label.SetLower_thresh(1)
-    one_label.SetUpper_thresh(1)
+    one_label.SetLowerThreshold(label)
+    one_label.SetUpperThreshold(label)
     one_label.SetOutsideValue(0)
     one_label.SetInsideValue(1)
     one_label_img = one_label.Execute(relabel_img)
@@ -195,61 +234,603 @@ def xct_connected_comp(img, output_path):
     return one_label_img
 
 
-def main(input_path, lower_thresh, upper_thresh, clean_output, final_closing_kernel):
+# Filters that can run inside bounding boxes, by name
+roi_filter_dict = {
+    function.__name__: function
+    for function in [
+        xct_binary_median_filter,
+        xct_binary_open,
+        xct_binary_close,
+        xct_binary_fill_holes,
+        xct_connected_comp,
+    ]
+}
+
+
+def xct_roi_filter(img, filter_name, roi="bbox", **params):
     """
-    Main function to run the segmentation process.
+    Runs one of the morphology filters only inside the bounding box(es) of the
+    foreground of a binary image and pastes the result into a full-size image.
+    The boxes are padded by the kernel radius plus one voxel, so the result is
+    the same as running the filter on the whole image.
 
     Parameters
     ----------
-    input_path : string
+    img : SimpleITK.Image
+
+    filter_name : string
+        Name of the filter function (e.g., xct_binary_open)
+
+    roi : string
+        bbox or blobs. Connected components always use one box around all of
+        the foreground, since the component is chosen over the whole image.
+
+    params : dict
+        Arguments of the filter
+
+    Returns
+    -------
+    SimpleITK.Image
+    """
+    function = roi_filter_dict[filter_name]
+    margin = [int(r) + 1 for r in params.get("kernel", [0, 0, 0])]
+    per_component = roi == "blobs" and function is not xct_connected_comp
+
+    return apply_in_bounding_boxes(
+        lambda sub_img: function(sub_img, **params), img, margin, per_component
+    )
+
+
+def read_config(config_path=None):
+    """
+    Reads the shared settings and the per-bone kernels and components. A bone
+    without a component keeps the largest one (rank 1).
+
+    Parameters
+    ----------
+    config_path : string
+        Path to the YAML config. Uses xct_seg.yml beside this script if None.
+
+    Returns
+    -------
+    config : dict
+        shared settings ("shared") and the kernels and component of each bone
+        ("bones")
+    """
+    if config_path is None:
+        config_path = default_config_path
+
+    with open(config_path, "r") as f:
+        config = yaml.safe_load(f) or {}
+
+    config.setdefault("shared", {})
+    config["shared"].setdefault("median_kernel", [3, 3, 3])
+    config.setdefault("bones", {})
+    for bone, kernels in config["bones"].items():
+        missing = [name for name in bone_kernel_names if name not in kernels]
+        if missing:
+            raise ValueError(
+                "Bone {} in {} is missing {}".format(
+                    bone, config_path, ", ".join(missing)
+                )
+            )
+
+        component = kernels.setdefault("component", {"rank": 1})
+        if len(component) != 1 or list(component)[0] not in component_selectors:
+            raise ValueError(
+                "Component of bone {} in {} must have one of: {}".format(
+                    bone, config_path, ", ".join(component_selectors)
+                )
+            )
+
+    return config
+
+
+def add_stage(graph, name, function, input_name, params, skip=False, roi=None):
+    """
+    Adds one segmentation stage to a stage graph, restricted to bounding boxes
+    of the bone if requested. If the graph already has a stage with the same
+    function, input, and parameters (e.g., the same stage of another bone),
+    that stage is used instead, so it only runs once.
+
+    Parameters
+    ----------
+    graph : StageGraph
 
-    output_path : string
+    name : string
+
+    function : function
+
+    input_name : string
+
+    params : dict
+
+    skip : bool
+
+    roi : string
+        bbox, blobs, or None (whole image). The threshold always uses the
+        whole image.
+
+    Returns
+    -------
+    string
+        Name of the stage (or of the existing stage that is used instead)
+    """
+    if roi is not None and function is not xct_threshold:
+        params = dict(params, filter_name=function.__name__, roi=roi)
+        function = xct_roi_filter
+
+    for stage in graph.stages.values():
+        if (
+            stage.function is function
+            and stage.inputs == [input_name]
+            and stage.params == params
+            and stage.skip == skip
+        ):
+            return stage.name
+
+    graph.add_stage(name, function, [input_name], params, skip)
+
+    return name
+
+
+def add_shared_stages(
+    graph, source, lower_thresh, upper_thresh, median_kernel, skip=[], roi=None
+):
+    """
+    Adds the threshold and median stages shared by all bones to a stage graph.
+
+    Parameters
+    ----------
+    graph : StageGraph
+
+    source : string
+        Name of the grayscale image in the graph
 
     lower_thresh : int
 
     upper_thresh : int
 
-    clean_output : string
+    median_kernel : list
 
-    final_closing_kernel : list
+    skip : list
+        Names of stages to skip (their input is passed through)
+
+    roi : string
+        Run the median filter inside bounding boxes of the bone (bbox or
+        blobs). Uses the whole image if None.
 
     Returns
     -------
-    final_img : SimpleITK.Image
+    string
+        Name of the last shared stage
+    """
+    threshold_params = {"lower_thresh": lower_thresh, "upper_thresh": upper_thresh}
+    input_name = add_stage(
+        graph, "threshold", xct_threshold, source, threshold_params, "threshold" in skip
+    )
+    input_name = add_stage(
+        graph,
+        "median",
+        xct_binary_median_filter,
+        input_name,
+        {"kernel": list(median_kernel)},
+        "median" in skip,
+        roi,
+    )
+
+    return input_name
+
+
+def stream_shared_stages(
+    graph,
+    shared_stage,
+    input_path,
+    lower_thresh,
+    upper_thresh,
+    median_kernel,
+    slab_size,
+    skip=[],
+    tmp_dir=None,
+):
     """
-    img = sitk.ReadImage(input_path)
+    Runs the threshold and median filter in z-slabs so the grayscale image is
+    never fully in memory, and adds the result to a stage graph as a source.
+    With a cache directory, the result is written as the cached output of the
+    median stage (and reused if it is already there). Otherwise it is written
+    to tmp_dir as <name>_MEDIAN.mha.
+
+    Parameters
+    ----------
+    graph : StageGraph
 
-    # Threshold
-    seg_img = xct_threshold(img, lower_thresh, upper_thresh)
+    shared_stage : string
+        Name of the last shared stage (see add_shared_stages)
 
-    # Median filter
-    filter_img = xct_binary_median_filter(seg_img)
+    input_path : string
+
+    lower_thresh : int
+
+    upper_thresh : int
 
-    # Open and close
-    cleaned_thresh_img = xct_binary_open(filter_img, [15, 15, 3])
-    cleaned_thresh_img = xct_binary_close(cleaned_thresh_img, [3, 3, 3])
+    median_kernel : list
 
-    # Fill holes
-    fill_img = xct_binary_fill_holes(cleaned_thresh_img)
+    slab_size : int
+        Number of slices filtered at once
 
-    # Write out image and check if bones are connected (manually)
-    sitk.WriteImage(fill_img, clean_output)
-    input("Press Enter to continue...")
-    fill_img = sitk.ReadImage(clean_output)
+    skip : list
+        Names of stages to skip
 
-    # Connected Components
-    single_comp = xct_connected_comp(fill_img)
+    tmp_dir : string
+        Directory for the filtered image when there is no cache directory. The
+        caller removes it once the segmentation is done.
+
+    Returns
+    -------
+    string
+        Name of the source to use as the input of the bone stages
+    """
+    if graph.cache_dir is not None:
+        output_path = graph.cache_path(shared_stage)
+    else:
+        if tmp_dir is None:
+            raise ValueError("Streaming without a cache directory needs tmp_dir")
+        base_name = os.path.basename(input_path).split(".")[0]
+        output_path = os.path.join(tmp_dir, base_name + "_MEDIAN.mha")
 
-    # Close
-    close_img = xct_binary_close(single_comp, final_closing_kernel)
+    def threshold_median(slab_img):
+        if "threshold" not in skip:
+            slab_img = xct_threshold(slab_img, lower_thresh, upper_thresh)
+        if "median" not in skip:
+            slab_img = xct_binary_median_filter(slab_img, median_kernel)
+        return slab_img
 
-    # Fill holes
-    fill_img2 = xct_binary_fill_holes(close_img)
+    if graph.cache_dir is None or not graph.is_cached(shared_stage):
+        # The median filter needs its z-radius of neighbouring slices
+        halo = 0 if "median" in skip else int(median_kernel[2])
+        filter_slabs(input_path, output_path, threshold_median, slab_size, halo)
 
-    # Median filter
-    final_img = xct_binary_median_filter(fill_img2)
+    graph.add_source(shared_stage + "_slabs", output_path)
 
-    return final_img
+    return shared_stage + "_slabs"
+
+
+def add_bone_stages(graph, bone, input_name, kernels, skip=[], roi=None):
+    """
+    Adds the segmentation stages of one bone to a stage graph. The stages are
+    named <bone>/<stage>. Stages that are the same as those of a bone added
+    earlier (same kernels up to that stage) are shared with that bone and keep
+    its name.
+
+    Parameters
+    ----------
+    graph : StageGraph
+
+    bone : string
+
+    input_name : string
+        Name of the last shared stage
+
+    kernels : dict
+        Kernels and component of the bone (see xct_seg.yml)
+
+    skip : list
+        Names of stages to skip (their input is passed through)
+
+    roi : string
+        Run the stages inside bounding boxes of the bone (bbox or blobs). Uses
+        the whole image if None.
+
+    Returns
+    -------
+    stage_dict : dict
+        Maps each bone stage (e.g., fill) to its name in the graph
+    """
+    stage_list = [
+        ["open", xct_binary_open, {"kernel": list(kernels["open_kernel"])}],
+        ["close", xct_binary_close, {"kernel": list(kernels["close_kernel"])}],
+        ["fill", xct_binary_fill_holes, {}],
+        ["connected", xct_connected_comp, dict(kernels["component"])],
+        [
+            "final_close",
+            xct_binary_close,
+            {"kernel": list(kernels["final_closing_kernel"])},
+        ],
+        ["final_fill", xct_binary_fill_holes, {}],
+        [
+            "final_median",
+            xct_binary_median_filter,
+            {"kernel": list(kernels["final_median_kernel"])},
+        ],
+    ]
+
+    stage_dict = {}
+    for name, function, params in stage_list:
+        input_name = add_stage(
+            graph, bone + "/" + name, function, input_name, params, name in skip, roi
+        )
+        stage_dict[name] = input_name
+
+    return stage_dict
+
+
+def component_sizes(img):
+    """
+    Finds the sizes of the connected components of a binary image.
+
+    Parameters
+    ----------
+    img : SimpleITK.Image
+
+    Returns
+    -------
+    list
+        Number of voxels in each component, largest first
+    """
+    relabel = sitk.RelabelComponentImageFilter()
+    relabel.SortByObjectSizeOn()
+    relabel.Execute(sitk.ConnectedComponent(img))
+
+    return list(relabel.GetSizeOfObjectsInPixels())
+
+
+def qa_report(
+    graph, bone, stage_dict, report_path, clean_output=None, num_components=5
+):
+    """
+    Writes a QA report of a segmentation run (YAML). The report replaces the
+    manual check of the cleaned image: it lists the status and run time of
+    each stage and the largest connected components of the cleaned image
+    (before connected components), so scans where the bones are still
+    connected can be found after a batch run.
+
+    Parameters
+    ----------
+    graph : StageGraph
+        Graph that has been run
+
+    bone : string
+
+    stage_dict : dict
+        Stages of the bone (output of add_bone_stages)
+
+    report_path : string
+
+    clean_output : string
+        Also write the cleaned image here for visual inspection
+
+    num_components : int
+        Number of components listed in the report
+    """
+    clean_img = graph.result(stage_dict["fill"])
+    if clean_output is not None:
+        print("Writing to {}".format(clean_output))
+        sitk.WriteImage(clean_img, clean_output)
+
+    sizes = component_sizes(clean_img)
+    final_sizes = component_sizes(graph.result(stage_dict[stage_names[-1]]))
+
+    report = {
+        "input": list(graph.sources.values()),
+        "bone": bone,
+        "stages": [
+            record
+            for record in graph.records
+            if record["stage"] in graph.sources
+            or record["stage"] in shared_stage_names
+            or record["stage"] in stage_dict.values()
+        ],
+        "clean_image": {
+            "components": len(sizes),
+            "largest_components": [int(size) for size in sizes[:num_components]],
+            # Separate bones give a second component of similar size. A value
+            # near 0 can mean the bones are still connected.
+            "second_to_largest": (
+                float(sizes[1]) / sizes[0] if len(sizes) > 1 else 0.0
+            ),
+        },
+        "final_image": {
+            "components": len(final_sizes),
+            "voxels": int(sum(final_sizes)),
+        },
+    }
+
+    print("Writing to {}".format(report_path))
+    with open(report_path, "w") as f:
+        yaml.safe_dump(report, f, default_flow_style=False, sort_keys=False)
+
+
+def main(
+    input_path,
+    lower_thresh,
+    upper_thresh,
+    bones=None,
+    config_path=None,
+    cache_dir=None,
+    skip=[],
+    roi=None,
+    workers=None,
+    report_dir=None,
+    slab_size=None,
+):
+    """
+    Main function to run the segmentation process. The image is read, and the
+    threshold and median filter are run, once for all bones. Bone stages with
+    the same kernels (e.g., the opening and closing before the component of
+    each bone is chosen) also run once. The remaining bone-specific stages then
+    run concurrently on separate threads. No user input is needed, so whole
+    cohorts can be segmented unattended. Checks of the cleaned image are
+    written to an optional QA report instead.
+
+    Parameters
+    ----------
+    input_path : string
+
+    lower_thresh : int
+
+    upper_thresh : int
+
+    bones : list
+        Bones to segment. Default = all bones in the config.
+
+    config_path : string
+        Shared settings and per-bone kernels and components. Default =
+        xct_seg.yml
+
+    cache_dir : string
+        Directory for the cached stage outputs. Finished stages are loaded from
+        here when the segmentation is re-run. Nothing is cached if None. Keys
+        are built from the stage function names and parameters, not their code,
+        so clear the cache after changing a filter. Superseded outputs are not
+        removed.
+
+    skip : list
+        Names of stages to skip
+
+    roi : string
+        Run the morphology inside bounding boxes of the bone (bbox or blobs)
+        instead of the whole image
+
+    workers : int
+        Number of bones segmented at once. Default = all bones.
+
+    report_dir : string
+        Write a QA report (<bone>_SEG_QA.yml) and the cleaned image
+        (<bone>_CLEAN_IMAGE.nii) of each bone here
+
+    slab_size : int
+        Run the threshold and median filter on slabs of this many slices,
+        streamed from the input file, instead of reading the whole grayscale
+        image. Use for images too large for memory. Without a cache directory,
+        the filtered image is written to a temporary directory that is removed
+        when the segmentation is done.
+
+    Returns
+    -------
+    final_dict : dict
+        Final segmentation (SimpleITK.Image) of each bone
+    """
+    config = read_config(config_path)
+    if bones is None:
+        bones = list(config["bones"])
+    unknown = [bone for bone in bones if bone not in config["bones"]]
+    if unknown:
+        raise ValueError(
+            "No kernels for bone(s) {}. Options are: {}".format(
+                ", ".join(unknown), ", ".join(config["bones"])
+            )
+        )
+
+    graph = StageGraph(cache_dir)
+    graph.add_source("image", input_path)
+    shared_stage = add_shared_stages(
+        graph,
+        "image",
+        lower_thresh,
+        upper_thresh,
+        config["shared"]["median_kernel"],
+        skip,
+        roi,
+    )
+    tmp_dir = None
+    if slab_size is not None and cache_dir is None:
+        tmp_dir = tempfile.mkdtemp(prefix="xct_seg_")
+
+    try:
+        if slab_size is not None:
+            shared_stage = stream_shared_stages(
+                graph,
+                shared_stage,
+                input_path,
+                lower_thresh,
+                upper_thresh,
+                config["shared"]["median_kernel"],
+                slab_size,
+                skip,
+                tmp_dir,
+            )
+
+        bone_stage_dict = {}
+        target_dict = {}
+        for bone in bones:
+            stage_dict = add_bone_stages(
+                graph, bone, shared_stage, config["bones"][bone], skip, roi
+            )
+            bone_stage_dict[bone] = stage_dict
+            target_dict[bone] = [stage_dict[stage_names[-1]]]
+            if report_dir is not None:
+                target_dict[bone].append(stage_dict["fill"])
+
+        # Compute all keys (and hash the input) before the threads start
+        for targets in target_dict.values():
+            for name in targets:
+                graph.key(name)
+
+        # Bones with the same connected components key keep the same component
+        # of the same image, so they would get the same segmentation
+        if "connected" not in skip:
+            connected_dict = {}
+            for bone in bones:
+                key = graph.key(bone_stage_dict[bone]["connected"])
+                if key in connected_dict:
+                    raise ValueError(
+                        "Bones {} and {} select the same connected component. Set "
+                        "a different component for each bone in the config".format(
+                            connected_dict[key], bone
+                        )
+                    )
+                connected_dict[key] = bone
+
+        # Stages needed by more than one bone are run (or read) once before the
+        # threads start. Of these, only the ones used by a bone-specific stage (or
+        # that are targets) are kept in memory while the bones run.
+        plan_dict = {bone: graph.plan(target_dict[bone]) for bone in bones}
+        num_bones = {}
+        for plan in plan_dict.values():
+            for name in plan:
+                num_bones[name] = num_bones.get(name, 0) + 1
+
+        shared_list = []
+        for bone in bones:
+            bone_only = [
+                name
+                for name in plan_dict[bone]
+                if name in graph.stages and num_bones[name] == 1
+            ]
+            for name in plan_dict[bone]:
+                if num_bones[name] == 1 or name in shared_list:
+                    continue
+                if name in target_dict[bone] or any(
+                    name in graph.stages[other].inputs for other in bone_only
+                ):
+                    shared_list.append(name)
+        if shared_list:
+            graph.run(shared_list)
+
+        def segment_bone(bone):
+            images = graph.run(target_dict[bone])
+            if report_dir is not None:
+                qa_report(
+                    graph,
+                    bone,
+                    bone_stage_dict[bone],
+                    os.path.join(report_dir, bone + "_SEG_QA.yml"),
+                    os.path.join(report_dir, bone + "_CLEAN_IMAGE.nii"),
+                )
+            return images[target_dict[bone][0]]
+
+        if workers is None:
+            workers = len(bones)
+        with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+            final_list = list(executor.map(segment_bone, bones))
+        for name in shared_list:
+            graph.release(name)
+
+    finally:
+        if tmp_dir is not None:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    return dict(zip(bones, final_list))
 
 
 if __name__ == "__main__":
@@ -258,42 +839,101 @@ if __name__ == "__main__":
     parser.add_argument("input_img_path", help="The input image file path")
     parser.add_argument("lower_thresh", default=3000, type=float)
     parser.add_argument("upper_thresh", default=15000, type=float)
-    parser.add_argument("-d", "--debug", nargs="?", type=bool, default=False)
+    parser.add_argument(
+        "-b",
+        "--bones",
+        type=str,
+        nargs="+",
+        default=None,
+        help="Bones to segment. Default = all bones in the config",
+    )
+    parser.add_argument(
+        "-k",
+        "--config",
+        type=str,
+        default=None,
+        help="Segmentation config (YAML) with the kernels of each bone. "
+        "Default = xct_seg.yml",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=None,
+        help="Number of bones segmented at once. Default = all bones",
+    )
+    parser.add_argument(
+        "-c",
+        "--cache_dir",
+        type=str,
+        default=None,
+        help="Cache the stage outputs in this directory (e.g., seg_cache) so a "
+        "re-run resumes at the first missing stage. Cache keys use the filter "
+        "function names and parameters only, so delete the directory after "
+        "editing a filter's code. Old outputs are never pruned. Default = no cache",
+    )
+    parser.add_argument(
+        "-s",
+        "--skip",
+        type=str,
+        nargs="+",
+        default=[],
+        choices=stage_names,
+        help="Stages to skip",
+    )
+    parser.add_argument(
+        "-q",
+        "--qa",
+        action="store_true",
+        help="Write a QA report and the cleaned image of each bone for inspection",
+    )
+    parser.add_argument(
+        "-r",
+        "--roi",
+        type=str,
+        default=None,
+        choices=roi_modes,
+        help="Run the morphology inside the padded bounding box of the thresholded "
+        "bone (bbox) or of each connected blob (blobs) instead of the whole image",
+    )
+    parser.add_argument(
+        "-z",
+        "--slab_size",
+        type=int,
+        default=None,
+        help="Threshold and median filter the image in slabs of this many slices "
+        "to bound memory use on large scans",
+    )
     args = parser.parse_args()
 
     # Parse arguments
     input_img_path = args.input_img_path
     lower_thresh = args.lower_thresh
     upper_thresh = args.upper_thresh
-    debug = args.debug
 
-    output_path = os.path.dirname(input_img_path)
+    output_path = os.path.dirname(os.path.abspath(input_img_path))
 
-    if debug:
-        output_path_debug = output_path
-        if "MC1" in input_img_path:
-            bone_debug = "MC1"
-        else:
-            bone_debug = "TRP"
-
-    if "MC1" in input_img_path:
-        final_closing_kernel = [27, 27, 3]
-        clean_output = os.path.join(output_path, "MC1_CLEAN_IMAGE.nii")
-        output_img = os.path.join(output_path, "MC1_SEG.nii")
-    else:
-        final_closing_kernel = [19, 19, 3]
-        clean_output = os.path.join(output_path, "TRP_CLEAN_IMAGE.nii")
-        output_img = os.path.join(output_path, "TRP_SEG.nii")
+    report_dir = None
+    if args.qa:
+        report_dir = output_path
 
-    final_img = main(
+    final_dict = main(
         input_img_path,
-        output_path,
         lower_thresh,
         upper_thresh,
-        clean_output,
-        final_closing_kernel,
+        args.bones,
+        args.config,
+        args.cache_dir,
+        args.skip,
+        args.roi,
+        args.workers,
+        report_dir,
+        args.slab_size,
     )
 
-    # Write out the final image
+    # Write out the final images
     print("Writing out final segmentation...")
-    sitk.WriteImage(final_img, output_img)
+    for bone, final_img in final_dict.items():
+        output_img = os.path.join(output_path, bone + "_SEG.nii")
+        print("Writing to {}".format(output_img))
+        sitk.WriteImage(final_img, output_img)